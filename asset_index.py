@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Asset Index - index ชื่อเครื่องของ Snip IT (IT Parcel) แบบกะทัดรัด
+ใช้ทั้งตอนจับคู่ผู้รับผิดชอบในรายงานรายวัน และการค้นหาใน fetch_snipit_devices.py
+
+- index เฉพาะ field ที่กำหนด (SNIPIT_INDEX_FIELDS) ไม่ใช่ทุก custom field
+- 1 record ต่อ asset ใช้ร่วมกันทุก key (record ที่เหมือนกันใช้ object เดียวกัน)
+- ค้นหาแบบตรงตัว (dict), ขึ้นต้นด้วย (sorted keys + bisect),
+  มีคำนี้อยู่ (trigram index) และแบบ token (ไม่สนลำดับ/ตัวคั่น)
+- trigram / token index สร้างเมื่อค้นหาแบบ contains / fuzzy / search ครั้งแรกเท่านั้น
+  (รายงานรายวันใช้แค่ get / match จึงมีแค่ dict ของ key ในหน่วยความจำ)
+
+Environment (optional):
+    SNIPIT_INDEX_FIELDS   field ที่ใช้เป็น key คั่นด้วย comma
+                          custom field ใช้รูปแบบ custom_fields.<ชื่อ field>
+                          (default: name,asset_tag,hostname,device_name,serial,custom_fields.Device Name)
+"""
+
+import os
+import re
+import sys
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+DEFAULT_KEY_FIELDS = ("name", "asset_tag", "hostname", "device_name", "serial",
+                      "custom_fields.Device Name")
+
+# แยก token ตามตัวคั่น และตามรอยต่อตัวอักษร/ตัวเลข เช่น AP2D10APC670253 -> ap, 2, d, 10, apc, 670253
+_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+")
+
+
+def key_fields_from_env() -> Sequence[str]:
+    """อ่านรายชื่อ field ที่ใช้เป็น key จาก SNIPIT_INDEX_FIELDS"""
+    value = os.getenv("SNIPIT_INDEX_FIELDS")
+    if not value:
+        return DEFAULT_KEY_FIELDS
+    return tuple(f.strip() for f in value.split(",") if f.strip())
+
+
+def normalize(value) -> str:
+    """แปลงค่าเป็น key (ตัดช่องว่าง, ตัวพิมพ์เล็ก, intern string)"""
+    if value is None:
+        return ""
+    return sys.intern(str(value).strip().lower())
+
+
+def tokenize(value) -> List[str]:
+    """แยก token จากค่า (ตัวพิมพ์เล็ก)"""
+    return _TOKEN_RE.findall(str(value).lower())
+
+
+def field_values(row: Dict, field: str) -> List:
+    """
+    ดึงค่าของ field จาก hardware row
+
+    Args:
+        row: hardware row ของ Snip IT
+        field: ชื่อ field หรือ custom_fields.<ชื่อ> (custom_fields.* = ทุก custom field)
+
+    Returns:
+        List ของค่าที่ไม่ว่าง
+    """
+    if field.startswith("custom_fields."):
+        cf = row.get("custom_fields") or {}
+        if not isinstance(cf, dict):
+            return []
+        name = field[len("custom_fields."):]
+        items = cf.values() if name == "*" else [cf.get(name)]
+        values = []
+        for data in items:
+            if isinstance(data, dict):
+                data = data.get("value")
+            if isinstance(data, (str, int, float)) and str(data).strip():
+                values.append(data)
+        return values
+
+    value = row.get(field)
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("username") or value.get("display_name")
+    if value is None or not str(value).strip():
+        return []
+    return [value]
+
+
+class AssetIndex:
+    """Index key (ชื่อเครื่อง / asset tag / serial ...) -> record ของ asset"""
+
+    def __init__(self, rows: Iterable[Dict] = (), key_fields: Optional[Sequence[str]] = None,
+                 record: Optional[Callable[[Dict], object]] = None):
+        """
+        Args:
+            rows: hardware rows ของ Snip IT
+            key_fields: field ที่ใช้เป็น key (default: SNIPIT_INDEX_FIELDS)
+            record: ฟังก์ชันแปลง row เป็น record ที่เก็บใน index (default: row เอง)
+        """
+        self.key_fields = tuple(key_fields or key_fields_from_env())
+        self._record = record or (lambda row: row)
+        self._records: List[object] = []
+        self._shared: Dict[tuple, int] = {}
+        self._exact: Dict[str, int] = {}
+        self._shared_keys: Dict[str, List[int]] = {}
+        self._sorted_keys: Optional[List[str]] = None
+        self._trigrams: Optional[Dict[str, set]] = None
+        self._tokens: Optional[Dict[str, set]] = None
+        self._sorted_tokens: Optional[List[str]] = None
+        for row in rows:
+            keys = [v for field in self.key_fields for v in field_values(row, field)]
+            if keys:
+                self._add(keys, self._record(row))
+
+    def __len__(self):
+        return len(self._exact)
+
+    def __contains__(self, key):
+        return normalize(key) in self._exact
+
+    def _intern_record(self, record) -> int:
+        """เก็บ record (record ที่มีค่าเหมือนกันใช้ object เดียวกัน) และคืนค่าลำดับ"""
+        try:
+            signature = tuple(sorted(record.items())) if isinstance(record, dict) else None
+            hash(signature)
+        except TypeError:
+            signature = None
+        if signature is not None and signature in self._shared:
+            return self._shared[signature]
+        self._records.append(record)
+        rid = len(self._records) - 1
+        if signature is not None:
+            self._shared[signature] = rid
+        return rid
+
+    def _add(self, keys, record):
+        rid = self._intern_record(record)
+        for raw_key in keys:
+            key = normalize(raw_key)
+            if not key:
+                continue
+            # key ซ้ำกันหลาย asset: get() คืน asset ล่าสุด (เหมือน lookup dict เดิม)
+            # ส่วนการค้นหาคืนทุก asset ที่ใช้ key นี้
+            previous = self._exact.get(key)
+            if previous is not None and previous != rid:
+                rids = self._shared_keys.setdefault(key, [previous])
+                if rid not in rids:
+                    rids.append(rid)
+            self._exact[key] = rid
+        self._sorted_keys = None
+        self._trigrams = None
+        self._tokens = None
+        self._sorted_tokens = None
+
+    def _text_index(self):
+        """สร้าง trigram / token index จาก key ทั้งหมด (ครั้งแรกที่ต้องใช้ หรือหลังเพิ่ม key)"""
+        if self._trigrams is None:
+            trigrams: Dict[str, set] = defaultdict(set)
+            tokens: Dict[str, set] = defaultdict(set)
+            for key in self._exact:
+                for i in range(len(key) - 2):
+                    trigrams[key[i:i + 3]].add(key)
+                for token in tokenize(key):
+                    tokens[sys.intern(token)].add(key)
+            self._trigrams, self._tokens = dict(trigrams), dict(tokens)
+            self._sorted_tokens = sorted(self._tokens)
+        return self._trigrams, self._tokens
+
+    def add(self, key, record):
+        """เพิ่ม key -> record (เช่น ผลจาก Snip IT Search API)"""
+        self._add([key], record)
+
+    def get(self, key, default=None):
+        """ค้นหาแบบตรงตัว (ไม่สนตัวพิมพ์เล็ก-ใหญ่)"""
+        rid = self._exact.get(normalize(key))
+        return default if rid is None else self._records[rid]
+
+    def match(self, hostname, default=None):
+        """
+        จับคู่ hostname ของ event กับ asset
+        ตรงตัวก่อน ถ้าไม่พบใช้ key ที่เป็น FQDN ของ hostname นั้น (hostname.domain) เมื่อมีเพียง asset เดียว
+        """
+        record = self.get(hostname)
+        if record is not None:
+            return record
+        key = normalize(hostname)
+        if not key:
+            return default
+        rids = {rid for k in self._prefix_keys(key + ".") for rid in self._key_records(k)}
+        return self._records[rids.pop()] if len(rids) == 1 else default
+
+    def _prefix_keys(self, prefix: str) -> List[str]:
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self._exact)
+        keys = []
+        i = bisect_left(self._sorted_keys, prefix)
+        while i < len(self._sorted_keys) and self._sorted_keys[i].startswith(prefix):
+            keys.append(self._sorted_keys[i])
+            i += 1
+        return keys
+
+    def _key_records(self, key: str) -> List[int]:
+        return self._shared_keys.get(key) or [self._exact[key]]
+
+    def _unique_records(self, keys, limit: Optional[int]) -> List[object]:
+        seen = set()
+        records = []
+        for key in keys:
+            for rid in self._key_records(key):
+                if rid in seen:
+                    continue
+                seen.add(rid)
+                records.append(self._records[rid])
+                if limit and len(records) >= limit:
+                    return records
+        return records
+
+    def prefix(self, prefix, limit: Optional[int] = None) -> List[object]:
+        """asset ที่มี key ขึ้นต้นด้วย prefix"""
+        prefix = normalize(prefix)
+        return self._unique_records(self._prefix_keys(prefix), limit) if prefix else []
+
+    def _contains_keys(self, fragment: str) -> List[str]:
+        if len(fragment) < 3:
+            return sorted(k for k in self._exact if fragment in k)
+        trigrams = self._text_index()[0]
+        candidates = None
+        for i in range(len(fragment) - 2):
+            posting = trigrams.get(fragment[i:i + 3])
+            if not posting:
+                return []
+            candidates = set(posting) if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        return sorted(k for k in candidates if fragment in k)
+
+    def contains(self, fragment, limit: Optional[int] = None) -> List[object]:
+        """asset ที่มี key มีคำว่า fragment อยู่ (ใช้ trigram index)"""
+        fragment = normalize(fragment)
+        return self._unique_records(self._contains_keys(fragment), limit) if fragment else []
+
+    def fuzzy(self, query, limit: Optional[int] = 20) -> List[object]:
+        """
+        ค้นหาแบบ token: ทุก token ของคำค้นต้องเป็นจุดเริ่มต้นของ token ใดๆ ใน key
+        (ไม่สนลำดับและตัวคั่น เช่น "apc 670" เจอ AP2D10APC670253)
+        """
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        tokens = self._text_index()[1]
+        candidates = None
+        for qt in query_tokens:
+            keys = set()
+            i = bisect_left(self._sorted_tokens, qt)
+            while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(qt):
+                keys |= tokens[self._sorted_tokens[i]]
+                i += 1
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return []
+        # key ที่สั้นกว่า (ใกล้คำค้นกว่า) ขึ้นก่อน
+        return self._unique_records(sorted(candidates, key=lambda k: (len(k), k)), limit)
+
+    def search(self, query, limit: Optional[int] = None) -> List[object]:
+        """
+        ค้นหารวม: ตรงตัว -> ขึ้นต้นด้วย -> มีคำนี้อยู่ -> token
+        คืนค่า record ไม่ซ้ำกันเรียงตามความใกล้เคียง
+        """
+        key = normalize(query)
+        if not key:
+            return []
+        keys = []
+        if key in self._exact:
+            keys.append(key)
+        keys += self._prefix_keys(key)
+        keys += self._contains_keys(key)
+        records = self._unique_records(keys, limit)
+        if limit and len(records) >= limit:
+            return records
+        seen = {id(r) for r in records}
+        for record in self.fuzzy(query, limit=None):
+            if id(record) not in seen:
+                seen.add(id(record))
+                records.append(record)
+                if limit and len(records) >= limit:
+                    break
+        return records
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Day Buckets - จัด events เข้าวันที่ Bangkok แบบเร็ว โดยไม่แก้ไข event dict
+
+- แปลงวันที่ Bangkok เป็นช่วงเวลา UTC ครั้งเดียวต่อวัน (ไม่ต้องแปลง timezone ทุก event)
+- timestamp รูปแบบปกติของ Deep Instinct (YYYY-MM-DDTHH:MM:SS[.ffffff]Z) เทียบเป็น string ได้เลย
+  รูปแบบอื่น (เช่นมี offset) จึง parse ด้วย fromisoformat ซึ่ง cache ผลไว้
+- จัด events หลายวันพร้อมกันในรอบเดียว (bisect บนจุดเริ่มต้นของแต่ละวัน)
+
+ตัวอย่าง:
+    buckets = DayBuckets(['2026-02-02', '2026-02-03'])
+    by_date = buckets.split(events)          # {date: [events]}
+    today = buckets.filter(events, '2026-02-03')
+"""
+
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+TZ_BANGKOK = timezone(timedelta(hours=7))
+
+# ความยาวของส่วน YYYY-MM-DDTHH:MM:SS
+_SECONDS_LEN = 19
+
+DateLike = Union[date, str]
+
+
+def as_date(value: DateLike) -> date:
+    """แปลง 'YYYY-MM-DD' หรือ date เป็น date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def event_timestamp(event: Dict) -> Optional[str]:
+    """timestamp ที่ใช้จัดวันของ event (timestamp หรือ insertion_timestamp)"""
+    return event.get('timestamp') or event.get('insertion_timestamp')
+
+
+@lru_cache(maxsize=65536)
+def parse_utc(timestamp: str) -> datetime:
+    """parse ISO timestamp เป็น datetime UTC (cache ผล: event เดียวกันถูกอ่านหลายครั้งต่อรายงาน)"""
+    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def bangkok_time(event: Dict) -> Optional[datetime]:
+    """เวลา Bangkok ของ event (None ถ้าไม่มี timestamp หรือ parse ไม่ได้)"""
+    timestamp = event_timestamp(event)
+    if not timestamp:
+        return None
+    try:
+        return parse_utc(timestamp).astimezone(TZ_BANGKOK)
+    except ValueError:
+        return None
+
+
+def sort_key(event: Dict) -> datetime:
+    """key สำหรับเรียง events ตามเวลา (event ที่ไม่มีเวลาอยู่ท้ายสุดเมื่อเรียงใหม่ -> เก่า)"""
+    timestamp = event_timestamp(event)
+    try:
+        return parse_utc(timestamp) if timestamp else datetime.min.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _is_canonical(timestamp: str) -> bool:
+    """YYYY-MM-DDTHH:MM:SS[.fff]Z (UTC) ซึ่งเทียบลำดับแบบ string ได้"""
+    return (len(timestamp) >= _SECONDS_LEN + 1 and timestamp[-1] == 'Z'
+            and timestamp[10] == 'T' and timestamp[4] == '-' and timestamp[13] == ':')
+
+
+class DayBuckets:
+    """ช่วงเวลา UTC ของวันที่ Bangkok หลายวัน คำนวณครั้งเดียวแล้วใช้จัด events ทั้งหมด"""
+
+    def __init__(self, dates: Iterable[DateLike]):
+        self.dates: List[date] = sorted({as_date(d) for d in dates})
+        starts = [datetime(d.year, d.month, d.day, tzinfo=TZ_BANGKOK).astimezone(timezone.utc)
+                  for d in self.dates]
+        self._starts = starts
+        self._ends = [s + timedelta(days=1) for s in starts]
+        # ขอบเขตเป็นวินาทีเต็ม จึงเทียบแค่ 19 ตัวแรกของ timestamp ได้ (เศษวินาทีไม่ข้ามขอบ)
+        self._start_keys = [s.strftime('%Y-%m-%dT%H:%M:%S') for s in starts]
+        self._end_keys = [e.strftime('%Y-%m-%dT%H:%M:%S') for e in self._ends]
+
+    @property
+    def bounds(self) -> Dict[date, tuple]:
+        """วันที่ -> (start UTC, end UTC ไม่รวม)"""
+        return {d: (s, e) for d, s, e in zip(self.dates, self._starts, self._ends)}
+
+    def bucket(self, timestamp: Optional[str]) -> Optional[date]:
+        """
+        วันที่ Bangkok ของ timestamp (เฉพาะวันที่อยู่ในชุดนี้)
+
+        Returns:
+            date หรือ None ถ้าไม่อยู่ในวันใดเลย / ไม่มี timestamp / parse ไม่ได้
+        """
+        if not timestamp or not self.dates:
+            return None
+        if _is_canonical(timestamp):
+            key = timestamp[:_SECONDS_LEN]
+            i = bisect_right(self._start_keys, key) - 1
+            if i >= 0 and key < self._end_keys[i]:
+                return self.dates[i]
+            return None
+        try:
+            dt = parse_utc(timestamp)
+        except ValueError:
+            return None
+        i = bisect_right(self._starts, dt) - 1
+        if i >= 0 and dt < self._ends[i]:
+            return self.dates[i]
+        return None
+
+    def split(self, events: Iterable[Dict]) -> Dict[date, List[Dict]]:
+        """
+        จัด events เข้าแต่ละวันในรอบเดียว (ลำดับเดิม, ไม่แก้ไข event)
+
+        Returns:
+            Dictionary วันที่ -> events ของวันนั้น (มีทุกวันในชุด แม้ไม่มี events)
+        """
+        result: Dict[date, List[Dict]] = {d: [] for d in self.dates}
+        for event in events:
+            day = self.bucket(event_timestamp(event))
+            if day is not None:
+                result[day].append(event)
+        return result
+
+    def filter(self, events: Iterable[Dict], target_date: Optional[DateLike] = None) -> List[Dict]:
+        """
+        events ที่อยู่ในวันที่ target_date (default: ทุกวันในชุด)
+        """
+        if target_date is None:
+            return [e for e in events if self.bucket(event_timestamp(e)) is not None]
+        target_date = as_date(target_date)
+        if target_date not in self.dates:
+            return []
+        i = self.dates.index(target_date)
+        start_key, end_key = self._start_keys[i], self._end_keys[i]
+        bucket = self.bucket
+        filtered = []
+        # fast path ใน loop: timestamp รูปแบบปกติเทียบ string กับขอบเขตของวันโดยตรง
+        for event in events:
+            timestamp = event.get('timestamp') or event.get('insertion_timestamp')
+            if not timestamp:
+                continue
+            if _is_canonical(timestamp):
+                if start_key <= timestamp[:_SECONDS_LEN] < end_key:
+                    filtered.append(event)
+            elif bucket(timestamp) == target_date:
+                filtered.append(event)
+        return filtered
+
+
+@lru_cache(maxsize=64)
+def buckets_for(dates: Sequence[date]) -> DayBuckets:
+    """DayBuckets ของชุดวันที่ (cache ไว้ เช่น กรองทีละหน้าด้วยวันเดียวกัน)"""
+    return DayBuckets(dates)
+
+
+def filter_by_date(events: Iterable[Dict], target_date: DateLike) -> List[Dict]:
+    """กรอง events ของวันที่ Bangkok ที่กำหนด (ไม่แก้ไข event)"""
+    target_date = as_date(target_date)
+    return buckets_for((target_date,)).filter(events, target_date)
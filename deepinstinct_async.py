@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Deep Instinct Async Client
+Client แบบ asyncio (aiohttp) ที่มี method เหมือน DeepInstinctClient
+ใช้ fan-out การดึงข้อมูลไฟล์ / รายละเอียด events และการค้นหาหลาย tenant พร้อมกันบน event loop เดียว
+โดยจำกัดจำนวน request พร้อมกันด้วย semaphore
+
+- ลองใหม่ด้วยนโยบายเดียวกับ http_transport (HTTP_RETRIES / HTTP_BACKOFF / HTTP_BACKOFF_MAX,
+  Retry-After และ 429) และใช้ HTTP_TIMEOUT เป็น timeout ต่อ request
+- aiohttp เป็น optional: ถ้าไม่ได้ติดตั้ง (หรือ DI_ASYNC=off) monitor ใช้ client แบบ sync ตามเดิม
+- BlockingFanout ให้โค้ด sync (monitor / tenant workers) เรียกใช้ได้ โดยมี event loop ส่วนตัว
+  ที่ใช้ session (keep-alive) เดิมข้ามรอบ polling
+
+Environment (optional):
+    DI_ASYNC              on/off (default: on ถ้าติดตั้ง aiohttp)
+    DI_ASYNC_CONCURRENCY  จำนวน request พร้อมกันสูงสุด (default: 10)
+
+ตัวอย่าง:
+    async with AsyncDeepInstinctClient(url, token) as client:
+        files = await client.get_files_details(['ab12...', 'cd34...'])
+"""
+
+import os
+import asyncio
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import aiohttp
+except ImportError:  # optional: ไม่มี aiohttp ใช้ http_transport แบบ sync แทน
+    aiohttp = None
+
+import http_transport
+from http_transport import IDEMPOTENT_METHODS, RETRY_STATUS, retry_delay
+
+# (endpoint, search criteria, after_event_id)
+StreamQuery = Tuple[str, Dict, int]
+
+
+class AsyncDeepInstinctClient:
+    """Async client สำหรับเชื่อมต่อกับ Deep Instinct API"""
+
+    def __init__(self, base_url: str, api_token: str, max_concurrency: Optional[int] = None,
+                 transport: Optional[http_transport.HttpTransport] = None):
+        """
+        Args:
+            base_url: Deep Instinct API URL
+            api_token: API token
+            max_concurrency: จำนวน request พร้อมกันสูงสุด (default: DI_ASYNC_CONCURRENCY)
+            transport: ใช้ค่า timeout / retry / backoff จาก transport นี้ (default: transport กลาง)
+        """
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is not installed")
+        self.base_url = base_url.rstrip('/')
+        self.headers = {
+            'Authorization': api_token,  # Deep Instinct doesn't use "Bearer " prefix
+            'Content-Type': 'application/json'
+        }
+        self.max_concurrency = max_concurrency or int(os.getenv('DI_ASYNC_CONCURRENCY', '10'))
+        policy = transport or http_transport.get_transport()
+        self.retries = policy.retries
+        self.backoff = policy.backoff
+        self.backoff_max = policy.backoff_max
+        self.timeout = aiohttp.ClientTimeout(total=policy.timeout)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional['aiohttp.ClientSession'] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """เปิด session (connection pool ขนาดเท่ากับ max_concurrency)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout,
+                                                  connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        """ปิด session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, path: str, idempotent: Optional[bool] = None,
+                       not_found=False, **kwargs):
+        """
+        ส่ง request ภายใต้ semaphore และคืนค่า JSON (ลองใหม่แบบเดียวกับ http_transport)
+
+        Args:
+            not_found: ค่าที่คืนเมื่อได้ 404 (default: raise เหมือน status error อื่น)
+        """
+        await self.open()
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                try:
+                    async with self._session.request(method, url, **kwargs) as response:
+                        # 429 = server ยังไม่ได้ประมวลผล จึงลองใหม่ได้ทุก method
+                        retryable = response.status == 429 or (idempotent and response.status in RETRY_STATUS)
+                        if not retryable or attempt >= self.retries:
+                            if response.status == 404 and not_found is not False:
+                                return not_found
+                            response.raise_for_status()
+                            return await response.json(content_type=None)
+                        delay = retry_delay(attempt, response.headers.get('Retry-After'),
+                                            self.backoff, self.backoff_max)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt >= self.retries or not idempotent:
+                        raise
+                    delay = retry_delay(attempt, None, self.backoff, self.backoff_max)
+            # รอนอก semaphore เพื่อไม่กั้น request อื่นระหว่าง backoff
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_events(self, after_event_id: int = 0) -> List[Dict]:
+        """
+        ดึงข้อมูล Events จาก Deep Instinct
+
+        Args:
+            after_event_id: Event ID ที่จะเริ่มดึงข้อมูลหลังจาก ID นี้
+
+        Returns:
+            List ของ events
+        """
+        try:
+            params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
+            result = await self._request('GET', '/events/', params=params)
+
+            # Handle both list and dict responses
+            if isinstance(result, dict):
+                return result.get('events', [])
+            if isinstance(result, list):
+                return result
+            return []
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"❌ Error fetching events: {e}")
+            return []
+
+    async def get_suspicious_events(self, after_event_id: int = 0) -> List[Dict]:
+        """
+        ดึงข้อมูล Suspicious Events จาก Deep Instinct
+
+        Args:
+            after_event_id: Event ID ที่จะเริ่มดึงข้อมูลหลังจาก ID นี้
+
+        Returns:
+            List ของ suspicious events
+        """
+        try:
+            params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
+            events = await self._request('GET', '/suspicious-events/', params=params)
+            return events if isinstance(events, list) else []
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"❌ Error fetching suspicious events: {e}")
+            return []
+
+    async def search_events(self, search_criteria: Dict) -> List[Dict]:
+        """
+        ค้นหา Events ด้วยเงื่อนไขที่กำหนด
+
+        Args:
+            search_criteria: Dictionary ของเงื่อนไขในการค้นหา
+
+        Returns:
+            List ของ events ที่ตรงกับเงื่อนไข
+        """
+        events = await self.search_stream('/events', search_criteria)
+        return events or []
+
+    async def search_stream(self, endpoint: str, search_criteria: Dict,
+                            after_event_id: int = 0) -> Optional[List[Dict]]:
+        """
+        ค้นหา events 1 หน้าของ stream ด้วย POST {endpoint}/search ต่อจาก after_event_id
+
+        Returns:
+            List ของ events หรือ None ถ้าเรียก API ไม่สำเร็จ (ผู้เรียกใช้ client แบบ sync แทนได้)
+        """
+        try:
+            params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
+            result = await self._request('POST', f'{endpoint}/search', idempotent=True,
+                                         params=params, json=search_criteria)
+
+            # /search ตอบกลับเป็น EventList ({"last_id", "events"}) หรือ list
+            if isinstance(result, dict):
+                return result.get('events', [])
+            return result if isinstance(result, list) else []
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"❌ Error searching {endpoint} ({search_criteria}): {e}")
+            return None
+
+    async def get_event_details(self, event_id: int) -> Optional[Dict]:
+        """
+        ดึงรายละเอียดของ Event ตาม ID
+
+        Args:
+            event_id: ID ของ event
+
+        Returns:
+            Dictionary ของรายละเอียด event หรือ None ถ้าไม่พบ
+        """
+        try:
+            return await self._request('GET', f'/events/{event_id}')
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"❌ Error fetching event details for ID {event_id}: {e}")
+            return None
+
+    async def get_events_details(self, event_ids: Iterable[int]) -> Dict[int, Optional[Dict]]:
+        """
+        ดึงรายละเอียดหลาย events พร้อมกัน (จำกัดด้วย max_concurrency)
+
+        Returns:
+            Dictionary event ID -> รายละเอียด (None ถ้าดึงไม่สำเร็จ)
+        """
+        event_ids = list(dict.fromkeys(event_ids))
+        results = await asyncio.gather(*(self.get_event_details(i) for i in event_ids))
+        return dict(zip(event_ids, results))
+
+    async def get_files_details(self, file_hashes: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """
+        ดึงข้อมูลไฟล์ (/events/file/{hash}) ของหลาย hash พร้อมกัน
+
+        Returns:
+            Dictionary hash -> ข้อมูลไฟล์ (None = ไม่พบ) เฉพาะ hash ที่เรียก API สำเร็จ
+            (hash ที่ error ไม่อยู่ในผลลัพธ์ เพื่อไม่ให้ถูก cache เป็น "ไม่พบ")
+        """
+        file_hashes = list(dict.fromkeys(file_hashes))
+
+        async def fetch(file_hash):
+            return await self._request('GET', f'/events/file/{file_hash}', not_found=None)
+
+        results = await asyncio.gather(*(fetch(h) for h in file_hashes), return_exceptions=True)
+        details = {}
+        for file_hash, result in zip(file_hashes, results):
+            if isinstance(result, BaseException):
+                print(f"❌ Error fetching file details for {file_hash}: {result}")
+                continue
+            details[file_hash] = result
+        return details
+
+    async def search_streams(self, queries: Sequence[StreamQuery]) -> List[Optional[List[Dict]]]:
+        """
+        ค้นหาหลาย stream / tenant พร้อมกัน
+
+        Args:
+            queries: (endpoint, search criteria, after_event_id) เช่น ('/events', {'tenant_id': 3}, 17500)
+
+        Returns:
+            ผลของแต่ละ query ตามลำดับ (None = เรียก API ไม่สำเร็จ)
+        """
+        return list(await asyncio.gather(*(self.search_stream(*query) for query in queries)))
+
+    async def search_events_by_tenant(self, tenant_ids: Iterable[int],
+                                      search_criteria: Optional[Dict] = None) -> Dict[int, List[Dict]]:
+        """
+        ค้นหา events ของหลาย tenant พร้อมกัน (เพิ่ม tenant_id ลงในเงื่อนไขค้นหาของแต่ละ tenant)
+
+        Returns:
+            Dictionary tenant ID -> events
+        """
+        tenant_ids = list(dict.fromkeys(tenant_ids))
+        criteria = search_criteria or {}
+        results = await self.search_streams([('/events', {**criteria, 'tenant_id': t}, 0) for t in tenant_ids])
+        return {tenant_id: events or [] for tenant_id, events in zip(tenant_ids, results)}
+
+
+class BlockingFanout:
+    """
+    เรียก AsyncDeepInstinctClient จากโค้ด sync: 1 event loop ส่วนตัวต่อ instance
+    (session / connection pool เดิมใช้ต่อข้ามรอบ polling)
+    """
+
+    def __init__(self, client: AsyncDeepInstinctClient):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        with self._lock:
+            return self._loop.run_until_complete(coro)
+
+    def files_details(self, file_hashes: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """ข้อมูลไฟล์ของหลาย hash (ดู AsyncDeepInstinctClient.get_files_details)"""
+        file_hashes = list(file_hashes)
+        return self._run(self.client.get_files_details(file_hashes)) if file_hashes else {}
+
+    def search_streams(self, queries: Sequence[StreamQuery]) -> List[Optional[List[Dict]]]:
+        """ค้นหาหลาย stream / tenant พร้อมกัน (ดู AsyncDeepInstinctClient.search_streams)"""
+        return self._run(self.client.search_streams(queries)) if queries else []
+
+    def close(self):
+        """ปิด session และ event loop"""
+        with self._lock:
+            if self._loop.is_closed():
+                return
+            self._loop.run_until_complete(self.client.close())
+            self._loop.close()
+
+
+def fanout_from_env(base_url: str, api_token: str) -> Optional[BlockingFanout]:
+    """BlockingFanout ตาม DI_ASYNC (None ถ้าปิด หรือไม่ได้ติดตั้ง aiohttp)"""
+    if aiohttp is None or os.getenv('DI_ASYNC', 'on').lower() in ('off', '0', 'false', 'no'):
+        return None
+    return BlockingFanout(AsyncDeepInstinctClient(base_url, api_token))
@@ -12,6 +12,15 @@ from datetime import datetime
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
+import http_transport
+from state_store import CursorStore, get_state_dir
+from event_store import EventStore, STREAM_EVENTS, STREAM_SUSPICIOUS
+from mattermost_delivery import BatchDelivery, DeliveryQueue, Outbox
+from event_aggregator import EventAggregator, Rollup
+from poll_scheduler import PollScheduler
+from enrichment_cache import EnrichmentCache, disk_tier_from_env
+from deepinstinct_async import fanout_from_env
+
 # โหลด environment variables
 load_dotenv('.env1')
 
@@ -26,6 +35,34 @@ class DeepInstinctClient:
         }
         self.last_event_id = 0
         self.last_suspicious_event_id = 0
+        # cache ของรายละเอียด event / ข้อมูลไฟล์ (LRU + TTL, disk tier ถ้าตั้ง DI_ENRICH_CACHE_PATH)
+        disk = disk_tier_from_env()
+        self.event_details_cache = EnrichmentCache(
+            'event', float(os.getenv('DI_EVENT_DETAILS_TTL', '300')), disk=disk)
+        self.file_details_cache = EnrichmentCache(
+            'file', float(os.getenv('DI_FILE_DETAILS_TTL', '3600')), disk=disk)
+        # async fan-out (aiohttp, DI_ASYNC) สร้างเมื่อใช้ครั้งแรก
+        self._api_token = api_token
+        self._fanout = None
+        self._fanout_ready = False
+    
+    def fanout(self):
+        """BlockingFanout ของ client นี้ (None ถ้าปิด DI_ASYNC หรือไม่มี aiohttp)"""
+        if not self._fanout_ready:
+            self._fanout = fanout_from_env(self.base_url, self._api_token)
+            self._fanout_ready = True
+        return self._fanout
+    
+    def close(self):
+        """ปิด async fan-out (ถ้าเปิดไว้) และแสดงสถิติของ enrichment cache"""
+        for cache in (self.event_details_cache, self.file_details_cache):
+            stats = cache.stats()
+            if stats['hits'] or stats['misses']:
+                print(f"🗂️  Enrichment cache '{cache.name}': {stats['hits']} hit(s), "
+                      f"{stats['misses']} API call(s), {stats['size']} cached")
+        if self._fanout is not None:
+            self._fanout.close()
+            self._fanout = None
     
     def get_events(self, after_event_id: int = 0, limit: int = 50) -> List[Dict]:
         """
@@ -42,7 +79,7 @@ class DeepInstinctClient:
             url = f"{self.base_url}/events/"
             params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
             
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
+            response = http_transport.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             
             result = response.json()
@@ -75,7 +112,7 @@ class DeepInstinctClient:
             url = f"{self.base_url}/suspicious-events/"
             params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
             
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
+            response = http_transport.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             
             events = response.json()
@@ -97,7 +134,8 @@ class DeepInstinctClient:
         """
         try:
             url = f"{self.base_url}/events/search"
-            response = requests.post(url, headers=self.headers, json=search_criteria, timeout=30)
+            response = http_transport.post(url, headers=self.headers, json=search_criteria,
+                                           idempotent=True)
             response.raise_for_status()
             
             events = response.json()
@@ -109,7 +147,7 @@ class DeepInstinctClient:
     
     def get_event_details(self, event_id: int) -> Optional[Dict]:
         """
-        ดึงรายละเอียดของ Event ตาม ID
+        ดึงรายละเอียดของ Event ตาม ID (ผ่าน cache: DI_EVENT_DETAILS_TTL)
         
         Args:
             event_id: ID ของ event
@@ -117,9 +155,12 @@ class DeepInstinctClient:
         Returns:
             Dictionary ของรายละเอียด event หรือ None ถ้าไม่พบ
         """
+        return self.event_details_cache.get(int(event_id), lambda: self._fetch_event_details(event_id))
+    
+    def _fetch_event_details(self, event_id: int) -> Optional[Dict]:
         try:
             url = f"{self.base_url}/events/{event_id}"
-            response = requests.get(url, headers=self.headers, timeout=30)
+            response = http_transport.get(url, headers=self.headers)
             response.raise_for_status()
             
             return response.json()
@@ -127,6 +168,115 @@ class DeepInstinctClient:
         except requests.exceptions.RequestException as e:
             print(f"❌ Error fetching event details for ID {event_id}: {e}")
             return None
+    
+    def get_file_details(self, file_hash: str) -> Optional[Dict]:
+        """
+        ดึงข้อมูลไฟล์ตาม hash (/events/file/{hash}) เช่น จำนวนเครื่องที่พบ, จำนวน events ที่เปิดอยู่
+        (ผ่าน cache: DI_FILE_DETAILS_TTL)
+        
+        Args:
+            file_hash: SHA256 ของไฟล์ (หรือ archive hash)
+        
+        Returns:
+            Dictionary ของข้อมูลไฟล์ หรือ None ถ้าไม่พบ
+        """
+        file_hash = str(file_hash).strip().lower()
+        return self.file_details_cache.get(file_hash, lambda: self._fetch_file_details(file_hash))
+    
+    def prefetch_file_details(self, file_hashes) -> int:
+        """
+        ดึงข้อมูลไฟล์ของหลาย hash พร้อมกัน (async fan-out) ลง cache ก่อน format alerts ของรอบนั้น
+        hash ที่อยู่ใน cache แล้วหรือดึงไม่สำเร็จจะถูกดึงทีละรายการตามปกติใน get_file_details
+        
+        Returns:
+            จำนวน hash ที่ดึงมาใส่ cache
+        """
+        fanout = self.fanout()
+        if fanout is None:
+            return 0
+        missing = self.file_details_cache.missing(str(h).strip().lower() for h in file_hashes if h)
+        if not missing:
+            return 0
+        details = fanout.files_details(missing)
+        for file_hash, value in details.items():
+            self.file_details_cache.get(file_hash, lambda value=value: value)
+        return len(details)
+    
+    def _fetch_file_details(self, file_hash: str) -> Optional[Dict]:
+        try:
+            url = f"{self.base_url}/events/file/{file_hash}"
+            response = http_transport.get(url, headers=self.headers)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            
+            return response.json()
+        
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error fetching file details for {file_hash}: {e}")
+            return None
+    
+    def search_stream(self, endpoint: str, search_criteria: Dict, after_event_id: int = 0) -> List[Dict]:
+        """
+        ค้นหา events 1 หน้าของ stream ด้วย POST {endpoint}/search ต่อจาก after_event_id
+        
+        Args:
+            endpoint: '/events' หรือ '/suspicious-events'
+            search_criteria: เงื่อนไขค้นหา เช่น {'tenant_id': 3}
+            after_event_id: Event ID ที่จะเริ่มดึงข้อมูลหลังจาก ID นี้
+        
+        Returns:
+            List ของ events ที่ตรงกับเงื่อนไข
+        """
+        try:
+            url = f"{self.base_url}{endpoint}/search"
+            params = {'after_event_id': after_event_id} if after_event_id > 0 else {}
+            response = http_transport.post(url, headers=self.headers, params=params, json=search_criteria,
+                                           idempotent=True)
+            response.raise_for_status()
+            
+            # /search ตอบกลับเป็น EventList ({"last_id", "events"}) หรือ list
+            result = response.json()
+            if isinstance(result, dict):
+                return result.get('events', [])
+            return result if isinstance(result, list) else []
+        
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error searching {endpoint} ({search_criteria}): {e}")
+            return []
+    
+    def search_streams(self, queries) -> List[Optional[List[Dict]]]:
+        """
+        ค้นหาหลาย (endpoint, criteria, after_event_id) พร้อมกันผ่าน async fan-out
+        
+        Returns:
+            ผลของแต่ละ query ตามลำดับ (None = ไม่มี fan-out หรือเรียก API ไม่สำเร็จ)
+        """
+        fanout = self.fanout()
+        if fanout is None:
+            return [None] * len(queries)
+        return fanout.search_streams(queries)
+    
+    def get_tenants(self) -> Optional[List[Dict]]:
+        """
+        ดึงรายชื่อ tenants (/multitenancy/tenant/)
+        
+        Returns:
+            List ของ tenants ({'id', 'name', 'msp_id', ...}) หรือ None ถ้าเรียก API ไม่สำเร็จ
+        """
+        try:
+            url = f"{self.base_url}/multitenancy/tenant/"
+            response = http_transport.get(url, headers=self.headers)
+            response.raise_for_status()
+            
+            result = response.json()
+            if isinstance(result, dict):
+                return result.get('tenants', [])
+            return result if isinstance(result, list) else []
+        
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error fetching tenants: {e}")
+            return None
 
 
 class MattermostNotifier:
@@ -151,11 +301,10 @@ class MattermostNotifier:
             if attachments:
                 payload['attachments'] = attachments
             
-            response = requests.post(
+            response = http_transport.post(
                 self.webhook_url,
                 json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
+                headers={'Content-Type': 'application/json'}
             )
             response.raise_for_status()
             
@@ -290,49 +439,201 @@ class MattermostNotifier:
         }
         
         return attachment
+    
+    def format_rollup_message(self, rollup: Rollup, event_type: str = "Event", summary: bool = False) -> Dict:
+        """
+        จัดรูปแบบกลุ่ม events (file hash / เครื่อง / threat type เดียวกัน) เป็น attachment เดียว
+        
+        Args:
+            rollup: กลุ่ม events จาก EventAggregator
+            event_type: ประเภทของ event
+            summary: True = alert สรุป events ที่ตามมาหลัง alert แรกเมื่อ window ปิด
+        
+        Returns:
+            Dictionary ของ Mattermost attachment (กลุ่มที่มี event เดียวใช้รูปแบบเดิม)
+        """
+        attachment = self.format_event_message(rollup.event, event_type)
+        if rollup.count <= 1 and not summary:
+            return attachment
+        
+        if summary:
+            attachment['pretext'] = f'🔁 **{event_type} repeated {rollup.count} more time(s)** (same file, device and threat type)'
+        else:
+            attachment['pretext'] = f'🚨 **New {event_type} Detected** (×{rollup.count})'
+        event_ids = ', '.join(str(i) for i in rollup.event_ids)
+        if rollup.count > len(rollup.event_ids):
+            event_ids += ', …'
+        attachment['fields'] = [
+            {'short': True, 'title': 'Grouped Events', 'value': str(rollup.count)},
+            {'short': True, 'title': 'Occurrences', 'value': str(rollup.occurrences)},
+            {'short': False, 'title': 'Event IDs', 'value': event_ids},
+        ] + attachment['fields']
+        return attachment
 
 
 class DeepInstinctMonitor:
     """Monitor สำหรับตรวจสอบและส่ง events ไปยัง Mattermost"""
     
-    def __init__(self, di_client: DeepInstinctClient, mm_notifier: MattermostNotifier):
+    def __init__(self, di_client: DeepInstinctClient, mm_notifier: MattermostNotifier,
+                 cursor_store: Optional[CursorStore] = None,
+                 event_store: Optional[EventStore] = None,
+                 delivery: Optional[BatchDelivery] = None,
+                 delivery_queue: Optional[DeliveryQueue] = None,
+                 aggregator: Optional[EventAggregator] = None):
         self.di_client = di_client
         self.mm_notifier = mm_notifier
-        self.last_event_id = 0
-        self.last_suspicious_event_id = 0
+        # รวมหลาย attachments ต่อ post และจำกัดอัตราการส่ง (MM_BATCH_* / MM_RATE_*)
+        self.delivery = delivery or BatchDelivery(mm_notifier.send_message)
+        # outbox + worker ใน background (ถ้ามี): บันทึกลง outbox แล้วไปดึงรอบถัดไปได้เลยโดยไม่รอ Mattermost
+        self.delivery_queue = delivery_queue
+        # ตัด event ซ้ำ และรวม events เดียวกัน (file hash / เครื่อง / threat type) เป็น alert เดียว (MM_AGGREGATE_*)
+        self.aggregator = aggregator
+        # เพิ่มจำนวนเครื่อง / events ที่พบไฟล์เดียวกันใน alert (ข้อมูลไฟล์ถูก cache ตาม hash)
+        self.enrich_files = os.getenv('MM_ENRICH_FILE', 'on').lower() not in ('off', '0', 'false', 'no')
+        self.cursor_store = cursor_store
+        # local event store (ถ้ามี) เก็บทุก event ที่ดึงมาให้รายงาน/การค้นหาอ่านต่อได้
+        self.event_store = event_store
+        
+        # อ่าน cursor ที่บันทึกไว้ (ถ้ามี) เพื่อไม่ต้องดึง history ทั้งหมดใหม่หลัง restart
+        cursors = cursor_store.load() if cursor_store else {}
+        self.last_event_id = cursors.get('last_event_id', 0)
+        self.last_suspicious_event_id = cursors.get('last_suspicious_event_id', 0)
+        if cursors:
+            print(f"📌 Resuming from event ID {self.last_event_id}, "
+                  f"suspicious event ID {self.last_suspicious_event_id}")
     
     def process_events(self, events: List[Dict], event_type: str = "Event") -> int:
         """
-        ประมวลผลและส่ง events ไปยัง Mattermost
+        ประมวลผลและส่ง events ไปยัง Mattermost ตามลำดับ (รวมหลาย events ต่อ 1 post)
+        
+        หยุดทันทีที่ส่งไม่สำเร็จ เพื่อให้ cursor เลื่อนไปเฉพาะ events ที่ส่งถึงแล้ว
+        (events ที่เหลือจะถูกดึงและส่งใหม่ในรอบถัดไป)
+        
+        ถ้ามี delivery_queue จะบันทึกลง outbox (durable) แล้วคืนค่าทันที
+        worker จะส่งให้ใน background และลองใหม่เองเมื่อส่งไม่สำเร็จ
         
         Args:
             events: List ของ events
             event_type: ประเภทของ event
         
         Returns:
-            จำนวน events ที่ส่งสำเร็จ
+            จำนวน events ช่วงต้นของ list ที่ประมวลผลเสร็จแล้ว (ส่งแล้ว หรือบันทึกลง outbox แล้ว)
         """
-        count = 0
-        
-        for event in events:
+        plan = self.aggregator.plan(event_type, events) if self.aggregator else None
+        if plan is not None and plan.duplicates:
+            print(f"🔁 {plan.duplicates} {event_type}(s) grouped or already sent")
+        
+        # ดึงข้อมูลไฟล์ของทุก hash ในรอบนี้พร้อมกันก่อน (แทนการเรียกทีละ alert)
+        prefetch = getattr(self.di_client, 'prefetch_file_details', None)
+        if self.enrich_files and prefetch is not None:
+            hashes = [event.get('file_hash') for index, event in enumerate(events)
+                      if plan is None or plan.rollups[index] is not None]
             try:
-                attachment = self.mm_notifier.format_event_message(event, event_type)
-                
-                # ส่งไปยัง Mattermost
-                if self.mm_notifier.send_message('', attachments=[attachment]):
-                    count += 1
-                    print(f"✅ Sent {event_type} ID: {event.get('id', 'N/A')}")
+                prefetch(hashes)
+            except Exception as e:
+                print(f"⚠️  File details prefetch failed: {e}")
+        
+        attachments = []
+        for index, event in enumerate(events):
+            rollup = plan.rollups[index] if plan is not None else None
+            if plan is not None and rollup is None:
+                attachments.append(None)
+                continue
+            try:
+                if rollup is not None:
+                    attachment = self.mm_notifier.format_rollup_message(rollup, event_type)
                 else:
-                    print(f"⚠️  Failed to send {event_type} ID: {event.get('id', 'N/A')}")
-                
-                # หน่วงเวลาเล็กน้อยเพื่อไม่ให้ spam
-                time.sleep(0.5)
-            
+                    attachment = self.mm_notifier.format_event_message(event, event_type)
+                attachments.append(self.enrich_attachment(attachment, event))
             except Exception as e:
+                # event ที่ format ไม่ได้จะ format ไม่ได้ตลอด จึงข้ามไปเลย
                 print(f"❌ Error processing event: {e}")
+                attachments.append(None)
         
+        count = self._deliver(events, attachments, event_type)
+        if plan is not None:
+            self.aggregator.commit(plan, count)
         return count
     
+    def enrich_attachment(self, attachment: Dict, event: Dict) -> Dict:
+        """เพิ่มข้อมูลไฟล์ (จำนวนเครื่อง / events ที่พบ hash เดียวกัน) ลงใน attachment"""
+        file_hash = event.get('file_hash')
+        get_file_details = getattr(self.di_client, 'get_file_details', None)
+        if not self.enrich_files or not file_hash or get_file_details is None:
+            return attachment
+        details = get_file_details(file_hash)
+        if not isinstance(details, dict):
+            return attachment
+        for key, title in (('affected_device_count', 'Devices Seen'), ('event_count', 'Open Events (hash)')):
+            if details.get(key) is not None:
+                attachment['fields'].append({'short': True, 'title': title, 'value': str(details[key])})
+        return attachment
+    
+    def _deliver(self, events: List[Dict], attachments: List[Optional[Dict]], event_type: str) -> int:
+        """ส่ง (หรือบันทึกลง outbox) attachments ของ events และคืนจำนวน events ช่วงต้นที่เสร็จแล้ว"""
+        if self.delivery_queue is not None:
+            try:
+                count = self.delivery_queue.enqueue(event_type, events, attachments)
+            except Exception as e:
+                # บันทึก outbox ไม่ได้ (เช่น disk เต็ม): ไม่เลื่อน cursor เพื่อดึงใหม่รอบถัดไป
+                print(f"❌ Cannot write {event_type}(s) to outbox: {e}")
+                return 0
+            print(f"📮 Queued {count} {event_type}(s) for delivery")
+            return count
+        
+        def on_sent(start, end):
+            ids = [str(event.get('id', 'N/A')) for event, attachment
+                   in zip(events[start:end], attachments[start:end]) if attachment is not None]
+            print(f"✅ Sent {len(ids)} {event_type}(s) ID: {', '.join(ids)}")
+        
+        # จำกัดอัตราการส่งด้วย token bucket (MM_RATE_PER_SEC / MM_RATE_BURST)
+        count = self.delivery.deliver(attachments, on_sent=on_sent)
+        if count < len(events):
+            print(f"⚠️  Failed to send {event_type} ID: {events[count].get('id', 'N/A')}")
+        return count
+    
+    def send_rollups(self):
+        """ส่ง alert สรุปของกลุ่มที่ window ปิดแล้ว (events ที่ตามมาหลัง alert แรก)"""
+        if not self.aggregator:
+            return
+        rollups = self.aggregator.take_expired()
+        if not rollups:
+            return
+        events, attachments = [], []
+        for rollup in rollups:
+            event_type = rollup.key[0]
+            # id ของ alert สรุปไม่ซ้ำกับ event จริง (กันบันทึกซ้ำใน outbox)
+            events.append({'id': f"rollup-{rollup.event_ids[0]}-{rollup.event.get('id', 'N/A')}-{rollup.count}"})
+            try:
+                attachments.append(self.mm_notifier.format_rollup_message(rollup, event_type, summary=True))
+            except Exception as e:
+                print(f"❌ Error processing rollup: {e}")
+                attachments.append(None)
+        count = self._deliver(events, attachments, 'Rollup')
+        # คืนกลุ่มที่ส่งไม่สำเร็จ และบันทึก state (กลุ่มที่ส่งแล้วไม่ต้องแจ้งซ้ำหลัง restart)
+        self.aggregator.restore(rollups[count:])
+    
+    def store_events(self, stream: str, events: List[Dict]):
+        """บันทึก events ที่ดึงมาลง local event store (ถ้ามี)"""
+        if not self.event_store or not events:
+            return
+        try:
+            self.event_store.add_events(stream, events)
+        except Exception as e:
+            print(f"⚠️  Cannot write events to local store: {e}")
+    
+    def commit_cursors(self):
+        """บันทึก cursor ปัจจุบันลง cursor store (ถ้ามี)"""
+        if not self.cursor_store:
+            return
+        try:
+            self.cursor_store.commit(
+                last_event_id=self.last_event_id,
+                last_suspicious_event_id=self.last_suspicious_event_id
+            )
+        except OSError as e:
+            print(f"⚠️  Cannot save cursor: {e}")
+    
     def check_new_events(self) -> tuple:
         """
         ตรวจสอบ events และ suspicious events ใหม่
@@ -346,12 +647,14 @@ class DeepInstinctMonitor:
         
         if events:
             print(f"📊 Found {len(events)} new event(s)")
+            self.store_events(STREAM_EVENTS, events)
             sent = self.process_events(events, "Event")
             print(f"✉️  Sent {sent}/{len(events)} events to Mattermost")
             
-            # อัพเดท last event ID
-            if events and 'id' in events[-1]:
-                self.last_event_id = events[-1]['id']
+            # อัพเดท last event ID เฉพาะ events ที่ส่งถึงแล้ว
+            if sent and 'id' in events[sent - 1]:
+                self.last_event_id = events[sent - 1]['id']
+                self.commit_cursors()
         else:
             print("ℹ️  No new events found")
         
@@ -363,39 +666,54 @@ class DeepInstinctMonitor:
         
         if suspicious_events:
             print(f"📊 Found {len(suspicious_events)} new suspicious event(s)")
+            self.store_events(STREAM_SUSPICIOUS, suspicious_events)
             sent = self.process_events(suspicious_events, "Suspicious Event")
             print(f"✉️  Sent {sent}/{len(suspicious_events)} suspicious events to Mattermost")
             
-            # อัพเดท last suspicious event ID
-            if suspicious_events and 'id' in suspicious_events[-1]:
-                self.last_suspicious_event_id = suspicious_events[-1]['id']
+            # อัพเดท last suspicious event ID เฉพาะ events ที่ส่งถึงแล้ว
+            if sent and 'id' in suspicious_events[sent - 1]:
+                self.last_suspicious_event_id = suspicious_events[sent - 1]['id']
+                self.commit_cursors()
         else:
             print("ℹ️  No new suspicious events found")
         
+        self.send_rollups()
+        
         return len(events), len(suspicious_events)
     
-    def run_continuous(self, interval: int = 300):
+    def run_continuous(self, interval: int = 300, scheduler: Optional[PollScheduler] = None):
         """
         รันการตรวจสอบแบบต่อเนื่อง
         
+        รอบถัดไปนับจาก deadline ของรอบก่อน (ไม่ drift ตามเวลาที่ใช้ดึง/ส่ง)
+        และปรับคาบตามปริมาณ events (POLL_MIN_INTERVAL / POLL_MAX_INTERVAL / POLL_BACKOFF)
+        
         Args:
             interval: ระยะเวลาระหว่างการตรวจสอบ (วินาที) default: 300 วินาที (5 นาที)
+            scheduler: PollScheduler (default: PollScheduler.from_env(interval))
         """
+        scheduler = scheduler or PollScheduler.from_env(interval)
         print("🚀 Starting Deep Instinct Monitor...")
         print(f"⏱️  Polling interval: {interval} seconds ({interval/60:.1f} minutes)")
+        if scheduler.adaptive:
+            print(f"⏱️  Adaptive polling: {scheduler.min_interval:g}-{scheduler.max_interval:g} seconds "
+                  f"(backoff x{scheduler.backoff:g} when idle)")
         print("Press Ctrl+C to stop\n")
         
         try:
             while True:
+                scheduler.wait()
+                scheduler.start_cycle()
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 print(f"\n{'='*60}")
                 print(f"🕐 {timestamp}")
                 print(f"{'='*60}")
                 
-                self.check_new_events()
+                found = sum(self.check_new_events())
                 
-                print(f"\n💤 Sleeping for {interval} seconds...")
-                time.sleep(interval)
+                delay = scheduler.end_cycle(found)
+                print(f"\n💤 Sleeping for {delay:.0f} seconds "
+                      f"(cycle took {scheduler.last_cost:.1f}s, period {scheduler.period:g}s)...")
         
         except KeyboardInterrupt:
             print("\n\n👋 Stopping monitor... Goodbye!")
@@ -403,6 +721,16 @@ class DeepInstinctMonitor:
             print(f"\n❌ Unexpected error: {e}")
 
 
+def stop_delivery_queue(delivery_queue: DeliveryQueue, flush_timeout: float = 5):
+    """
+    ส่ง alert ที่ถึงเวลาส่งและค้างอยู่ก่อน (รอไม่เกิน flush_timeout วินาที) แล้วหยุด threads
+    รายการที่ยังส่งไม่ได้ (เช่น Mattermost ล่ม) อยู่ใน outbox และจะถูกส่งเมื่อเริ่มใหม่
+    """
+    if not delivery_queue.flush(flush_timeout):
+        print("📮 Outbox: alerts still pending, they will be sent after restart")
+    delivery_queue.stop()
+
+
 def main():
     """Main function"""
     print("╔══════════════════════════════════════════════════════════════╗")
@@ -450,17 +778,53 @@ def main():
     else:
         print("⚠️  Warning: Could not verify Mattermost webhook")
     
-    # สร้าง monitor และรัน
-    monitor = DeepInstinctMonitor(di_client, mm_notifier)
+    # สร้าง monitor และรัน (cursor เก็บใน STATE_DIR/.last_event_id เพื่อให้ restart แล้วทำงานต่อได้)
+    cursor_path = os.getenv('CURSOR_STATE_FILE') or os.path.join(get_state_dir(), '.last_event_id')
+    print(f"📌 Cursor file: {cursor_path}")
+    event_store = None
+    if os.getenv('EVENT_STORE', 'on').lower() not in ('off', '0', 'false', 'no'):
+        event_store = EventStore()
+        print(f"📦 Local event store: {event_store.path}")
+    delivery_queue = None
+    if os.getenv('MM_OUTBOX', 'on').lower() not in ('off', '0', 'false', 'no'):
+        outbox = Outbox()
+        delivery_queue = DeliveryQueue(outbox, mm_notifier.send_message)
+        counts = outbox.counts()
+        print(f"📮 Outbox: {outbox.path} (pending: {counts['pending']}, dead letter: {counts['dead']})")
+        delivery_queue.start()
+    polling_interval = int(os.getenv('POLLING_INTERVAL', '300'))
+    
+    if os.getenv('MONITOR_MODE', 'global').lower() == 'tenants':
+        # แบ่ง tenants ให้ worker processes (worker อยู่ใน tenant_monitor.py เพื่อให้ import ได้จาก process ใหม่)
+        from tenant_monitor import TenantSupervisor
+        seed_cursors = CursorStore(cursor_path).load()
+        if event_store is not None:
+            event_store.close()
+        supervisor = TenantSupervisor(di_client, di_url, di_token, mm_webhook, seed_cursors, polling_interval)
+        try:
+            supervisor.run()
+        finally:
+            if delivery_queue is not None:
+                stop_delivery_queue(delivery_queue)
+        return
     
-    # ดึงข้อมูลครั้งแรก
-    print("\n📥 Fetching initial events...")
-    monitor.check_new_events()
+    # กลุ่ม events ที่รอแจ้งใน alert สรุปบันทึกไว้ข้าง cursor (ไม่หายเมื่อ restart ระหว่าง window)
+    aggregator = EventAggregator(state_path=os.path.join(get_state_dir(), 'rollups.json'))
+    monitor = DeepInstinctMonitor(di_client, mm_notifier, CursorStore(cursor_path), event_store,
+                                  delivery_queue=delivery_queue, aggregator=aggregator)
     
-    # รันแบบต่อเนื่อง (polling ทุก 5 นาที)
-    # แก้ไข interval ตามต้องการ เช่น 60 = 1 นาที, 300 = 5 นาที, 600 = 10 นาที
-    polling_interval = int(os.getenv('POLLING_INTERVAL', '300'))
-    monitor.run_continuous(interval=polling_interval)
+    try:
+        # ดึงข้อมูลครั้งแรก
+        print("\n📥 Fetching initial events...")
+        monitor.check_new_events()
+        
+        # รันแบบต่อเนื่อง (polling ทุก 5 นาที)
+        # แก้ไข interval ตามต้องการ เช่น 60 = 1 นาที, 300 = 5 นาที, 600 = 10 นาที
+        monitor.run_continuous(interval=polling_interval)
+    finally:
+        if delivery_queue is not None:
+            stop_delivery_queue(delivery_queue)
+        di_client.close()
 
 
 if __name__ == '__main__':
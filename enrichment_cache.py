@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Enrichment Cache - cache ผลการเรียก API สำหรับเพิ่มข้อมูลให้ alert (รายละเอียด event / ข้อมูลไฟล์ตาม hash)
+
+- หน่วยความจำ: LRU จำกัดจำนวนรายการ + อายุ (TTL) ต่อรายการ
+- ดิสก์ (optional): SQLite ใช้ร่วมกันได้หลาย process และยังอยู่หลัง restart
+- request coalescing: หลาย threads ขอ key เดียวกันพร้อมกัน เรียก API ครั้งเดียวแล้วใช้ผลร่วมกัน
+- ผลที่เป็น None (ไม่พบ / เรียก API ไม่สำเร็จ) cache สั้นกว่า (miss TTL) เพื่อไม่ยิงซ้ำระหว่าง burst
+
+Environment (optional):
+    DI_ENRICH_CACHE_SIZE   จำนวนรายการสูงสุดในหน่วยความจำต่อ cache (default: 2048)
+    DI_ENRICH_MISS_TTL     อายุของผลที่ไม่พบ (วินาที) (default: 60)
+    DI_ENRICH_CACHE_PATH   path ของไฟล์ SQLite สำหรับ cache บนดิสก์ (default: ไม่ใช้ดิสก์)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrichment (
+    cache TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (cache, key)
+);
+"""
+
+
+class DiskTier:
+    """cache บนดิสก์ (SQLite) ใช้ร่วมกันหลาย EnrichmentCache / หลาย process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, cache: str, key: str):
+        """
+        Returns:
+            (found, value, expires_at) โดย expires_at เป็น wall-clock time
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM enrichment WHERE cache = ? AND key = ? AND expires_at > ?',
+                (cache, key, time.time())
+            ).fetchone()
+        if row is None:
+            return False, None, 0.0
+        return True, (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def put(self, cache: str, key: str, value, ttl: float):
+        """บันทึกค่า (value ต้องแปลงเป็น JSON ได้)"""
+        data = json.dumps(value, ensure_ascii=False) if value is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO enrichment (cache, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (cache, key, data, time.time() + ttl)
+            )
+
+    def prune(self) -> int:
+        """ลบรายการที่หมดอายุแล้ว"""
+        with self._lock, self._conn:
+            return self._conn.execute('DELETE FROM enrichment WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def close(self):
+        """ปิด connection"""
+        with self._lock:
+            self._conn.close()
+
+
+_shared_disk: Dict[str, DiskTier] = {}
+_shared_disk_lock = threading.Lock()
+
+
+def disk_tier_from_env() -> Optional[DiskTier]:
+    """DiskTier จาก DI_ENRICH_CACHE_PATH (ใช้ connection เดียวต่อ path ภายใน process)"""
+    path = os.getenv('DI_ENRICH_CACHE_PATH')
+    if not path:
+        return None
+    with _shared_disk_lock:
+        if path not in _shared_disk:
+            _shared_disk[path] = DiskTier(path)
+            _shared_disk[path].prune()
+        return _shared_disk[path]
+
+
+class EnrichmentCache:
+    """LRU + TTL ในหน่วยความจำ, disk tier (optional) และรวม request ที่ซ้ำกัน"""
+
+    def __init__(self, name: str, ttl: float, maxsize: Optional[int] = None, miss_ttl: Optional[float] = None,
+                 disk: Optional[DiskTier] = None):
+        """
+        Args:
+            name: ชื่อ cache (แยก key ของแต่ละประเภทใน disk tier)
+            ttl: อายุของผลที่พบ (วินาที)
+            maxsize: จำนวนรายการสูงสุดในหน่วยความจำ (default: DI_ENRICH_CACHE_SIZE)
+            miss_ttl: อายุของผลที่เป็น None (default: DI_ENRICH_MISS_TTL)
+            disk: DiskTier (default: ไม่ใช้ดิสก์)
+        """
+        self.name = name
+        self.ttl = float(ttl)
+        self.maxsize = max(1, maxsize or int(os.getenv('DI_ENRICH_CACHE_SIZE', '2048')))
+        self.miss_ttl = float(os.getenv('DI_ENRICH_MISS_TTL', '60') if miss_ttl is None else miss_ttl)
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._pending: Dict[Hashable, Future] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _ttl_for(self, value) -> float:
+        return self.ttl if value is not None else self.miss_ttl
+
+    def _store(self, key: Hashable, value, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, loader: Callable[[], object]):
+        """
+        คืนค่าของ key จาก cache หรือเรียก loader (ครั้งเดียวต่อ key แม้ถูกเรียกพร้อมกันหลาย threads)
+
+        Args:
+            key: key ของข้อมูล (เช่น event ID, file hash)
+            loader: ฟังก์ชันเรียก API คืนค่าข้อมูล หรือ None ถ้าไม่พบ
+
+        Returns:
+            ข้อมูลจาก cache หรือจาก loader
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            # มีคนกำลังเรียก API ของ key นี้อยู่: รอผลเดียวกัน
+            with self._lock:
+                self.hits += 1
+            return future.result()
+
+        try:
+            value = self._load(key, loader)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+        future.set_result(value)
+        return value
+
+    def _load(self, key: Hashable, loader: Callable[[], object]):
+        if self.disk is not None:
+            found, value, expires_at = self.disk.get(self.name, str(key))
+            if found:
+                with self._lock:
+                    self.hits += 1
+                    self._store(key, value, expires_at - time.time())
+                return value
+
+        value = loader()
+        ttl = self._ttl_for(value)
+        with self._lock:
+            self.misses += 1
+            self._store(key, value, ttl)
+        if self.disk is not None:
+            try:
+                self.disk.put(self.name, str(key), value, ttl)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"⚠️  Cannot write enrichment cache: {e}")
+        return value
+
+    def missing(self, keys: Iterable[Hashable]) -> List[Hashable]:
+        """
+        key ที่ยังไม่มีใน cache (หน่วยความจำ หรือ disk tier) สำหรับดึงหลายรายการพร้อมกันล่วงหน้า
+        key ที่พบใน disk tier จะถูกนำขึ้นหน่วยความจำ
+
+        Returns:
+            List ของ key ที่ต้องเรียก API (ไม่ซ้ำกัน ตามลำดับเดิม)
+        """
+        result = []
+        now = time.monotonic()
+        for key in dict.fromkeys(keys):
+            with self._lock:
+                entry = self._entries.get(key)
+                if (entry is not None and entry[0] > now) or key in self._pending:
+                    continue
+            if self.disk is not None:
+                found, value, expires_at = self.disk.get(self.name, str(key))
+                if found:
+                    with self._lock:
+                        self._store(key, value, expires_at - time.time())
+                    continue
+            result.append(key)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """จำนวน hits / misses (เรียก API) / รายการในหน่วยความจำ"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Event Aggregator - ตัด event ซ้ำ และรวม events ที่เหมือนกันเป็น alert เดียวก่อนส่ง Mattermost
+
+- event ID ที่ส่งแล้วจำไว้ใน LRU ขนาดจำกัด (ดึงซ้ำ/ซ้อนกันก็ไม่ส่งซ้ำ)
+- events ที่มี file hash + เครื่อง + threat type เดียวกันในหน้าต่างเวลา (window) รวมเป็นกลุ่ม:
+  event แรกส่งทันที events ที่ตามมาภายใน window (รวมถึงที่มาพร้อมกันในรอบเดียวกัน) ไม่ส่งแยก
+  แต่นับรวมแล้วส่งเป็น alert สรุปเมื่อ window ปิด
+- นับเข้ากลุ่มตอน commit เฉพาะ events ที่ส่ง/บันทึกแล้วเท่านั้น (events ที่ถูกดึงซ้ำรอบถัดไปไม่ถูกนับสองครั้ง)
+- จำนวน ID / กลุ่มที่จำไว้มีขอบเขต หน่วยความจำไม่โตตามเวลาที่ daemon รัน
+- กลุ่มที่มี events รอแจ้งใน alert สรุปบันทึกลงไฟล์ state (state_path) ก่อน cursor เลื่อนผ่าน
+  restart / crash ระหว่าง window จึงไม่ทำให้ events ที่ถูกรวมไว้หายไป
+
+Environment (optional):
+    MM_AGGREGATE_WINDOW       ความยาว window เป็นวินาที (default: 300, 0 = ไม่รวมกลุ่ม ตัดแค่ ID ซ้ำ)
+    MM_AGGREGATE_MAX_GROUPS   จำนวนกลุ่มที่เปิดอยู่พร้อมกันสูงสุด (default: 1000)
+    MM_SEEN_IDS               จำนวน event ID ที่จำไว้ (default: 10000)
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from state_store import atomic_write_json, load_json
+
+# จำนวน event ID สูงสุดที่เก็บไว้แสดงใน alert ของแต่ละกลุ่ม
+MAX_GROUP_IDS = 20
+
+
+class SeenIds:
+    """ชุดของ key ที่เคยเห็นแล้ว แบบ LRU ขนาดจำกัด"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._keys: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: Hashable):
+        """เพิ่ม key (ลบ key ที่ไม่ได้ใช้นานที่สุดเมื่อเกินความจุ)"""
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
+
+
+def event_occurrences(event: Dict) -> int:
+    """จำนวนครั้งที่เกิดของ event (occurrence_count + reoccurrence_count, อย่างน้อย 1)"""
+    total = 0
+    for field in ('occurrence_count', 'reoccurrence_count'):
+        try:
+            total += int(event.get(field) or 0)
+        except (TypeError, ValueError):
+            pass
+    return max(total, 1)
+
+
+def group_key(stream: str, event: Dict) -> Optional[Tuple]:
+    """
+    key ของกลุ่ม: (stream, file hash, เครื่อง, threat type)
+
+    Returns:
+        None ถ้า event ไม่มี file hash หรือระบุเครื่องไม่ได้ (ไม่รวมกลุ่ม ส่งแยกตามปกติ)
+    """
+    file_hash = event.get('file_hash') or event.get('container_hash')
+    device_info = event.get('recorded_device_info') or {}
+    device = event.get('device_id') or device_info.get('hostname') or event.get('device_name')
+    if not file_hash or not device:
+        return None
+    return (stream, str(file_hash).lower(), str(device).lower(), event.get('threat_type'))
+
+
+class Rollup:
+    """events กลุ่มเดียวกันที่ส่งเป็น alert เดียว"""
+
+    def __init__(self, key: Optional[Tuple], event: Dict):
+        self.key = key
+        self.event = event
+        self.count = 0
+        self.occurrences = 0
+        self.event_ids: List = []
+        self.opened = time.monotonic()
+
+    def add(self, event: Dict):
+        """นับ event เข้ากลุ่ม (event ล่าสุดใช้เป็นตัวแทนของกลุ่ม)"""
+        self.event = event
+        self.count += 1
+        self.occurrences += event_occurrences(event)
+        if len(self.event_ids) < MAX_GROUP_IDS:
+            self.event_ids.append(event.get('id', 'N/A'))
+
+    def to_dict(self) -> Dict:
+        """แปลงเป็น dict สำหรับบันทึกลงไฟล์ state (เวลาที่เปิด window เป็น wall-clock)"""
+        return {
+            'key': list(self.key) if self.key is not None else None,
+            'event': self.event,
+            'count': self.count,
+            'occurrences': self.occurrences,
+            'event_ids': self.event_ids,
+            'opened_at': time.time() - (time.monotonic() - self.opened),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Rollup':
+        """สร้าง Rollup จาก dict ที่บันทึกด้วย to_dict()"""
+        key = data.get('key')
+        rollup = cls(tuple(key) if key is not None else None, data['event'])
+        rollup.count = int(data.get('count') or 0)
+        rollup.occurrences = int(data.get('occurrences') or 0)
+        rollup.event_ids = list(data.get('event_ids') or [])
+        opened_at = float(data.get('opened_at') or time.time())
+        rollup.opened = time.monotonic() - max(time.time() - opened_at, 0.0)
+        return rollup
+
+
+def merge_state_files(sources: Iterable[str], target: str):
+    """
+    ย้ายกลุ่มที่รอแจ้งจากไฟล์ state หลายไฟล์มารวมใน target แล้วลบไฟล์ต้นทาง
+    (เช่น shard ที่ถูกยุบเมื่อจำนวน worker ลดลง) ต้องเรียกขณะที่ไม่มี process ใดใช้ไฟล์เหล่านี้อยู่
+    """
+    sources = [p for p in sources if p != target and os.path.exists(p)]
+    if not sources:
+        return
+    merged = load_json(target, default={}) or {}
+    for path in sources:
+        data = load_json(path, default={}) or {}
+        for section in ('groups', 'ready'):
+            merged.setdefault(section, []).extend(data.get(section) or [])
+    atomic_write_json(target, merged)
+    for path in sources:
+        os.remove(path)
+
+
+class AggregationPlan:
+    """ผลการรวมกลุ่มของ events 1 รอบ (ยังไม่บันทึกสถานะจนกว่าจะ commit)"""
+
+    def __init__(self, stream: str, events: Sequence[Dict]):
+        self.stream = stream
+        self.events = events
+        # alert ที่ต้องส่งของแต่ละ event ตามลำดับ (None = ไม่ต้องส่ง: ซ้ำ หรือรวมอยู่ในกลุ่มแล้ว)
+        self.rollups: List[Optional[Rollup]] = []
+        # event ที่รวมเข้ากลุ่ม (window ที่เปิดจากรอบก่อน หรือ event แรกของกลุ่มในรอบนี้): index -> key
+        # นับเข้ากลุ่มตอน commit เมื่อ event นั้นอยู่ในช่วงที่ส่งแล้วเท่านั้น
+        self.suppressed: Dict[int, Tuple] = {}
+
+    @property
+    def duplicates(self) -> int:
+        """จำนวน events ที่ไม่ต้องส่งแยก"""
+        return sum(1 for r in self.rollups if r is None)
+
+
+class EventAggregator:
+    """ตัด event ซ้ำด้วย LRU และรวม events เป็นกลุ่มตาม window"""
+
+    def __init__(self, window: Optional[float] = None, max_groups: Optional[int] = None,
+                 seen_capacity: Optional[int] = None, state_path: Optional[str] = None):
+        """
+        Args:
+            window: ความยาว window (วินาที) default: MM_AGGREGATE_WINDOW
+            max_groups: จำนวนกลุ่มที่เปิดอยู่สูงสุด default: MM_AGGREGATE_MAX_GROUPS
+            seen_capacity: จำนวน event ID ที่จำไว้ default: MM_SEEN_IDS
+            state_path: ไฟล์ JSON เก็บกลุ่มที่รอแจ้ง (default: ไม่บันทึก เก็บในหน่วยความจำอย่างเดียว)
+        """
+        self.window = float(os.getenv('MM_AGGREGATE_WINDOW', '300') if window is None else window)
+        self.max_groups = max(1, max_groups or int(os.getenv('MM_AGGREGATE_MAX_GROUPS', '1000')))
+        self.seen = SeenIds(seen_capacity or int(os.getenv('MM_SEEN_IDS', '10000')))
+        # กลุ่มที่ส่ง alert แรกไปแล้วและ window ยังเปิดอยู่: key -> Rollup ของ events ที่ตามมา
+        self._groups: OrderedDict = OrderedDict()
+        # กลุ่มที่ window ปิดแล้ว (หรือถูกเบียดออก) และรอส่ง alert สรุป
+        self._ready: List[Rollup] = []
+        self.state_path = state_path
+        if state_path:
+            self._load()
+
+    def _load(self):
+        """อ่านกลุ่มที่รอแจ้งจากไฟล์ state (กลุ่มที่ window ปิดไประหว่างหยุดทำงานจะถูกส่งรอบแรก)"""
+        data = load_json(self.state_path, default={}) or {}
+        try:
+            groups = sorted((Rollup.from_dict(g) for g in data.get('groups') or []), key=lambda g: g.opened)
+            ready = [Rollup.from_dict(g) for g in data.get('ready') or []]
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"⚠️  Cannot read aggregation state {self.state_path}: {e}")
+            return
+        for group in groups:
+            if group.key is None:
+                ready.append(group)
+                continue
+            previous = self._groups.pop(group.key, None)
+            if previous is not None and previous.count:
+                ready.append(previous)
+            self._groups[group.key] = group
+        self._ready = ready
+        if self.pending():
+            print(f"📌 Restored {self.pending()} grouped event(s) awaiting a summary alert")
+
+    def save(self):
+        """
+        บันทึกกลุ่มที่มี events รอแจ้งลงไฟล์ state (ถ้ากำหนด state_path)
+        เรียกก่อนเลื่อน cursor ผ่าน events ที่ถูกรวมไว้ และหลังส่ง alert สรุปแล้ว
+        """
+        if not self.state_path:
+            return
+        data = {
+            'groups': [g.to_dict() for g in self._groups.values() if g.count],
+            'ready': [g.to_dict() for g in self._ready],
+        }
+        try:
+            atomic_write_json(self.state_path, data)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  Cannot save aggregation state: {e}")
+
+    def plan(self, stream: str, events: Sequence[Dict]) -> AggregationPlan:
+        """
+        รวมกลุ่ม events ของรอบนี้ (ไม่เปลี่ยนสถานะ เรียก commit หลังส่งสำเร็จ)
+
+        Args:
+            stream: ชื่อ stream (แยก ID / กลุ่มของแต่ละ stream)
+            events: events ตามลำดับ
+
+        Returns:
+            AggregationPlan
+        """
+        plan = AggregationPlan(stream, events)
+        now = time.monotonic()
+        batch_ids = set()
+        batch_keys = set()
+        for index, event in enumerate(events):
+            event_id = event.get('id')
+            if event_id is not None:
+                if (stream, event_id) in self.seen or event_id in batch_ids:
+                    plan.rollups.append(None)
+                    continue
+                batch_ids.add(event_id)
+
+            key = group_key(stream, event) if self.window > 0 else None
+            if key is None:
+                rollup = Rollup(None, event)
+                rollup.add(event)
+                plan.rollups.append(rollup)
+                continue
+            group = self._groups.get(key)
+            if key in batch_keys or (group is not None and now - group.opened < self.window):
+                # event แรกของกลุ่มในรอบนี้ เปิด window ตอน commit ก่อนถึง index นี้เสมอ
+                plan.suppressed[index] = key
+                plan.rollups.append(None)
+                continue
+            batch_keys.add(key)
+            rollup = Rollup(key, event)
+            rollup.add(event)
+            plan.rollups.append(rollup)
+        return plan
+
+    def commit(self, plan: AggregationPlan, count: int):
+        """
+        บันทึกสถานะของ events ช่วงต้นที่ส่งแล้ว (events ที่เหลือจะถูกดึงและวางแผนใหม่รอบถัดไป)
+
+        Args:
+            plan: ผลจาก plan()
+            count: จำนวน events ช่วงต้นของ plan.events ที่ส่ง/บันทึกแล้ว
+        """
+        self._expire()
+        changed = False
+        for index in range(min(count, len(plan.events))):
+            event = plan.events[index]
+            if event.get('id') is not None:
+                self.seen.add((plan.stream, event['id']))
+            rollup = plan.rollups[index]
+            if rollup is not None and rollup.key is not None:
+                # alert แรกส่งแล้ว: เปิด window สำหรับนับ events ที่ตามมา
+                self._open(rollup.key, rollup.event)
+            elif index in plan.suppressed:
+                key = plan.suppressed[index]
+                group = self._groups.get(key)
+                if group is None:
+                    # window ปิดระหว่าง plan กับ commit: แจ้งใน alert สรุปรอบถัดไป
+                    group = Rollup(key, event)
+                    self._ready.append(group)
+                group.add(event)
+                changed = True
+        if changed:
+            self.save()
+
+    def _open(self, key: Tuple, event: Dict):
+        previous = self._groups.pop(key, None)
+        if previous is not None and previous.count:
+            self._ready.append(previous)
+        # window ใหม่ยังไม่มี event ที่ต้องสรุป (event แรกส่งไปแล้ว)
+        self._groups[key] = Rollup(key, event)
+        while len(self._groups) > self.max_groups:
+            _, evicted = self._groups.popitem(last=False)
+            if evicted.count:
+                self._ready.append(evicted)
+
+    def _expire(self):
+        now = time.monotonic()
+        # กลุ่มเรียงตามเวลาที่เปิด (OrderedDict) หยุดเมื่อพบกลุ่มที่ยังไม่หมด window
+        while self._groups:
+            key, group = next(iter(self._groups.items()))
+            if now - group.opened < self.window:
+                break
+            del self._groups[key]
+            if group.count:
+                self._ready.append(group)
+
+    def take_expired(self) -> List[Rollup]:
+        """ดึงกลุ่มที่ window ปิดแล้วและมี events ที่ยังไม่ได้แจ้ง (เพื่อส่ง alert สรุป)"""
+        self._expire()
+        ready, self._ready = self._ready, []
+        return ready
+
+    def restore(self, rollups: Sequence[Rollup]):
+        """คืนกลุ่มที่ส่ง alert สรุปไม่สำเร็จ เพื่อส่งใหม่รอบถัดไป แล้วบันทึก state"""
+        self._ready[:0] = rollups
+        self.save()
+
+    def pending(self) -> int:
+        """จำนวน events ที่รวมไว้และยังไม่ได้แจ้ง"""
+        return sum(g.count for g in self._groups.values()) + sum(g.count for g in self._ready)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Event Store - เก็บ Events จาก Deep Instinct ลง SQLite แบบ incremental
+ใช้แทนการไล่ดึงจาก API ใหม่ทุกครั้ง: รายงานรายวัน, monitor และการค้นหาย้อนหลัง
+อ่านจาก store ที่มี index (timestamp, วันที่ Bangkok, hostname, tenant_id, file_hash, severity)
+
+ค้นหาจาก command line:
+    python3 event_store.py --date 2026-02-03
+    python3 event_store.py --hostname AP2D10APC670253 --stream suspicious-events
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from state_store import get_state_dir
+
+# Bangkok timezone
+TZ_BANGKOK = timezone(timedelta(hours=7))
+
+# ชื่อ stream ตรงกับ endpoint ของ Deep Instinct API
+STREAM_EVENTS = 'events'
+STREAM_SUSPICIOUS = 'suspicious-events'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    stream TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    timestamp TEXT,
+    bangkok_date TEXT,
+    hostname TEXT,
+    tenant_id INTEGER,
+    file_hash TEXT,
+    severity TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (stream, id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events (stream, bangkok_date);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_hostname ON events (hostname);
+CREATE INDEX IF NOT EXISTS idx_events_tenant ON events (tenant_id);
+CREATE INDEX IF NOT EXISTS idx_events_hash ON events (file_hash);
+CREATE INDEX IF NOT EXISTS idx_events_severity ON events (severity);
+"""
+
+
+def default_store_path() -> str:
+    """path ของไฟล์ SQLite (EVENT_STORE_PATH หรือ STATE_DIR/events.db)"""
+    return os.getenv('EVENT_STORE_PATH') or os.path.join(get_state_dir(), 'events.db')
+
+
+def _bangkok_date(timestamp: Optional[str]) -> Optional[str]:
+    """แปลง ISO timestamp (UTC) เป็นวันที่ Bangkok รูปแบบ YYYY-MM-DD"""
+    if not timestamp:
+        return None
+    try:
+        dt_utc = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return dt_utc.astimezone(TZ_BANGKOK).date().isoformat()
+
+
+class EventStore:
+    """SQLite store สำหรับ Events และ Suspicious Events"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_store_path()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WAL ให้ monitor เขียนและรายงานอ่านพร้อมกันได้
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        """ปิด connection"""
+        with self._lock:
+            self._conn.close()
+
+    def last_id(self, stream: str) -> int:
+        """
+        Event ID ล่าสุดที่เก็บไว้ของ stream
+
+        Returns:
+            ID ล่าสุด หรือ 0 ถ้ายังไม่มีข้อมูล
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT MAX(id) FROM events WHERE stream = ?', (stream,)
+            ).fetchone()
+        return row[0] or 0
+
+    def first_event(self, stream: str) -> Optional[Dict]:
+        """
+        Event ที่ ID ต่ำสุดที่เก็บไว้ของ stream (จุดเริ่มต้นของข้อมูลใน store)
+
+        Returns:
+            Event dict หรือ None ถ้ายังไม่มีข้อมูล
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM events WHERE stream = ? ORDER BY id LIMIT 1', (stream,)
+            ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def add_events(self, stream: str, events: Iterable[Dict]) -> int:
+        """
+        เพิ่ม/อัพเดท events ลง store
+
+        Args:
+            stream: 'events' หรือ 'suspicious-events'
+            events: events จาก API
+
+        Returns:
+            จำนวน events ที่เขียนลง store
+        """
+        rows = []
+        for event in events:
+            if 'id' not in event:
+                continue
+            timestamp = event.get('timestamp') or event.get('insertion_timestamp')
+            device_info = event.get('recorded_device_info') or {}
+            hostname = device_info.get('hostname')
+            rows.append((
+                stream,
+                event['id'],
+                timestamp,
+                _bangkok_date(timestamp),
+                str(hostname).strip().lower() if hostname else None,
+                event.get('tenant_id'),
+                event.get('file_hash'),
+                event.get('threat_severity'),
+                json.dumps({k: v for k, v in event.items() if not k.startswith('_')},
+                           ensure_ascii=False),
+            ))
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO events '
+                '(stream, id, timestamp, bangkok_date, hostname, tenant_id, file_hash, severity, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        return len(rows)
+
+    def query(self, stream: Optional[str] = None, date=None, hostname: Optional[str] = None,
+              tenant_id: Optional[int] = None, file_hash: Optional[str] = None,
+              severity: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """
+        ค้นหา events จาก store (ทุกเงื่อนไขเป็น optional และใช้ index)
+
+        Args:
+            stream: 'events' หรือ 'suspicious-events'
+            date: วันที่ Bangkok (date หรือ 'YYYY-MM-DD')
+            hostname: ชื่อเครื่อง (ไม่สนใจตัวพิมพ์เล็ก-ใหญ่)
+            tenant_id: Tenant ID
+            file_hash: Hash ของไฟล์
+            severity: threat_severity เช่น HIGH
+            limit: จำนวนสูงสุด
+
+        Returns:
+            List ของ events เรียงตาม ID
+        """
+        conditions = []
+        params = []
+        if stream:
+            conditions.append('stream = ?')
+            params.append(stream)
+        if date:
+            conditions.append('bangkok_date = ?')
+            params.append(date.isoformat() if hasattr(date, 'isoformat') else str(date))
+        if hostname:
+            conditions.append('hostname = ?')
+            params.append(str(hostname).strip().lower())
+        if tenant_id is not None:
+            conditions.append('tenant_id = ?')
+            params.append(tenant_id)
+        if file_hash:
+            conditions.append('file_hash = ?')
+            params.append(file_hash)
+        if severity:
+            conditions.append('severity = ?')
+            params.append(severity.upper())
+
+        sql = 'SELECT data FROM events'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY stream, id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def events_for_date(self, stream: str, target_date) -> List[Dict]:
+        """ดึง events ของวันที่กำหนด (ตามเวลา Bangkok)"""
+        return self.query(stream=stream, date=target_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ค้นหา Events จาก local event store (SQLite)")
+    parser.add_argument("--db", help="path ของไฟล์ SQLite (default: EVENT_STORE_PATH หรือ STATE_DIR/events.db)")
+    parser.add_argument("-s", "--stream", choices=[STREAM_EVENTS, STREAM_SUSPICIOUS])
+    parser.add_argument("-d", "--date", help="วันที่ Bangkok รูปแบบ YYYY-MM-DD")
+    parser.add_argument("-n", "--hostname", help="ชื่อเครื่อง")
+    parser.add_argument("-t", "--tenant-id", type=int, help="Tenant ID")
+    parser.add_argument("--hash", dest="file_hash", help="File hash")
+    parser.add_argument("--severity", help="threat_severity เช่น HIGH")
+    parser.add_argument("--limit", type=int, help="จำนวนสูงสุด")
+    parser.add_argument("--json", action="store_true", help="แสดงผลเป็น JSON")
+    args = parser.parse_args()
+
+    if args.db and not os.path.exists(args.db):
+        print(f"ไม่พบไฟล์ {args.db}", file=sys.stderr)
+        sys.exit(1)
+
+    store = EventStore(args.db)
+    events = store.query(stream=args.stream, date=args.date, hostname=args.hostname,
+                         tenant_id=args.tenant_id, file_hash=args.file_hash,
+                         severity=args.severity, limit=args.limit)
+    store.close()
+
+    if args.json:
+        print(json.dumps(events, ensure_ascii=False, indent=2))
+        return
+
+    print(f"พบ {len(events)} รายการ\n")
+    print("-" * 100)
+    print(f"{'ID':<8} {'Timestamp':<28} {'Severity':<10} {'Hostname':<20} {'Tenant':<30}")
+    print("-" * 100)
+    for event in events:
+        hostname = (event.get('recorded_device_info') or {}).get('hostname', '-')
+        print(f"{event.get('id', '-'):<8} {str(event.get('timestamp', '-'))[:27]:<28} "
+              f"{str(event.get('threat_severity', '-')):<10} {str(hostname)[:19]:<20} "
+              f"{str(event.get('tenant_name', '-'))[:29]:<30}")
+    print("-" * 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,24 @@
 ดึงรายการ Device (Hardware) และผู้รับผิดชอบจาก Snip IT / IT Parcel API
 ใช้ .env1: IT_PARCEL_API_URL, IT_PARCEL_TOKEN
 รองรับการค้นหาตามชื่อเครื่องและผู้รับผิดชอบ
+
+ดึงทุกหน้าของ inventory (หลายหน้าพร้อมกัน) และแสดงผลทีละหน้าทันทีที่ได้รับ
+    python3 fetch_snipit_devices.py -n APC670 -f ndjson
+    python3 fetch_snipit_devices.py -r "กองศิลปาชีพ" -f csv > devices.csv
+    python3 fetch_snipit_devices.py --offline -n Desktop    # ใช้ inventory cache บนดิสก์
+    python3 fetch_snipit_devices.py -n "apc 670" --fuzzy    # รวมผลแบบ token (ไม่สนลำดับ/ตัวคั่น)
 """
 import os
 import sys
+import csv
 import json
 import argparse
 import requests
 from pathlib import Path
 
+from asset_index import AssetIndex, key_fields_from_env
+from snipit_inventory import InventoryCache, SnipitClient
+
 # โหลด .env1
 env_path = Path(__file__).resolve().parent / ".env1"
 if env_path.exists():
@@ -24,10 +34,6 @@ if env_path.exists():
 BASE_URL = os.environ.get("IT_PARCEL_API_URL", "").rstrip("/")
 TOKEN = os.environ.get("IT_PARCEL_TOKEN", "")
 
-if not BASE_URL or not TOKEN:
-    print("กรุณาตั้งค่า IT_PARCEL_API_URL และ IT_PARCEL_TOKEN ใน .env1", file=sys.stderr)
-    sys.exit(1)
-
 
 def get_name(row):
     return (
@@ -53,11 +59,59 @@ def get_responsible(row):
     return str(assigned)
 
 
-def match_keyword(text, keyword):
-    """เช็คว่า keyword อยู่ใน text หรือไม่ (ไม่สนใจตัวพิมพ์เล็ก-ใหญ่)"""
-    if not keyword or not text:
-        return True
-    return keyword.lower() in str(text).lower()
+def matching_ids(rows, keyword, key_fields, fuzzy=False):
+    """
+    ค้นหาด้วย AssetIndex ของชุด rows (สร้าง index ครั้งเดียวต่อชุด rows)
+    contains ครอบคลุมแบบตรงตัว / ขึ้นต้นด้วย / มีคำนี้อยู่ (substring ของค่า field ใดๆ)
+    fuzzy=True: รวมผลแบบ token ด้วย
+
+    Returns:
+        set ของ id(row) ที่ตรงกับ keyword
+    """
+    # record เป็น id(row): row ที่ค่าเหมือนกันทุก field ยังแยกกัน (ไม่ถูกรวมเป็น record เดียว)
+    index = AssetIndex(rows, key_fields=key_fields, record=id)
+    ids = set(index.contains(keyword))
+    if fuzzy:
+        ids.update(index.fuzzy(keyword, limit=None))
+    return ids
+
+
+def iter_inventory_pages(args):
+    """
+    Generator คืนค่า rows ทีละหน้าตามแหล่งข้อมูลที่เลือก
+    --offline: cache บนดิสก์อย่างเดียว, --cache: cache (refresh ถ้าหมดอายุ), ปกติ: ดึงจาก API ทุกหน้า
+    """
+    if args.offline:
+        yield InventoryCache().load_cached()
+        return
+    if not BASE_URL or not TOKEN:
+        print("กรุณาตั้งค่า IT_PARCEL_API_URL และ IT_PARCEL_TOKEN ใน .env1", file=sys.stderr)
+        sys.exit(1)
+    client = SnipitClient(BASE_URL, TOKEN)
+    if args.cache:
+        yield InventoryCache().load_rows(client)
+        return
+    yield from client.iter_pages_parallel(workers=args.workers)
+
+
+def filter_page(rows, name=None, responsible=None, fuzzy=False):
+    """
+    กรอง rows 1 หน้าตามคำค้น (ชื่อเครื่อง และ/หรือ ผู้รับผิดชอบ) โดยคงลำดับเดิม
+    ค้นหาผ่าน AssetIndex ของหน้านี้ / ของ inventory cache ทั้งก้อน (-r ใช้ index ของ assigned_to)
+    fuzzy=True: ชื่อเครื่องรวมผลแบบ token ด้วย
+    """
+    if not name and not responsible:
+        return rows
+    name_ids = matching_ids(rows, name, key_fields_from_env(), fuzzy) if name else None
+    resp_ids = matching_ids(rows, responsible, ("assigned_to",)) if responsible else None
+    return [
+        row for row in rows
+        if (name_ids is None or id(row) in name_ids)
+        and (resp_ids is None or id(row) in resp_ids)
+    ]
+
+
+CSV_COLUMNS = ["id", "name", "asset_tag", "serial", "responsible"]
 
 
 def main():
@@ -74,66 +128,84 @@ def main():
         metavar="คำค้น",
         help="ค้นหาตามผู้รับผิดชอบ (ชื่อคนหรือหน่วย)",
     )
+    parser.add_argument(
+        "-f", "--format",
+        choices=["table", "ndjson", "csv"],
+        default="table",
+        help="รูปแบบผลลัพธ์ (default: table)",
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        help="จำนวนหน้าที่ดึงพร้อมกัน (default: SNIPIT_CRAWL_WORKERS หรือ 8, 1 = ทีละหน้า)",
+    )
+    parser.add_argument(
+        "--fuzzy",
+        action="store_true",
+        help="ค้นหาชื่อเครื่องแบบ token เพิ่มเติม (ไม่สนลำดับ/ตัวคั่น เช่น \"apc 670\")",
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--cache",
+        action="store_true",
+        help="ใช้ inventory cache บนดิสก์ (ดึงใหม่เฉพาะเมื่อหมดอายุ)",
+    )
+    source.add_argument(
+        "--offline",
+        action="store_true",
+        help="ใช้ inventory cache บนดิสก์อย่างเดียว ไม่เรียก API",
+    )
     args = parser.parse_args()
 
-    url = f"{BASE_URL}/hardware"
-    headers = {"Authorization": f"Bearer {TOKEN}", "Accept": "application/json"}
-    params = {"limit": 500}
-
+    # ข้อความสถานะไปที่ stderr เมื่อส่งออกเป็น NDJSON/CSV เพื่อให้ stdout เป็นข้อมูลล้วน
+    info = sys.stdout if args.format == "table" else sys.stderr
+    if args.name:
+        print(f"ค้นหา 'ชื่อเครื่อง' ตรงกับ: {args.name}", file=info)
+    if args.responsible:
+        print(f"ค้นหา 'ผู้รับผิดชอบ' ตรงกับ: {args.responsible}", file=info)
+
+    writer = csv.writer(sys.stdout) if args.format == "csv" else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+    elif args.format == "table":
+        print("-" * 80)
+        print(f"{'ลำดับ':<6} {'ชื่อเครื่อง / Asset':<35} {'ผู้รับผิดชอบ':<30}")
+        print("-" * 80)
+
+    scanned = 0
+    found = 0
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        r.raise_for_status()
-        data = r.json()
+        # กรองและแสดงผลทีละหน้าทันทีที่ได้รับ ไม่ต้องรอ inventory ครบ
+        for page in iter_inventory_pages(args):
+            scanned += len(page)
+            for row in filter_page(page, args.name, args.responsible, args.fuzzy):
+                found += 1
+                if args.format == "ndjson":
+                    print(json.dumps(row, ensure_ascii=False))
+                elif writer:
+                    writer.writerow([row.get("id", ""), get_name(row), row.get("asset_tag", ""),
+                                     row.get("serial", ""), get_responsible(row)])
+                else:
+                    name_str = str(get_name(row))[:34]
+                    resp_str = str(get_responsible(row))[:29]
+                    print(f"{found:<6} {name_str:<35} {resp_str:<30}")
+            sys.stdout.flush()
     except requests.RequestException as e:
         print(f"เชื่อมต่อ API ไม่ได้: {e}", file=sys.stderr)
         if hasattr(e, "response") and e.response is not None:
             print(f"Status: {e.response.status_code}", file=sys.stderr)
             print(e.response.text[:500], file=sys.stderr)
         sys.exit(1)
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         print(f"ตอบกลับไม่ใช่ JSON: {e}", file=sys.stderr)
         sys.exit(1)
 
-    rows = data.get("rows") or data.get("data") or []
-    if not rows and isinstance(data, list):
-        rows = data
-
-    if not rows:
-        print("ไม่มีข้อมูล hardware ในระบบ (หรือ API ส่งรูปแบบอื่น)")
-        print("Response keys:", list(data.keys()) if isinstance(data, dict) else "list")
+    if args.format == "table":
+        print("-" * 80)
+    if not scanned:
+        print("ไม่มีข้อมูล hardware ในระบบ (หรือ API ส่งรูปแบบอื่น)", file=info)
         return
-
-    # กรองตามคำค้น (ชื่อเครื่อง และ/หรือ ผู้รับผิดชอบ)
-    if args.name or args.responsible:
-        filtered = []
-        for row in rows:
-            name = get_name(row)
-            resp = get_responsible(row)
-            ok_name = match_keyword(name, args.name)
-            ok_resp = match_keyword(resp, args.responsible)
-            if ok_name and ok_resp:
-                filtered.append(row)
-        rows = filtered
-        if args.name:
-            print(f"ค้นหา 'ชื่อเครื่อง' มีคำว่า: {args.name}")
-        if args.responsible:
-            print(f"ค้นหา 'ผู้รับผิดชอบ' มีคำว่า: {args.responsible}")
-        print(f"พบ {len(rows)} รายการ\n")
-    else:
-        print(f"พบ {len(rows)} รายการ\n")
-
-    print("-" * 80)
-    print(f"{'ลำดับ':<6} {'ชื่อเครื่อง / Asset':<35} {'ผู้รับผิดชอบ':<30}")
-    print("-" * 80)
-
-    for i, row in enumerate(rows, 1):
-        name = get_name(row)
-        responsible = get_responsible(row)
-        name_str = str(name)[:34]
-        resp_str = str(responsible)[:29]
-        print(f"{i:<6} {name_str:<35} {resp_str:<30}")
-
-    print("-" * 80)
+    print(f"พบ {found} รายการ (จากทั้งหมด {scanned} รายการ)", file=info)
 
 
 if __name__ == "__main__":
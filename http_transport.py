@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+HTTP Transport - connection pool กลางที่ทุก client ใช้ร่วมกัน
+(Deep Instinct, Mattermost, Snip IT / IT Parcel)
+
+- 1 requests.Session ต่อ host (keep-alive) ไม่ต้อง handshake TCP+TLS ใหม่ทุก request
+- timeout, ขนาด pool และจำนวนครั้งที่ลองใหม่ตั้งค่าได้จาก environment
+- ลองใหม่ด้วย exponential backoff แบบ jitter และเคารพ Retry-After เมื่อเจอ 429/503
+
+Environment (optional):
+    HTTP_POOL_SIZE      จำนวน connection สูงสุดต่อ host (default: 10)
+    HTTP_TIMEOUT        timeout ต่อ request เป็นวินาที (default: 30)
+    HTTP_RETRIES        จำนวนครั้งที่ลองใหม่ (default: 3)
+    HTTP_BACKOFF        backoff เริ่มต้นเป็นวินาที (default: 0.5)
+    HTTP_BACKOFF_MAX    backoff / Retry-After สูงสุดเป็นวินาที (default: 60)
+"""
+
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# method ที่ลองใหม่ได้อย่างปลอดภัย (ส่งซ้ำแล้วผลไม่เปลี่ยน)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+def _env_number(name: str, default, cast=int):
+    """อ่านค่าตัวเลขจาก environment (ใช้ default ถ้าไม่ได้ตั้งหรือค่าไม่ถูกต้อง)"""
+    try:
+        return cast(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def retry_delay(attempt: int, retry_after: Optional[str], backoff: float, backoff_max: float) -> float:
+    """
+    เวลารอก่อนลองใหม่ (ใช้ร่วมกับ client แบบ async เพื่อให้นโยบายเดียวกัน)
+
+    Args:
+        attempt: ครั้งที่ลองใหม่ (เริ่มที่ 0)
+        retry_after: ค่า header Retry-After (วินาที หรือ HTTP date) หรือ None
+        backoff: backoff เริ่มต้น (วินาที)
+        backoff_max: เวลารอสูงสุด (วินาที)
+
+    Returns:
+        Retry-After (ไม่เกิน backoff_max) หรือ exponential backoff แบบ full jitter
+    """
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                until = parsedate_to_datetime(retry_after)
+                seconds = (until - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return min(max(seconds, 0.0), backoff_max)
+    return random.uniform(0, min(backoff_max, backoff * (2 ** attempt)))
+
+
+class HttpTransport:
+    """Connection pool ต่อ host พร้อม retry/backoff"""
+
+    def __init__(self, pool_size: Optional[int] = None, timeout: Optional[float] = None,
+                 retries: Optional[int] = None, backoff: Optional[float] = None,
+                 backoff_max: Optional[float] = None):
+        self.pool_size = pool_size or _env_number('HTTP_POOL_SIZE', 10)
+        self.timeout = timeout or _env_number('HTTP_TIMEOUT', 30, float)
+        self.retries = _env_number('HTTP_RETRIES', 3) if retries is None else retries
+        self.backoff = backoff or _env_number('HTTP_BACKOFF', 0.5, float)
+        self.backoff_max = backoff_max or _env_number('HTTP_BACKOFF_MAX', 60, float)
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url: str) -> requests.Session:
+        """คืนค่า Session (keep-alive pool) ของ host ใน url"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(f"{parts.scheme}://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def _delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """เวลารอก่อนลองใหม่: Retry-After (ถ้ามี) หรือ exponential backoff แบบ full jitter"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        return retry_delay(attempt, retry_after, self.backoff, self.backoff_max)
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """
+        ส่ง HTTP request ผ่าน connection pool
+
+        Args:
+            method: HTTP method
+            url: URL ปลายทาง
+            idempotent: ส่งซ้ำได้อย่างปลอดภัยหรือไม่ (default: ตาม method)
+                        POST ที่เป็นการค้นหา เช่น /events/search ให้ส่ง True
+            **kwargs: ส่งต่อให้ requests (params, json, headers, timeout, ...)
+
+        Returns:
+            requests.Response (ผู้เรียกต้อง raise_for_status เอง เหมือน requests.get/post)
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.session_for(url)
+
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # request ที่ไม่ idempotent ลองใหม่ได้เฉพาะกรณีที่ยังเชื่อมต่อไม่สำเร็จ
+                safe = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if attempt >= self.retries or not safe:
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+
+            # 429 = server ยังไม่ได้ประมวลผล จึงลองใหม่ได้ทุก method
+            retryable = response.status_code == 429 or (
+                idempotent and response.status_code in RETRY_STATUS
+            )
+            if not retryable or attempt >= self.retries:
+                return response
+            delay = self._delay(attempt, response)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """ปิด connection ทั้งหมด"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_default_transport: Optional[HttpTransport] = None
+_default_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """คืนค่า transport กลางของ process (สร้างครั้งแรกที่เรียก)"""
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """ส่ง request ผ่าน transport กลาง"""
+    return get_transport().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """GET ผ่าน transport กลาง (ใช้แทน requests.get)"""
+    return get_transport().get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """POST ผ่าน transport กลาง (ใช้แทน requests.post)"""
+    return get_transport().post(url, **kwargs)
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Mattermost Delivery - ส่ง attachments ไปยัง Mattermost webhook แบบรวมหลายรายการต่อ 1 post
+และจำกัดอัตราการส่งด้วย token bucket (แทนการ sleep คงที่หลังทุก post)
+
+Environment (optional):
+    MM_BATCH_SIZE        จำนวน attachments สูงสุดต่อ 1 post (default: 10, 1 = ส่งทีละรายการ)
+    MM_BATCH_MAX_BYTES   ขนาด JSON ของ attachments สูงสุดต่อ 1 post (default: 50000)
+    MM_RATE_PER_SEC      จำนวน post ต่อวินาทีโดยเฉลี่ย (default: 2)
+    MM_RATE_BURST        จำนวน post ที่ส่งติดกันได้ทันทีก่อนถูกจำกัด (default: 5)
+
+Outbox (DeliveryQueue): monitor บันทึก attachments ลง outbox (SQLite) แล้วทำงานต่อทันที
+worker ใน background ส่งไปยัง Mattermost, ลองใหม่แบบ backoff เมื่อส่งไม่สำเร็จ
+และย้ายไป dead letter เมื่อเกินจำนวนครั้ง (ไม่หายไปไหน ส่งใหม่ได้ด้วย --requeue-dead)
+    MM_OUTBOX            on/off (default: on)
+    MM_OUTBOX_PATH       path ของไฟล์ SQLite (default: STATE_DIR/outbox.db)
+    MM_SENDER_WORKERS    จำนวน worker ที่ส่งพร้อมกัน (default: 1 = ส่งตามลำดับที่ตรวจพบเสมอ
+                         มากกว่า 1 = ส่งหลาย post พร้อมกัน แต่ alert อาจสลับลำดับเมื่อมีการส่งใหม่)
+    MM_QUEUE_SIZE        จำนวน post ที่รอส่งในหน่วยความจำ (default: 20)
+    MM_MAX_ATTEMPTS      จำนวนครั้งที่ลองส่งก่อนย้ายไป dead letter (default: 50)
+    MM_RETRY_BACKOFF     backoff เริ่มต้นเป็นวินาที (default: 5)
+    MM_RETRY_BACKOFF_MAX backoff สูงสุดเป็นวินาที (default: 600)
+
+ดู / ส่งใหม่ dead letter:
+    python3 mattermost_delivery.py --status
+    python3 mattermost_delivery.py --requeue-dead
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import sqlite3
+import argparse
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from state_store import get_state_dir
+
+
+class TokenBucket:
+    """Token bucket แบบ thread-safe: เติม rate tokens ต่อวินาที เก็บได้สูงสุด burst tokens"""
+
+    def __init__(self, rate: float, burst: float):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        ขอ tokens โดยไม่รอ
+
+        Returns:
+            0 ถ้าได้ tokens แล้ว หรือจำนวนวินาทีที่ต้องรอก่อนจะมี tokens พอ
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        รอจนได้ tokens
+
+        Returns:
+            เวลาที่รอทั้งหมด (วินาที)
+        """
+        waited = 0.0
+        while True:
+            delay = self.try_acquire(tokens)
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+def attachment_size(attachment: Dict) -> int:
+    """ขนาด JSON (bytes) ของ attachment"""
+    return len(json.dumps(attachment, ensure_ascii=False).encode('utf-8'))
+
+
+class BatchDelivery:
+    """รวม attachments หลายรายการเป็น 1 post ตามขนาดที่กำหนด และส่งผ่าน token bucket"""
+
+    def __init__(self, send_message: Callable[..., bool], batch_size: Optional[int] = None,
+                 max_bytes: Optional[int] = None, bucket: Optional[TokenBucket] = None):
+        """
+        Args:
+            send_message: ฟังก์ชันส่ง (text, attachments=...) -> bool เช่น MattermostNotifier.send_message
+            batch_size: จำนวน attachments สูงสุดต่อ post (default: MM_BATCH_SIZE)
+            max_bytes: ขนาด attachments สูงสุดต่อ post (default: MM_BATCH_MAX_BYTES)
+            bucket: TokenBucket (default: จาก MM_RATE_PER_SEC / MM_RATE_BURST)
+        """
+        self.send_message = send_message
+        self.batch_size = max(1, batch_size or int(os.getenv('MM_BATCH_SIZE', '10')))
+        self.max_bytes = max_bytes or int(os.getenv('MM_BATCH_MAX_BYTES', '50000'))
+        self.bucket = bucket or TokenBucket(float(os.getenv('MM_RATE_PER_SEC', '2')),
+                                            float(os.getenv('MM_RATE_BURST', '5')))
+
+    def _send_batch(self, attachments: List[Dict]) -> bool:
+        self.bucket.acquire()
+        return self.send_message('', attachments=attachments)
+
+    def deliver(self, attachments: Sequence[Optional[Dict]],
+                on_sent: Optional[Callable[[int, int], None]] = None) -> int:
+        """
+        ส่ง attachments ตามลำดับ (รวมเป็น post ละหลายรายการ)
+
+        หยุดทันทีที่ส่ง post ไม่สำเร็จ เพื่อให้ผู้เรียกเลื่อน cursor เฉพาะช่วงที่ส่งถึงแล้ว
+
+        Args:
+            attachments: attachment ของแต่ละ event ตามลำดับ (None = ข้าม เช่น format ไม่ได้)
+            on_sent: callback(start, end) เมื่อส่ง post สำเร็จ (ช่วง index [start, end) ของ attachments)
+
+        Returns:
+            จำนวนรายการช่วงต้นของ attachments ที่ส่งแล้ว (รวมรายการที่ข้าม)
+        """
+        indexed = [(i, a) for i, a in enumerate(attachments) if a is not None]
+        # รายการที่ข้ามช่วงต้น (ก่อน attachment แรก) นับว่าเสร็จทันที
+        done = indexed[0][0] if indexed else len(attachments)
+        batches = pack_batches(indexed, self.batch_size, self.max_bytes, attachment=lambda item: item[1])
+        position = 0
+        for batch in batches:
+            if not self._send_batch([a for _, a in batch]):
+                return done
+            # รายการที่ข้ามหลัง post นี้นับรวมไปจนถึง attachment ถัดไป
+            position += len(batch)
+            end = indexed[position][0] if position < len(indexed) else len(attachments)
+            if on_sent:
+                on_sent(done, end)
+            done = end
+        return done
+
+
+def pack_batches(items: Sequence, batch_size: int, max_bytes: int,
+                 attachment: Callable = lambda item: item) -> List[List]:
+    """
+    แบ่ง items เป็นกลุ่มตามลำดับ กลุ่มละไม่เกิน batch_size รายการและขนาดรวมไม่เกิน max_bytes
+    (attachment ที่ใหญ่กว่า max_bytes อยู่กลุ่มเดียวตามลำพัง)
+
+    Args:
+        items: รายการที่จะแบ่ง
+        batch_size: จำนวนสูงสุดต่อกลุ่ม
+        max_bytes: ขนาด JSON รวมสูงสุดต่อกลุ่ม
+        attachment: ฟังก์ชันดึง attachment จาก item
+
+    Returns:
+        List ของกลุ่ม
+    """
+    batches: List[List] = []
+    batch: List = []
+    batch_bytes = 0
+    for item in items:
+        size = attachment_size(attachment(item))
+        if batch and (len(batch) >= batch_size or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+_OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    attachment TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    UNIQUE (stream, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt, id);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    attachment TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+
+class Outbox:
+    """Outbox บนดิสก์ (SQLite) เก็บ attachments ที่ยังส่งไม่สำเร็จ และ dead letter"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('MM_OUTBOX_PATH') or os.path.join(get_state_dir(), 'outbox.db')
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_OUTBOX_SCHEMA)
+
+    def close(self):
+        """ปิด connection"""
+        with self._lock:
+            self._conn.close()
+
+    def add(self, items: Iterable[Tuple[str, object, Dict]]) -> int:
+        """
+        บันทึก attachments ลง outbox (รายการที่มีอยู่แล้วจะไม่ถูกเพิ่มซ้ำ)
+
+        Args:
+            items: (stream, event_id, attachment)
+
+        Returns:
+            จำนวนรายการที่เพิ่มใหม่
+        """
+        now = time.time()
+        rows = [(stream, str(event_id), json.dumps(attachment, ensure_ascii=False), now)
+                for stream, event_id, attachment in items]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO outbox (stream, event_id, attachment, created_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            return self._conn.total_changes - before
+
+    def due(self, limit: int, exclude: Iterable[int] = (), ordered: bool = False) -> List[Tuple[int, Dict]]:
+        """
+        รายการที่ถึงเวลาส่ง เรียงตามลำดับที่บันทึก
+
+        Args:
+            limit: จำนวนรายการสูงสุด
+            exclude: id ที่กำลังส่งอยู่
+            ordered: True = เฉพาะรายการช่วงต้นของ outbox ที่ถึงเวลาแล้ว
+                     (รายการเก่าสุดที่ยังรอ backoff กั้นรายการหลังจากนั้นไว้ ไม่ให้ส่งแซง)
+
+        Returns:
+            List ของ (id, attachment)
+        """
+        exclude = set(exclude)
+        now = time.time()
+        with self._lock:
+            if ordered:
+                rows = self._conn.execute(
+                    'SELECT id, attachment, next_attempt FROM outbox ORDER BY id LIMIT ?',
+                    (limit + len(exclude),)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    'SELECT id, attachment, next_attempt FROM outbox WHERE next_attempt <= ? ORDER BY id LIMIT ?',
+                    (now, limit + len(exclude))
+                ).fetchall()
+        due = []
+        for row_id, data, next_attempt in rows:
+            if row_id in exclude:
+                continue
+            if next_attempt > now:
+                break
+            due.append((row_id, json.loads(data)))
+            if len(due) >= limit:
+                break
+        return due
+
+    def next_due_in(self) -> Optional[float]:
+        """จำนวนวินาทีจนถึงรายการถัดไปที่ต้องส่ง (None ถ้า outbox ว่าง)"""
+        with self._lock:
+            row = self._conn.execute('SELECT MIN(next_attempt) FROM outbox').fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0.0)
+
+    def ack(self, ids: Sequence[int]):
+        """ลบรายการที่ส่งสำเร็จ"""
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+
+    def retry_later(self, ids: Sequence[int], error: str, backoff: float, backoff_max: float,
+                    max_attempts: int) -> int:
+        """
+        เลื่อนเวลาส่งรายการที่ส่งไม่สำเร็จ (exponential backoff + jitter)
+        รายการที่ครบ max_attempts จะย้ายไป dead letter
+
+        Returns:
+            จำนวนรายการที่ย้ายไป dead letter
+        """
+        now = time.time()
+        dead = 0
+        with self._lock, self._conn:
+            for row_id in ids:
+                row = self._conn.execute('SELECT attempts FROM outbox WHERE id = ?', (row_id,)).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0] + 1
+                if max_attempts and attempts >= max_attempts:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO dead_letter '
+                        '(id, stream, event_id, attachment, attempts, created_at, failed_at, last_error) '
+                        'SELECT id, stream, event_id, attachment, ?, created_at, ?, ? FROM outbox WHERE id = ?',
+                        (attempts, now, error, row_id)
+                    )
+                    self._conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+                    dead += 1
+                    continue
+                delay = min(backoff_max, backoff * (2 ** (attempts - 1))) * random.uniform(0.5, 1.0)
+                self._conn.execute(
+                    'UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?',
+                    (attempts, now + delay, error, row_id)
+                )
+        return dead
+
+    def requeue_dead(self) -> int:
+        """ย้ายทุกรายการใน dead letter กลับเข้า outbox เพื่อส่งใหม่"""
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.execute(
+                'INSERT OR IGNORE INTO outbox (stream, event_id, attachment, created_at) '
+                'SELECT stream, event_id, attachment, created_at FROM dead_letter ORDER BY id'
+            )
+            moved = self._conn.total_changes - before
+            self._conn.execute('DELETE FROM dead_letter')
+        return moved
+
+    def counts(self) -> Dict[str, int]:
+        """จำนวนรายการที่รอส่ง และใน dead letter"""
+        with self._lock:
+            pending = self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+            dead = self._conn.execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+        return {'pending': pending, 'dead': dead}
+
+
+class DeliveryQueue:
+    """
+    ส่ง attachments จาก outbox ไปยัง Mattermost ด้วย worker threads
+
+    dispatcher ดึงรายการที่ถึงเวลาจาก outbox รวมเป็น post แล้วใส่คิวในหน่วยความจำ (จำกัดขนาด)
+    worker ส่ง post ผ่าน token bucket: สำเร็จ = ลบจาก outbox, ไม่สำเร็จ = เลื่อนเวลาส่ง (backoff)
+
+    worker เดียว (default): ส่งทีละ post ตามลำดับใน outbox และส่ง post ถัดไปหลัง post ก่อนหน้าสำเร็จแล้วเท่านั้น
+    alert จึงถึง channel ตามลำดับที่ตรวจพบเหมือนการส่งตรง แม้มีการส่งใหม่หลัง error
+    """
+
+    def __init__(self, outbox: Outbox, send_message: Callable[..., bool], workers: Optional[int] = None,
+                 queue_size: Optional[int] = None, batch_size: Optional[int] = None,
+                 max_bytes: Optional[int] = None, bucket: Optional[TokenBucket] = None):
+        self.outbox = outbox
+        self.send_message = send_message
+        self.workers = max(1, workers or int(os.getenv('MM_SENDER_WORKERS', '1')))
+        # worker เดียว = รักษาลำดับ (1 post ที่กำลังส่ง และรายการเก่าสุดกั้นรายการหลังจากนั้น)
+        self.ordered = self.workers == 1
+        self.batch_size = max(1, batch_size or int(os.getenv('MM_BATCH_SIZE', '10')))
+        self.max_bytes = max_bytes or int(os.getenv('MM_BATCH_MAX_BYTES', '50000'))
+        self.bucket = bucket or TokenBucket(float(os.getenv('MM_RATE_PER_SEC', '2')),
+                                            float(os.getenv('MM_RATE_BURST', '5')))
+        self.max_attempts = int(os.getenv('MM_MAX_ATTEMPTS', '50'))
+        self.backoff = float(os.getenv('MM_RETRY_BACKOFF', '5'))
+        self.backoff_max = float(os.getenv('MM_RETRY_BACKOFF_MAX', '600'))
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or int(os.getenv('MM_QUEUE_SIZE', '20')))
+        self._inflight: set = set()
+        self._inflight_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def enqueue(self, stream: str, events: Sequence[Dict], attachments: Sequence[Optional[Dict]]) -> int:
+        """
+        บันทึก attachments ของ events ลง outbox (durable) แล้วคืนค่าทันทีโดยไม่รอส่ง
+
+        Args:
+            stream: ชื่อ stream (ใช้กันบันทึกซ้ำร่วมกับ event id)
+            events: events ตามลำดับ
+            attachments: attachment ของแต่ละ event (None = ข้าม)
+
+        Returns:
+            จำนวน events ที่บันทึกแล้ว (ทั้งหมด) ให้ผู้เรียกเลื่อน cursor ได้
+        """
+        self.outbox.add(
+            (stream, event.get('id', f"{time.time()}-{i}"), attachment)
+            for i, (event, attachment) in enumerate(zip(events, attachments)) if attachment is not None
+        )
+        self._wake.set()
+        return len(events)
+
+    def start(self):
+        """เริ่ม dispatcher และ worker threads"""
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads.append(threading.Thread(target=self._dispatch, name='mm-dispatch', daemon=True))
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f'mm-sender-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10):
+        """หยุด threads (รายการที่ยังไม่ส่งยังอยู่ใน outbox และจะถูกส่งเมื่อเริ่มใหม่)"""
+        self._stop.set()
+        self._wake.set()
+        for _ in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+    def flush(self, timeout: float = 30) -> bool:
+        """รอจน outbox ไม่มีรายการที่ถึงเวลาส่งค้างอยู่ (True ถ้าส่งหมดภายในเวลา)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._inflight_lock:
+                busy = bool(self._inflight)
+            if not busy and not self.outbox.due(1):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            with self._inflight_lock:
+                inflight = set(self._inflight)
+            if self.ordered and inflight:
+                # รอ post ก่อนหน้าส่งเสร็จ (สำเร็จหรือเลื่อนเวลา) ก่อนเลือก post ถัดไป
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+                continue
+            limit = self.batch_size if self.ordered else self.batch_size * self._queue.maxsize
+            rows = self.outbox.due(limit, exclude=inflight, ordered=self.ordered)
+            if not rows:
+                wait = self.outbox.next_due_in()
+                self._wake.wait(timeout=1.0 if wait is None else min(max(wait, 0.05), 1.0))
+                self._wake.clear()
+                continue
+            batches = pack_batches(rows, self.batch_size, self.max_bytes, attachment=lambda row: row[1])
+            for batch in batches[:1] if self.ordered else batches:
+                ids = [row_id for row_id, _ in batch]
+                with self._inflight_lock:
+                    self._inflight.update(ids)
+                while not self._stop.is_set():
+                    try:
+                        # คิวเต็ม = Mattermost ส่งไม่ทัน: รอ (ไม่กระทบ polling เพราะ monitor แค่บันทึกลง outbox)
+                        self._queue.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                else:
+                    with self._inflight_lock:
+                        self._inflight.difference_update(ids)
+                    return
+
+    def _work(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None or self._stop.is_set():
+                if batch is not None:
+                    with self._inflight_lock:
+                        self._inflight.difference_update(row_id for row_id, _ in batch)
+                return
+            ids = [row_id for row_id, _ in batch]
+            try:
+                self.bucket.acquire()
+                ok = self.send_message('', attachments=[attachment for _, attachment in batch])
+            except Exception as e:
+                print(f"❌ Error sending to Mattermost: {e}")
+                ok = False
+            try:
+                if ok:
+                    self.outbox.ack(ids)
+                    print(f"✅ Delivered {len(ids)} attachment(s) from outbox")
+                else:
+                    dead = self.outbox.retry_later(ids, 'send failed', self.backoff, self.backoff_max,
+                                                   self.max_attempts)
+                    if dead:
+                        print(f"☠️  Moved {dead} attachment(s) to dead letter "
+                              f"(re-send with: python3 mattermost_delivery.py --requeue-dead)")
+            finally:
+                with self._inflight_lock:
+                    self._inflight.difference_update(ids)
+                self._wake.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ดูสถานะ / ส่งใหม่ dead letter ของ Mattermost outbox")
+    parser.add_argument("--db", help="path ของไฟล์ outbox (default: MM_OUTBOX_PATH หรือ STATE_DIR/outbox.db)")
+    parser.add_argument("--status", action="store_true", help="แสดงจำนวนรายการที่รอส่ง / dead letter")
+    parser.add_argument("--requeue-dead", action="store_true", help="ย้าย dead letter กลับเข้า outbox")
+    args = parser.parse_args()
+
+    if args.db and not os.path.exists(args.db):
+        print(f"ไม่พบไฟล์ {args.db}", file=sys.stderr)
+        sys.exit(1)
+
+    outbox = Outbox(args.db)
+    if args.requeue_dead:
+        print(f"♻️  Requeued {outbox.requeue_dead()} attachment(s) (monitor จะส่งในรอบถัดไป)")
+    counts = outbox.counts()
+    print(f"📮 Outbox: {outbox.path}")
+    print(f"   Pending: {counts['pending']}")
+    print(f"   Dead letter: {counts['dead']}")
+    outbox.close()
+
+
+if __name__ == "__main__":
+    main()
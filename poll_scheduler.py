@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Poll Scheduler - กำหนดเวลา polling ของ monitor แบบไม่ drift และปรับความถี่ตามปริมาณ events
+
+- นับรอบจาก deadline บน monotonic clock (เวลาที่ใช้ดึง/ส่งไม่ถูกบวกเพิ่มในแต่ละรอบ)
+- รอบที่ใช้เวลานานกว่าคาบ: เริ่มรอบถัดไปทันทีโดยไม่ไล่ชดเชยรอบที่ข้ามไป
+- ไม่พบ events: ยืดคาบทีละ POLL_BACKOFF เท่า จนถึง POLL_MAX_INTERVAL (ลดโหลด API ตอนเงียบ)
+- พบ events: กลับไปใช้คาบสั้นสุด POLL_MIN_INTERVAL ทันที (ลด latency ช่วงเกิดเหตุ)
+
+Environment (optional):
+    POLLING_INTERVAL    คาบปกติ (วินาที) ใช้ตอนเริ่มต้น (default: 300)
+    POLL_MIN_INTERVAL   คาบสั้นสุดเมื่อพบ events (default: POLLING_INTERVAL)
+    POLL_MAX_INTERVAL   คาบยาวสุดเมื่อไม่พบ events (default: POLLING_INTERVAL)
+    POLL_BACKOFF        ตัวคูณคาบเมื่อไม่พบ events (default: 1.5)
+    (default คือคาบคงที่ POLLING_INTERVAL เหมือนเดิม ตั้ง POLL_MIN_INTERVAL / POLL_MAX_INTERVAL
+     ให้ต่างจาก POLLING_INTERVAL เพื่อเปิดการปรับคาบ)
+"""
+
+import os
+import time
+from typing import Callable, Optional
+
+
+class PollScheduler:
+    """คำนวณ deadline ของรอบ polling ถัดไปจากผลของรอบก่อน"""
+
+    def __init__(self, interval: float, min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, backoff: float = 1.5,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            interval: คาบเริ่มต้น (วินาที)
+            min_interval: คาบสั้นสุดเมื่อพบ events (default: interval)
+            max_interval: คาบยาวสุดเมื่อไม่พบ events (default: interval)
+            backoff: ตัวคูณคาบเมื่อไม่พบ events
+        """
+        self.interval = float(interval)
+        self.min_interval = float(min(min_interval or interval, interval))
+        self.max_interval = float(max(max_interval or interval, interval))
+        if self.min_interval <= 0:
+            raise ValueError("polling interval must be positive")
+        self.backoff = max(float(backoff), 1.0)
+        self.period = self.interval
+        self.last_cost = 0.0
+        self.overruns = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._cycle_start: Optional[float] = None
+        self._deadline: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, interval: Optional[float] = None) -> 'PollScheduler':
+        """สร้างจาก POLLING_INTERVAL / POLL_MIN_INTERVAL / POLL_MAX_INTERVAL / POLL_BACKOFF"""
+        if interval is None:
+            interval = float(os.getenv('POLLING_INTERVAL', '300'))
+        interval = float(interval)
+        return cls(interval,
+                   min_interval=float(os.getenv('POLL_MIN_INTERVAL') or interval),
+                   max_interval=float(os.getenv('POLL_MAX_INTERVAL') or interval),
+                   backoff=float(os.getenv('POLL_BACKOFF', '1.5')))
+
+    @property
+    def adaptive(self) -> bool:
+        """True ถ้าคาบปรับตามปริมาณ events ได้"""
+        return self.min_interval < self.max_interval
+
+    def start_cycle(self):
+        """เริ่มรอบ polling (รอบแรก deadline เริ่มนับจากตอนนี้)"""
+        self._cycle_start = self._clock()
+        if self._deadline is None:
+            self._deadline = self._cycle_start
+
+    def end_cycle(self, found: int) -> float:
+        """
+        จบรอบ polling: วัดเวลาที่ใช้ ปรับคาบตามจำนวน events แล้วกำหนด deadline ถัดไป
+
+        Args:
+            found: จำนวน events ที่พบในรอบนี้
+
+        Returns:
+            จำนวนวินาทีที่ต้องรอก่อนรอบถัดไป
+        """
+        now = self._clock()
+        if self._cycle_start is None:
+            self.start_cycle()
+        self.last_cost = now - self._cycle_start
+
+        if found > 0:
+            self.period = self.min_interval
+        else:
+            self.period = min(self.max_interval, self.period * self.backoff)
+
+        self._deadline += self.period
+        if self._deadline < now:
+            # ช้ากว่าคาบ: เริ่มรอบถัดไปทันที และเลื่อน deadline มาที่ปัจจุบัน (ไม่ยิงรอบที่ค้างติดกัน)
+            self.overruns += 1
+            self._deadline = now
+        return self._deadline - now
+
+    def delay(self) -> float:
+        """จำนวนวินาทีจนถึงรอบถัดไป"""
+        if self._deadline is None:
+            return 0.0
+        return max(self._deadline - self._clock(), 0.0)
+
+    def wait(self):
+        """รอจนถึง deadline ของรอบถัดไป"""
+        while True:
+            remaining = self.delay()
+            if remaining <= 0:
+                return
+            self._sleep(remaining)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Report HTTP Handler - request handler ที่ใช้ร่วมกันระหว่าง serve_reports.py และ serve_reports_docker.py
+
+- ส่งไฟล์บีบอัดที่สร้างไว้แล้ว (.br / .gz) ตาม Accept-Encoding ของ client
+- ETag (strong) และ Last-Modified ตอบ 304 Not Modified เมื่อ client มีไฟล์เวอร์ชันล่าสุดแล้ว
+- รายงานของวันที่ผ่านมาแล้วที่สมบูรณ์ (ไม่มี marker .incomplete) และไม่ถูกแก้ไขนานกว่า
+  REPORT_IMMUTABLE_AFTER: Cache-Control immutable (cache ได้ 1 ปี)
+- รายงานของวันนี้, รายงานที่ยังไม่สมบูรณ์ (re-run จะเขียนทับ) และไฟล์อื่นๆ:
+  Cache-Control no-cache (ต้อง revalidate ทุกครั้ง)
+- Range requests (206), keep-alive (HTTP/1.1) และส่งไฟล์ด้วย sendfile (zero-copy)
+- ReportHTTPServer: 1 thread ต่อ connection และจำกัดจำนวน connection พร้อมกัน
+  client ที่ช้าไม่บล็อกผู้ใช้อื่นที่เปิดรายงานพร้อมกัน
+
+Environment (optional):
+    REPORT_SERVER_MAX_CONNECTIONS  จำนวน connection ที่ให้บริการพร้อมกัน (default: 64)
+                                   connection ที่เกินจะรอคิวจนมี connection ว่าง
+    REPORT_SERVER_KEEPALIVE        เวลารอ request ถัดไปบน connection เดิม เป็นวินาที (default: 15)
+    REPORT_IMMUTABLE_AFTER         รายงานที่ไม่ถูกแก้ไขนานกว่านี้ (วินาที) ถึงจะ cache แบบ immutable
+                                   (default: 86400 - เผื่อการสร้างรายงานวันเดิมซ้ำ)
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+import email.utils
+import http.server
+from datetime import datetime, timezone, timedelta
+from http import HTTPStatus
+
+from report_render import INCOMPLETE_SUFFIX
+
+# Bangkok timezone
+TZ_BANGKOK = timezone(timedelta(hours=7))
+
+# วันที่ในชื่อไฟล์/โฟลเดอร์รายงาน เช่น event_details_2026-02-03.html, event_details_2026-02-03/page-0001.json
+_REPORT_DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+# ลำดับความสำคัญของ encoding ที่ส่งได้ (นามสกุลไฟล์บีบอัดที่ report builder สร้างไว้)
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+
+# ไฟล์รายงานต้องไม่ถูกแก้ไขนานเท่านี้ก่อนส่ง immutable (สร้างรายงานวันเดิมซ้ำจะเขียนทับไฟล์)
+IMMUTABLE_AFTER = float(os.getenv('REPORT_IMMUTABLE_AFTER', '86400'))
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    แปลง Range header (รองรับช่วงเดียว) เป็น (start, end) แบบรวมปลาย
+
+    Returns:
+        (start, end), None ถ้าไม่มี/ไม่รองรับ (ส่งทั้งไฟล์) หรือ False ถ้าช่วงอยู่นอกไฟล์ (416)
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # หลายช่วง (multipart/byteranges) หรือรูปแบบอื่น: ส่งทั้งไฟล์ตาม RFC 9110
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N คือ N bytes สุดท้าย
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def parse_accept_encoding(header):
+    """
+    แปลง Accept-Encoding เป็น dict encoding -> q
+
+    Returns:
+        Dictionary เช่น {'gzip': 1.0, 'br': 0.5} (encoding ที่ q=0 ไม่ถูกนับ)
+    """
+    accepted = {}
+    for part in (header or '').split(','):
+        items = part.strip().split(';')
+        coding = items[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in items[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return {coding: q for coding, q in accepted.items() if q > 0}
+
+
+def report_date_of(path):
+    """คืนค่าวันที่ของรายงานจาก path (None ถ้าไม่ใช่ไฟล์รายงานรายวัน)"""
+    match = _REPORT_DATE_RE.search(path)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def report_marker_of(path):
+    """
+    path ของ marker .incomplete ของรายงานที่ไฟล์นี้เป็นส่วนหนึ่ง
+    เช่น event_detail/event_details_2026-02-03/page-0001.json -> event_detail/event_details_2026-02-03.incomplete
+    """
+    match = _REPORT_DATE_RE.search(path)
+    if not match:
+        return None
+    return path[:match.end()] + INCOMPLETE_SUFFIX
+
+
+def make_etag(stat, encoding=None):
+    """strong ETag จากขนาดและเวลาแก้ไขของไฟล์ (แยกตาม encoding)"""
+    tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if encoding:
+        tag += f"-{encoding}"
+    return f'"{tag}"'
+
+
+class ReportRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler สำหรับ HTML reports พร้อม content negotiation และ conditional GET"""
+
+    # keep-alive: ทุก response มี Content-Length จึงใช้ connection เดิมต่อได้
+    protocol_version = 'HTTP/1.1'
+    # ปิด connection ที่ไม่มี request ใหม่ภายในเวลานี้ (ไม่ให้ถือ thread ไว้)
+    timeout = float(os.getenv('REPORT_SERVER_KEEPALIVE', '15'))
+
+    def end_headers(self):
+        # เพิ่ม CORS headers
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET')
+        if not getattr(self, '_cache_control_sent', False):
+            self.send_header('Cache-Control', CACHE_REVALIDATE)
+        self._cache_control_sent = False
+        super().end_headers()
+
+    def cache_control_for(self, path, stat):
+        """
+        Cache-Control ของไฟล์: immutable เฉพาะรายงานวันที่ผ่านมาแล้วที่สมบูรณ์และไม่ถูกแก้ไขมานานพอ
+        รายงานที่ดึงข้อมูลไม่ครบ (มี marker .incomplete) จะถูก re-run เขียนทับ จึงต้อง revalidate
+        """
+        relative = os.path.relpath(path, self.directory)
+        report_date = report_date_of(relative)
+        if not report_date or report_date >= datetime.now(TZ_BANGKOK).date():
+            return CACHE_REVALIDATE
+        if time.time() - stat.st_mtime < IMMUTABLE_AFTER:
+            return CACHE_REVALIDATE
+        if os.path.exists(os.path.join(self.directory, report_marker_of(relative))):
+            return CACHE_REVALIDATE
+        return CACHE_IMMUTABLE
+
+    def select_representation(self, path, stat):
+        """
+        เลือกไฟล์ที่จะส่ง: ไฟล์บีบอัดคู่ (.br / .gz) ถ้า client รับได้และเป็นเวอร์ชันเดียวกับต้นฉบับ
+
+        Returns:
+            Tuple (path ที่ส่ง, encoding หรือ None)
+        """
+        accepted = parse_accept_encoding(self.headers.get('Accept-Encoding'))
+        candidates = []
+        for encoding, suffix in _ENCODINGS:
+            q = accepted.get(encoding, accepted.get('*', 0))
+            if q <= 0:
+                continue
+            try:
+                companion = os.stat(path + suffix)
+            except OSError:
+                continue
+            # report builder ตั้ง mtime ของไฟล์บีบอัดเท่ากับต้นฉบับ ถ้าเก่ากว่าแปลว่าเป็นเวอร์ชันเก่า
+            if companion.st_mtime_ns >= stat.st_mtime_ns:
+                candidates.append((-q, len(candidates), encoding, path + suffix))
+        if not candidates:
+            return path, None
+        _, _, encoding, chosen = min(candidates)
+        return chosen, encoding
+
+    def not_modified(self, etag, last_modified):
+        """ตรวจ If-None-Match / If-Modified-Since ว่า client มีไฟล์นี้แล้วหรือไม่"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            # เปรียบเทียบแบบ weak ตาม RFC 9110 (ไม่สน prefix W/)
+            return any(t == '*' or (t[2:] if t.startswith('W/') else t) == etag for t in tags)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since is None:
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return int(last_modified) <= since.timestamp()
+        return False
+
+    def range_matches(self, etag, last_modified):
+        """If-Range: ส่งเฉพาะช่วงเมื่อ validator ตรงกับไฟล์ปัจจุบันเท่านั้น"""
+        if_range = self.headers.get('If-Range')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        try:
+            since = email.utils.parsedate_to_datetime(if_range)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(last_modified) == int(since.timestamp())
+
+    def send_head(self):
+        self._send_range = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or path.endswith('/') or not os.path.isfile(path):
+            # directory listing / redirect / 404 ใช้การทำงานเดิมของ SimpleHTTPRequestHandler
+            return super().send_head()
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        chosen, encoding = self.select_representation(path, stat)
+        chosen_stat = stat if encoding is None else os.stat(chosen)
+        etag = make_etag(chosen_stat, encoding)
+        last_modified = stat.st_mtime
+        cache_control = self.cache_control_for(path, stat)
+
+        if self.not_modified(etag, last_modified):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_cache_headers(etag, last_modified, cache_control)
+            self.end_headers()
+            return None
+
+        try:
+            f = open(chosen, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        size = chosen_stat.st_size
+        byte_range = None
+        if self.range_matches(etag, last_modified):
+            byte_range = parse_range(self.headers.get('Range'), size)
+
+        try:
+            if byte_range is False:
+                f.close()
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self._send_cache_headers(etag, last_modified, cache_control)
+                self.end_headers()
+                return None
+            if byte_range:
+                start, end = byte_range
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                self._send_range = (start, end - start + 1)
+            else:
+                self.send_response(HTTPStatus.OK)
+                self._send_range = (0, size)
+            self.send_header('Content-Type', self.guess_type(path))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(self._send_range[1]))
+            self.send_header('Accept-Ranges', 'bytes')
+            self._send_cache_headers(etag, last_modified, cache_control)
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def _send_cache_headers(self, etag, last_modified, cache_control):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(last_modified))
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', cache_control)
+        self._cache_control_sent = True
+
+    def copyfile(self, source, outputfile):
+        """ส่งไฟล์ด้วย sendfile (zero-copy) เฉพาะช่วงที่ send_head กำหนด"""
+        send_range = getattr(self, '_send_range', None)
+        if send_range is None:
+            # directory listing (BytesIO) ใช้วิธีเดิม
+            return super().copyfile(source, outputfile)
+        offset, count = send_range
+        self._send_range = None
+        if count:
+            self.wfile.flush()
+            self.connection.sendfile(source, offset=offset, count=count)
+
+
+class ReportHTTPServer(http.server.ThreadingHTTPServer):
+    """HTTP server แบบ 1 thread ต่อ connection พร้อมจำกัดจำนวน connection พร้อมกัน"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_connections=None):
+        self.max_connections = max_connections or int(os.getenv('REPORT_SERVER_MAX_CONNECTIONS', '64'))
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        # connection ที่เกินจำนวนจะรอใน accept loop (และ listen backlog) จนมี slot ว่าง
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def handle_error(self, request, client_address):
+        # client ปิด connection ระหว่างดาวน์โหลด (เช่น ปิดแท็บ) ไม่ต้องพิมพ์ traceback
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Report Render - สร้างไฟล์ HTML รายละเอียด Events ของรายงานรายวัน
+
+รองรับ 2 รูปแบบ (REPORT_LAYOUT):
+- paged  (default) หน้า HTML เบาๆ + ไฟล์ JSON แยกเป็นหน้า (shard) ที่ browser โหลดเมื่อต้องใช้
+         แบ่งหน้า / กรอง / ค้นหาฝั่ง browser ขนาดหน้าแรกไม่ขึ้นกับจำนวน events ของวัน
+- single ไฟล์ HTML เดียวที่มีทุก event (แบบเดิม)
+
+event_detail/
+    event_details_YYYY-MM-DD.html          หน้า HTML (URL เดิมที่ส่งใน Mattermost)
+    event_details_YYYY-MM-DD/index.json    สรุปจำนวน + รายชื่อ shard
+    event_details_YYYY-MM-DD/page-0001.json
+    event_details_YYYY-MM-DD.incomplete    มีอยู่ระหว่างเขียน หรือเมื่อข้อมูลของวันยังดึงไม่ครบ
+                                           (report server จะไม่ส่ง Cache-Control immutable)
+
+ทุกไฟล์มีไฟล์บีบอัดคู่กัน (.gz และ .br ถ้าติดตั้ง brotli) ให้ report server ส่งได้ทันที
+โดยไม่ต้องบีบอัดทุก request (REPORT_COMPRESS=gzip,br | off)
+"""
+
+import os
+import gzip
+import json
+import shutil
+from html import escape
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# marker ของรายงานที่ยังไม่สมบูรณ์ (report server ใช้ตัดสินว่าจะ cache แบบ immutable ได้หรือไม่)
+INCOMPLETE_SUFFIX = ".incomplete"
+
+# field ของ record ที่แสดงใน card (ทุกค่าเป็น string)
+RECORD_FIELDS = (
+    "event_type", "event_id", "time_str", "action", "severity", "threat_type", "description",
+    "hostname", "ip_address", "msp_name", "tenant_name",
+    "responsible_display", "snipit_dept_display", "snipit_division_display",
+    "filename", "file_hash",
+)
+
+REPORT_CSS = """        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f5f5; padding: 20px; }
+        .container { max-width: 1200px; margin: 0 auto; background: white; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 10px 10px 0 0; }
+        .header h1 { font-size: 28px; margin-bottom: 10px; }
+        .header p { opacity: 0.9; }
+        .content { padding: 30px; }
+        .event-card { background: #f9f9f9; border-left: 4px solid #667eea; padding: 20px; margin-bottom: 20px; border-radius: 5px; }
+        .event-card.malicious { border-left-color: #e74c3c; }
+        .event-card.suspicious { border-left-color: #f39c12; }
+        .event-header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 15px; padding-bottom: 10px; border-bottom: 2px solid #e0e0e0; }
+        .event-id { font-size: 20px; font-weight: bold; color: #333; }
+        .event-time { color: #666; font-size: 14px; }
+        .section { margin-bottom: 20px; }
+        .section-title { font-size: 16px; font-weight: bold; color: #667eea; margin-bottom: 10px; padding-bottom: 5px; border-bottom: 1px solid #e0e0e0; }
+        .detail-row { display: grid; grid-template-columns: 200px 1fr; gap: 10px; padding: 8px 0; border-bottom: 1px solid #f0f0f0; }
+        .detail-label { font-weight: 600; color: #555; }
+        .detail-value { color: #333; word-break: break-all; }
+        .badge { display: inline-block; padding: 4px 12px; border-radius: 20px; font-size: 12px; font-weight: bold; margin-right: 5px; }
+        .badge.prevented { background: #e74c3c; color: white; }
+        .badge.detected { background: #3498db; color: white; }
+        .badge.severity-critical { background: #c0392b; color: white; }
+        .badge.severity-very-high { background: #e74c3c; color: white; }
+        .badge.severity-high { background: #e67e22; color: white; }
+        .badge.severity-moderate { background: #f39c12; color: white; }
+        .badge.severity-low { background: #27ae60; color: white; }
+        .badge.severity-very-low { background: #95a5a6; color: white; }
+        .hash { font-family: 'Courier New', monospace; font-size: 12px; background: #ecf0f1; padding: 5px; border-radius: 3px; }
+"""
+
+_REPORT_HEAD_HTML = """<!DOCTYPE html>
+<html lang="th">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>รายละเอียด Events - Deep Instinct</title>
+    <style>
+{css}    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🔒 รายละเอียด Security Events</h1>
+            <p>สร้างเมื่อ: {date_str} (GMT+7)</p>
+            <p>จำนวนทั้งหมด: {total} events</p>
+        </div>
+        <div class="content">
+"""
+
+_EVENT_CARD_HTML = """
+            <div class="event-card {event_type}">
+                <div class="event-header">
+                    <div class="event-id">Event ID: {event_id}</div>
+                    <div class="event-time">{time_str}</div>
+                </div>
+                
+                <div style="margin-bottom: 15px;">
+                    <span class="badge {action_class}">{action}</span>
+                    <span class="badge severity-{severity_class}">{severity}</span>
+                </div>
+                
+                <div class="section">
+                    <div class="section-title">📋 ข้อมูลทั่วไป</div>
+                    <div class="detail-row">
+                        <div class="detail-label">Threat Type:</div>
+                        <div class="detail-value">{threat_type}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">Details:</div>
+                        <div class="detail-value">{description}</div>
+                    </div>
+                </div>
+                
+                <div class="section">
+                    <div class="section-title">💻 Device & User Details</div>
+                    <div class="detail-row">
+                        <div class="detail-label">Device Name:</div>
+                        <div class="detail-value">{hostname}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">IP Address:</div>
+                        <div class="detail-value">{ip_address}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">MSP:</div>
+                        <div class="detail-value">{msp_name}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">Tenant:</div>
+                        <div class="detail-value">{tenant_name}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">ผู้รับผิดชอบ (Snip IT):</div>
+                        <div class="detail-value">{responsible_display}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">แผนก (Snip IT):</div>
+                        <div class="detail-value">{snipit_dept_display}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">กอง (Snip IT):</div>
+                        <div class="detail-value">{snipit_division_display}</div>
+                    </div>
+                </div>
+                
+                <div class="section">
+                    <div class="section-title">🔍 Event Indicators</div>
+                    <div class="detail-row">
+                        <div class="detail-label">Filename:</div>
+                        <div class="detail-value">{filename}</div>
+                    </div>
+                    <div class="detail-row">
+                        <div class="detail-label">File Hash:</div>
+                        <div class="detail-value"><span class="hash">{file_hash}</span></div>
+                    </div>
+                </div>
+            </div>
+"""
+
+_REPORT_FOOT_HTML = """
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+
+_PAGED_CSS = """        .toolbar { display: flex; flex-wrap: wrap; gap: 10px; margin-bottom: 20px; align-items: center; }
+        .toolbar input, .toolbar select, .toolbar button { padding: 8px 12px; border: 1px solid #ddd; border-radius: 5px; font-size: 14px; }
+        .toolbar input { flex: 1; min-width: 220px; }
+        .toolbar button { background: #667eea; color: white; border: none; cursor: pointer; }
+        .toolbar button:disabled { background: #ccc; cursor: default; }
+        .status { color: #666; font-size: 14px; }
+"""
+
+_PAGED_BODY_HTML = """
+            <div class="toolbar">
+                <input id="q" type="search" placeholder="ค้นหา hostname, ผู้รับผิดชอบ, tenant, hash, ไฟล์ ...">
+                <select id="type">
+                    <option value="">ทุกประเภท</option>
+                    <option value="malicious">Malicious</option>
+                    <option value="suspicious">Suspicious</option>
+                </select>
+                <select id="severity"><option value="">ทุก Severity</option></select>
+            </div>
+            <div class="toolbar">
+                <button id="prev">&laquo; ก่อนหน้า</button>
+                <span class="status" id="status">กำลังโหลด...</span>
+                <button id="next">ถัดไป &raquo;</button>
+            </div>
+            <div id="events"></div>
+            <template id="card-template">{card}</template>
+            <script id="report-config" type="application/json">{config}</script>
+            <script>
+{script}            </script>
+"""
+
+# ฝั่ง browser: โหลด index.json แล้วโหลด shard เฉพาะหน้าที่แสดง
+# เมื่อกรอง/ค้นหา จะไล่โหลด shard ทีละไฟล์และแสดงผลที่ตรงทันทีที่พบ
+_PAGED_SCRIPT = """(function () {
+    var config = JSON.parse(document.getElementById('report-config').textContent);
+    var template = document.getElementById('card-template');
+    var list = document.getElementById('events');
+    var status = document.getElementById('status');
+    var prev = document.getElementById('prev');
+    var next = document.getElementById('next');
+    var q = document.getElementById('q');
+    var typeSel = document.getElementById('type');
+    var sevSel = document.getElementById('severity');
+    var index = null, shards = {}, page = 0, matches = null, scanToken = 0;
+
+    function loadShard(i) {
+        if (!shards[i]) {
+            shards[i] = fetch(config.data_dir + index.pages[i].file).then(function (r) {
+                if (!r.ok) { throw new Error(r.status); }
+                return r.json();
+            });
+        }
+        return shards[i];
+    }
+
+    function card(rec) {
+        var node = template.content.firstElementChild.cloneNode(true);
+        node.classList.add(rec.event_type);
+        node.querySelectorAll('[data-f]').forEach(function (el) {
+            el.textContent = rec[el.getAttribute('data-f')];
+        });
+        var action = node.querySelector('[data-f=action]').parentNode;
+        action.classList.add(String(rec.action).toLowerCase());
+        var severity = node.querySelector('[data-f=severity]').parentNode;
+        severity.className += String(rec.severity).toLowerCase().replace(/_/g, '-');
+        return node;
+    }
+
+    function show(records) {
+        var frag = document.createDocumentFragment();
+        records.forEach(function (rec) { frag.appendChild(card(rec)); });
+        list.replaceChildren(frag);
+        window.scrollTo(0, 0);
+    }
+
+    function filtering() {
+        return q.value.trim() !== '' || typeSel.value !== '' || sevSel.value !== '';
+    }
+
+    function matcher() {
+        var words = q.value.trim().toLowerCase().split(/\\s+/).filter(Boolean);
+        var type = typeSel.value, sev = sevSel.value;
+        return function (rec) {
+            if (type && rec.event_type !== type) { return false; }
+            if (sev && rec.severity !== sev) { return false; }
+            if (!words.length) { return true; }
+            var text = config.search_fields.map(function (f) { return rec[f]; }).join(' ').toLowerCase();
+            return words.every(function (w) { return text.indexOf(w) !== -1; });
+        };
+    }
+
+    function renderPage() {
+        var pageSize = index.page_size;
+        if (matches === null) {
+            var pages = index.pages.length;
+            prev.disabled = page <= 0;
+            next.disabled = page >= pages - 1;
+            status.textContent = 'หน้า ' + (pages ? page + 1 : 0) + ' / ' + pages + ' (' + index.total + ' events)';
+            if (!pages) { list.replaceChildren(); return; }
+            loadShard(page).then(show, function () { status.textContent = 'โหลดข้อมูลไม่สำเร็จ'; });
+            return;
+        }
+        var pages = Math.max(1, Math.ceil(matches.items.length / pageSize));
+        prev.disabled = page <= 0;
+        next.disabled = page >= pages - 1;
+        status.textContent = 'หน้า ' + (page + 1) + ' / ' + pages + ' (พบ ' + matches.items.length + ' events' +
+            (matches.done ? '' : ', กำลังค้นหา ' + matches.scanned + '/' + index.pages.length + ' ไฟล์') + ')';
+        show(matches.items.slice(page * pageSize, (page + 1) * pageSize));
+    }
+
+    function scan() {
+        var token = ++scanToken;
+        page = 0;
+        if (!filtering()) { matches = null; renderPage(); return; }
+        var test = matcher();
+        matches = {items: [], scanned: 0, done: false};
+        renderPage();
+        var i = 0;
+        (function step() {
+            if (token !== scanToken) { return; }
+            if (i >= index.pages.length) { matches.done = true; renderPage(); return; }
+            loadShard(i).then(function (records) {
+                if (token !== scanToken) { return; }
+                var before = matches.items.length;
+                records.forEach(function (rec) { if (test(rec)) { matches.items.push(rec); } });
+                matches.scanned = ++i;
+                // แสดงผลใหม่เฉพาะเมื่อหน้าแรกยังไม่เต็ม (ไม่ให้หน้าจอกระพริบทุก shard)
+                if (before < index.page_size || i === index.pages.length) { renderPage(); }
+                step();
+            }, function () { status.textContent = 'โหลดข้อมูลไม่สำเร็จ'; });
+        })();
+    }
+
+    var timer = null;
+    function scheduleScan() {
+        clearTimeout(timer);
+        timer = setTimeout(scan, 250);
+    }
+
+    prev.addEventListener('click', function () { if (page > 0) { page--; renderPage(); } });
+    next.addEventListener('click', function () { page++; renderPage(); });
+    q.addEventListener('input', scheduleScan);
+    typeSel.addEventListener('change', scan);
+    sevSel.addEventListener('change', scan);
+
+    fetch(config.data_dir + 'index.json', {cache: 'no-cache'}).then(function (r) { return r.json(); }).then(function (data) {
+        index = data;
+        Object.keys(index.severity_counts).sort().forEach(function (sev) {
+            var opt = document.createElement('option');
+            opt.value = sev;
+            opt.textContent = sev + ' (' + index.severity_counts[sev] + ')';
+            sevSel.appendChild(opt);
+        });
+        renderPage();
+    }, function () { status.textContent = 'โหลดข้อมูลไม่สำเร็จ'; });
+})();
+"""
+
+# field ที่ใช้ค้นหาฝั่ง browser
+SEARCH_FIELDS = ("event_id", "hostname", "ip_address", "tenant_name", "msp_name", "threat_type",
+                 "description", "responsible_display", "snipit_dept_display", "snipit_division_display",
+                 "filename", "file_hash")
+
+
+def render_event_card(record: Dict) -> str:
+    """สร้าง HTML ของ event 1 รายการจาก record (escape ทุก field)"""
+    fields = {k: escape(str(record.get(k, 'N/A'))) for k in RECORD_FIELDS}
+    fields['action_class'] = fields['action'].lower()
+    fields['severity_class'] = fields['severity'].lower().replace('_', '-')
+    return _EVENT_CARD_HTML.format(**fields)
+
+
+def write_single_report(records: Iterable[Dict], output_file: str, date_str: str, total: int) -> str:
+    """
+    เขียนรายงานแบบไฟล์ HTML เดียว (เขียน card ทีละรายการลงไฟล์)
+
+    Args:
+        records: records เรียงตามลำดับที่จะแสดง
+        output_file: path ของไฟล์ HTML
+        date_str: เวลาที่สร้างรายงาน
+        total: จำนวน records
+
+    Returns:
+        output_file
+    """
+    # เขียนลงไฟล์ชั่วคราวแล้วค่อย replace (ผู้เปิดรายงานระหว่างสร้างจะเห็นไฟล์เก่าครบทั้งไฟล์)
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(_REPORT_HEAD_HTML.format(css=REPORT_CSS, date_str=escape(date_str), total=total))
+        for record in records:
+            f.write(render_event_card(record))
+        f.write(_REPORT_FOOT_HTML)
+    os.replace(tmp_file, output_file)
+    write_compressed_companions(output_file)
+    return output_file
+
+
+def incomplete_marker_path(output_file: str) -> str:
+    """path ของไฟล์ marker รายงานยังไม่สมบูรณ์ (ชื่อเดียวกับรายงาน นามสกุล .incomplete)"""
+    return os.path.splitext(output_file)[0] + INCOMPLETE_SUFFIX
+
+
+def mark_report_incomplete(output_file: str, incomplete: bool = True) -> None:
+    """
+    สร้าง/ลบ marker ว่ารายงานยังไม่สมบูรณ์
+
+    Args:
+        output_file: path ของไฟล์ HTML ของรายงาน
+        incomplete: True = สร้าง marker, False = ลบ marker (รายงานสมบูรณ์แล้ว)
+    """
+    marker = incomplete_marker_path(output_file)
+    if incomplete:
+        with open(marker, 'w', encoding='utf-8'):
+            pass
+        return
+    try:
+        os.remove(marker)
+    except FileNotFoundError:
+        pass
+
+
+def _compress_formats() -> List[str]:
+    """รูปแบบไฟล์บีบอัดที่ต้องสร้าง จาก REPORT_COMPRESS (default: gzip,br)"""
+    value = os.getenv('REPORT_COMPRESS', 'gzip,br').lower()
+    if value in ('', 'off', '0', 'false', 'no'):
+        return []
+    formats = [f.strip() for f in value.split(',')]
+    return [f for f in ('gzip', 'br') if f in formats and (f != 'br' or brotli is not None)]
+
+
+def remove_companions(path: str) -> None:
+    """ลบไฟล์บีบอัดคู่ของ path (ถ้ามี)"""
+    for suffix in ('.gz', '.br'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def write_compressed_companions(path: str) -> None:
+    """
+    สร้างไฟล์ .gz / .br คู่กับไฟล์ต้นฉบับ (mtime เท่ากับต้นฉบับ ให้ server ตรวจว่าเป็นเวอร์ชันเดียวกัน)
+    รูปแบบที่ไม่ได้สร้างจะถูกลบ เพื่อไม่ให้ server ส่งไฟล์บีบอัดของเวอร์ชันเก่า
+    """
+    formats = _compress_formats()
+    stat = os.stat(path)
+    for fmt, suffix in (('gzip', '.gz'), ('br', '.br')):
+        target = path + suffix
+        if fmt not in formats:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp_path = f"{target}.tmp"
+        if fmt == 'gzip':
+            with open(path, 'rb') as src, open(tmp_path, 'wb') as raw:
+                # mtime=0 ให้ไฟล์ .gz เหมือนเดิมทุกครั้งถ้าเนื้อหาไม่เปลี่ยน
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as dst:
+                    shutil.copyfileobj(src, dst)
+        else:
+            with open(path, 'rb') as src:
+                data = brotli.compress(src.read(), quality=11)
+            with open(tmp_path, 'wb') as dst:
+                dst.write(data)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, target)
+
+
+def _write_compact_json(path: str, data) -> None:
+    """เขียน JSON แบบไม่มีช่องว่าง (ไฟล์ชั่วคราว -> os.replace) พร้อมไฟล์บีบอัดคู่"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    write_compressed_companions(path)
+
+
+def write_paged_report(records: Iterable[Dict], output_file: str, date_str: str,
+                       page_size: Optional[int] = None) -> str:
+    """
+    เขียนรายงานแบบแบ่งหน้า: หน้า HTML (shell) + JSON shard ละ page_size events
+
+    Args:
+        records: records เรียงตามลำดับที่จะแสดง
+        output_file: path ของไฟล์ HTML (shard อยู่ในโฟลเดอร์ชื่อเดียวกันไม่มี .html)
+        date_str: เวลาที่สร้างรายงาน
+        page_size: จำนวน events ต่อ shard (default: REPORT_PAGE_SIZE หรือ 100)
+
+    Returns:
+        output_file
+    """
+    page_size = page_size or int(os.getenv('REPORT_PAGE_SIZE', '100'))
+    data_dir = os.path.splitext(output_file)[0]
+    os.makedirs(data_dir, exist_ok=True)
+
+    pages: List[Dict] = []
+    type_counts: Dict[str, int] = {}
+    severity_counts: Dict[str, int] = {}
+    buffer: List[Dict] = []
+
+    def flush():
+        name = f"page-{len(pages) + 1:04d}.json"
+        _write_compact_json(os.path.join(data_dir, name), buffer)
+        pages.append({"file": name, "count": len(buffer)})
+        buffer.clear()
+
+    for record in records:
+        record = {k: str(record.get(k, 'N/A')) for k in RECORD_FIELDS}
+        type_counts[record['event_type']] = type_counts.get(record['event_type'], 0) + 1
+        severity_counts[record['severity']] = severity_counts.get(record['severity'], 0) + 1
+        buffer.append(record)
+        if len(buffer) >= page_size:
+            flush()
+    if buffer:
+        flush()
+
+    # ลบ shard เก่าที่เกินจำนวนหน้าปัจจุบัน (กรณีสร้างรายงานวันเดิมซ้ำแล้ว events น้อยลง)
+    current = {p["file"] for p in pages}
+    for name in os.listdir(data_dir):
+        if name.startswith("page-") and name.endswith(".json") and name not in current:
+            os.remove(os.path.join(data_dir, name))
+            remove_companions(os.path.join(data_dir, name))
+
+    total = sum(p["count"] for p in pages)
+    _write_compact_json(os.path.join(data_dir, "index.json"), {
+        "generated": date_str,
+        "total": total,
+        "page_size": page_size,
+        "type_counts": type_counts,
+        "severity_counts": severity_counts,
+        "pages": pages,
+    })
+
+    # template ของ card ใช้ markup เดียวกับแบบ single (ค่าจริงใส่ด้วย textContent ฝั่ง browser)
+    placeholders = {k: f'<span data-f="{k}"></span>' for k in RECORD_FIELDS}
+    placeholders.update(event_type='', action_class='', severity_class='')
+    card = _EVENT_CARD_HTML.format(**placeholders).strip()
+    config = json.dumps({
+        "data_dir": f"{os.path.basename(data_dir)}/",
+        "search_fields": SEARCH_FIELDS,
+    }, ensure_ascii=False).replace('</', '<\\/')
+
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(_REPORT_HEAD_HTML.format(css=REPORT_CSS + _PAGED_CSS, date_str=escape(date_str),
+                                         total=total))
+        f.write(_PAGED_BODY_HTML.format(card=card, config=config, script=_PAGED_SCRIPT))
+        f.write(_REPORT_FOOT_HTML)
+    os.replace(tmp_file, output_file)
+    write_compressed_companions(output_file)
+    return output_file
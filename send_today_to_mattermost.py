@@ -6,11 +6,20 @@ Deep Instinct to Mattermost - Daily Report with Threat Severity
 
 import os
 import sys
-import requests
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta, date
 from dotenv import load_dotenv
 
+import http_transport
+from event_store import EventStore, STREAM_EVENTS, STREAM_SUSPICIOUS
+from asset_index import AssetIndex
+from day_buckets import bangkok_time, filter_by_date, sort_key
+from report_render import mark_report_incomplete, write_paged_report, write_single_report
+from snipit_inventory import HostSearchCache, InventoryCache, SnipitClient, search_hostnames
+from state_store import atomic_write_json, get_state_dir, load_json
+
 # โหลด environment variables
 load_dotenv('/home/api/DeepInstint/.env1')
 
@@ -21,6 +30,11 @@ WEBHOOK_URL = os.getenv('MATTERMOST_WEBHOOK_URL')
 REPORT_SERVER_URL = os.getenv('REPORT_SERVER_URL', 'http://localhost:8080')
 IT_PARCEL_API_URL = os.getenv('IT_PARCEL_API_URL', '').rstrip('/')
 IT_PARCEL_TOKEN = os.getenv('IT_PARCEL_TOKEN', '')
+# แหล่งข้อมูลรายงาน: store = local event store (SQLite, ดึงเฉพาะ events ใหม่),
+# search = ให้ /search กรองตามช่วงวันที่ (เหมาะกับรายงานย้อนหลัง), api = ไล่ดึงจาก API ทุกครั้ง
+REPORT_SOURCE = os.getenv('REPORT_SOURCE', 'store').lower()
+# รูปแบบไฟล์รายละเอียด: paged = HTML + JSON shards (โหลดทีละหน้า), single = HTML ไฟล์เดียว
+REPORT_LAYOUT = os.getenv('REPORT_LAYOUT', 'paged').lower()
 
 # Bangkok timezone
 TZ_BANGKOK = timezone(timedelta(hours=7))
@@ -30,173 +44,411 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 EVENT_DETAIL_DIR = os.path.join(SCRIPT_DIR, 'event_detail')
 
 
+def _snipit_row_to_info(row):
+    """แปลง hardware row ของ Snip IT เป็น dict ผู้รับผิดชอบ / แผนก / กอง"""
+    assigned = row.get("assigned_to")
+    if isinstance(assigned, dict):
+        responsible = (
+            assigned.get("name")
+            or assigned.get("username")
+            or assigned.get("display_name")
+            or str(assigned.get("id", ""))
+        )
+    else:
+        responsible = str(assigned) if assigned else "-"
+    cf = row.get("custom_fields") or {}
+    dept = division = "N/A"
+    if isinstance(cf, dict):
+        fd = cf.get("แผนก")
+        if isinstance(fd, dict) and fd.get("value"):
+            dept = fd.get("value")
+        fk = cf.get("กอง")
+        if isinstance(fk, dict) and fk.get("value"):
+            division = fk.get("value")
+    return {"responsible": responsible, "แผนก": dept, "กอง": division}
+
+def load_snipit_inventory():
+    """
+    ดึงรายการ Hardware ทั้งหมดจาก Snip IT แล้วสร้าง AssetIndex ชื่อเครื่อง -> ผู้รับผิดชอบ
+    (ไม่ขึ้นกับ events จึงรันพร้อมกับการดึง events ได้)
+    ใช้ inventory cache บนดิสก์ (TTL + incremental refresh, ใช้ข้อมูลเก่าถ้า IT Parcel ล่ม)
+    คืนค่า AssetIndex (อาจว่างถ้าไม่มี config หรือ API ล้มเหลว)
+    """
+    if not IT_PARCEL_API_URL or not IT_PARCEL_TOKEN:
+        return AssetIndex()
+    rows = InventoryCache().load_rows(SnipitClient(IT_PARCEL_API_URL, IT_PARCEL_TOKEN))
+
+    return AssetIndex(rows, record=_snipit_row_to_info)
+
+def resolve_snipit_hostnames(lookup, hostnames):
+    """
+    สำหรับ hostname ที่ยังไม่พบใน lookup: ใช้ Search API ของ Snip IT (รองรับ custom field เช่น Device Name)
+    ค้นหาพร้อมกันหลาย hostname และจำผลทั้งที่พบ/ไม่พบไว้ (HostSearchCache)
+    เพิ่มผลลัพธ์ลงใน lookup และคืนค่า lookup เดิม
+    """
+    if not IT_PARCEL_API_URL or not IT_PARCEL_TOKEN or not hostnames:
+        return lookup
+    missing = []
+    for hostname in hostnames:
+        if not hostname or str(hostname).strip().lower() in ("", "n/a"):
+            continue
+        if lookup.match(hostname) is None:
+            missing.append(hostname)
+    if not missing:
+        return lookup
+    client = SnipitClient(IT_PARCEL_API_URL, IT_PARCEL_TOKEN)
+    for key, row in search_hostnames(client, missing, HostSearchCache()).items():
+        if row:
+            lookup.add(key, _snipit_row_to_info(row))
+    return lookup
+
 def get_snipit_responsible_lookup(extra_search_hostnames=None):
     """
-    ดึงรายการ Hardware จาก Snip IT (IT Parcel) แล้วสร้าง dict ชื่อเครื่อง -> ผู้รับผิดชอบ
+    ดึงรายการ Hardware จาก Snip IT (IT Parcel) แล้วสร้าง AssetIndex ชื่อเครื่อง -> ผู้รับผิดชอบ
     ใช้จับคู่กับ Deep Instinct event ตาม hostname/ชื่อเครื่อง
     ถ้า extra_search_hostnames ให้ จะใช้ Search API สำหรับ hostname ที่ยังไม่พบ (รองรับ custom field เช่น Device Name)
-    คืนค่า dict (อาจว่างถ้าไม่มี config หรือ API ล้มเหลว)
+    คืนค่า AssetIndex (อาจว่างถ้าไม่มี config หรือ API ล้มเหลว)
     """
-    if not IT_PARCEL_API_URL or not IT_PARCEL_TOKEN:
-        return {}
-    url = f"{IT_PARCEL_API_URL}/hardware"
-    headers = {"Authorization": f"Bearer {IT_PARCEL_TOKEN}", "Accept": "application/json"}
-    rows = []
-    offset = 0
-    limit = 200
-    try:
-        while True:
-            params = {"limit": limit, "offset": offset}
-            r = requests.get(url, headers=headers, params=params, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            page = data.get("rows") or data.get("data") or (data if isinstance(data, list) else [])
-            if not page:
-                break
-            rows.extend(page)
-            total = data.get("total") if isinstance(data, dict) else None
-            if total is not None and offset + len(page) >= total:
-                break
-            if len(page) < limit:
-                break
-            offset += limit
-    except Exception:
-        pass
-    def _row_to_info(row):
-        assigned = row.get("assigned_to")
-        if isinstance(assigned, dict):
-            responsible = (
-                assigned.get("name")
-                or assigned.get("username")
-                or assigned.get("display_name")
-                or str(assigned.get("id", ""))
-            )
-        else:
-            responsible = str(assigned) if assigned else "-"
-        cf = row.get("custom_fields") or {}
-        dept = division = "N/A"
-        if isinstance(cf, dict):
-            fd = cf.get("แผนก")
-            if isinstance(fd, dict) and fd.get("value"):
-                dept = fd.get("value")
-            fk = cf.get("กอง")
-            if isinstance(fk, dict) and fk.get("value"):
-                division = fk.get("value")
-        return {"responsible": responsible, "แผนก": dept, "กอง": division}
-
-    lookup = {}
-    for row in rows:
-        name = row.get("name") or row.get("asset_tag") or row.get("hostname") or row.get("device_name") or ""
-        asset_tag = row.get("asset_tag") or ""
-        hostname = row.get("hostname") or ""
-        serial = row.get("serial") or ""
-        info = _row_to_info(row)
-        keys_to_add = [name, asset_tag, hostname, serial]
-        custom_fields = row.get("custom_fields") or {}
-        if isinstance(custom_fields, dict):
-            for field_name, field_data in custom_fields.items():
-                if isinstance(field_data, dict) and field_data.get("value"):
-                    keys_to_add.append(field_data.get("value"))
-                elif isinstance(field_data, (str, int, float)):
-                    keys_to_add.append(field_data)
-        for raw_key in keys_to_add:
-            if raw_key is not None and str(raw_key).strip():
-                key = str(raw_key).strip().lower()
-                lookup[key] = info
-    # สำหรับ hostname ที่ยังไม่พบ: ใช้ Search API
-    if extra_search_hostnames:
-        seen = set()
-        for hostname in extra_search_hostnames:
-            if not hostname or str(hostname).strip() in ("", "n/a"):
-                continue
-            key = str(hostname).strip().lower()
-            if key in seen or lookup.get(key):
-                continue
-            seen.add(key)
-            try:
-                r = requests.get(url, headers=headers, params={"search": hostname.strip(), "limit": 5}, timeout=10)
-                r.raise_for_status()
-                data = r.json()
-                search_rows = data.get("rows") or data.get("data") or []
-                if len(search_rows) == 1:
-                    lookup[key] = _row_to_info(search_rows[0])
-            except Exception:
-                pass
-    return lookup
+    return resolve_snipit_hostnames(load_snipit_inventory(), extra_search_hostnames)
 
 def convert_to_bangkok_time(iso_timestamp):
     """แปลง ISO timestamp เป็นเวลา Bangkok"""
     if not iso_timestamp:
         return None
-    dt_utc = datetime.fromisoformat(iso_timestamp.replace('Z', '+00:00'))
-    dt_bangkok = dt_utc.astimezone(TZ_BANGKOK)
-    return dt_bangkok
+    return bangkok_time({'timestamp': iso_timestamp})
 
-def filter_today(events):
-    """กรองเฉพาะ events ของวันนี้"""
-    today_bangkok = datetime.now(TZ_BANGKOK).date()
-    return filter_by_date(events, today_bangkok)
-
-def filter_by_date(events, target_date):
-    """กรองเฉพาะ events ของวันที่กำหนด"""
+def bangkok_day_bounds(target_date):
+    """คืนค่าช่วงเวลา (start, end) ของวันที่ Bangkok เป็นเวลา UTC (end ไม่รวม)"""
     if isinstance(target_date, str):
         target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
-    filtered = []
-    for event in events:
-        timestamp = event.get('timestamp') or event.get('insertion_timestamp')
-        if timestamp:
-            dt_bangkok = convert_to_bangkok_time(timestamp)
-            if dt_bangkok and dt_bangkok.date() == target_date:
-                event['_bangkok_time'] = dt_bangkok
-                filtered.append(event)
-    return filtered
-
-def fetch_events_with_pagination(endpoint, after_id, max_pages=20):
-    """ดึง events พร้อม pagination"""
-    url = f"{API_URL}{endpoint}"
+    start_bangkok = datetime(target_date.year, target_date.month, target_date.day, tzinfo=TZ_BANGKOK)
+    start_utc = start_bangkok.astimezone(timezone.utc)
+    return start_utc, start_utc + timedelta(days=1)
+
+def build_date_search(target_date, field='timestamp'):
+    """สร้าง payload สำหรับ /events/search แบบ range filter ของวันที่ Bangkok"""
+    start_utc, end_utc = bangkok_day_bounds(target_date)
+    # DateRangeFilter รวมปลายช่วง จึงถอยเวลาสิ้นสุดลง 1 ms
+    end_utc -= timedelta(milliseconds=1)
+    return {
+        field: {
+            'from': start_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'to': end_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        }
+    }
+
+def fetch_event_page(endpoint, after_id, search=None):
+    """
+    ดึง events 1 หน้า (สูงสุด 50 events ที่ ID มากกว่า after_id)
+    ถ้าระบุ search (payload ของ /search) จะใช้ POST {endpoint}/search ให้ server กรองให้
+    คืนค่า (events, last_id) และ raise exception ถ้าเรียก API ไม่สำเร็จ
+    (http_transport ลองใหม่ให้แล้วเมื่อเจอ network error / 429 / 5xx ตาม HTTP_RETRIES)
+    """
+    url = f"{API_URL}{endpoint}/search" if search else f"{API_URL}{endpoint}"
     headers = {'Authorization': TOKEN}
+    params = {"after_event_id": after_id}
+    if search:
+        response = http_transport.post(url, headers=headers, params=params, json=search,
+                                       idempotent=True)
+    else:
+        response = http_transport.get(url, headers=headers, params=params)
+    response.raise_for_status()
     
-    all_events = []
-    current_after_id = after_id
+    data = response.json()
     
-    for page in range(max_pages):
-        params = {"after_event_id": current_after_id}
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # API อาจกลับมาเป็น list หรือ dict
-            if isinstance(data, dict):
-                events_batch = data.get('events', [])
-                last_id = data.get('last_id')
-            elif isinstance(data, list):
-                events_batch = data
-                last_id = None
-            else:
-                print(f"⚠️  Unexpected response format: {type(data)}")
-                break
+    # API อาจกลับมาเป็น list หรือ dict
+    if isinstance(data, dict):
+        return data.get('events', []), data.get('last_id')
+    if isinstance(data, list):
+        return data, None
+    raise ValueError(f"Unexpected response format: {type(data)}")
+
+class PageCrawl:
+    """
+    ไล่ดึง events ทีละหน้าแบบ lazy (ใช้ใน for loop)
+    
+    - ไม่จำกัดจำนวนหน้า (max_pages=None) การลองใหม่ของแต่ละหน้าทำใน http_transport ชั้นเดียว
+    - after_id คือจุดที่ต้องดึงต่อหลังจากหน้าล่าสุดที่ yield ออกไป (ใช้ทำ checkpoint/resume)
+    - truncated เป็น True ถ้าหยุดก่อนดึงครบ (error หลัง transport ลองใหม่ครบแล้ว หรือถึง max_pages)
+    """
+    
+    def __init__(self, endpoint, after_id, max_pages=None, search=None):
+        self.endpoint = endpoint
+        self.after_id = after_id
+        self.max_pages = max_pages
+        self.search = search
+        self.pages = 0
+        self.truncated = False
+        self.error = None
+    
+    def __iter__(self):
+        while self.max_pages is None or self.pages < self.max_pages:
+            try:
+                events_batch, last_id = fetch_event_page(self.endpoint, self.after_id, self.search)
+            except Exception as e:
+                self.truncated = True
+                self.error = e
+                print(f"⚠️  {self.endpoint}: stopped after {self.pages} page(s), "
+                      f"resume from after_event_id {self.after_id}: {e}")
+                return
             
             if not events_batch:
-                break
-            
-            all_events.extend(events_batch)
+                return
             
             # ใช้ last_id จาก response หรือ max id จาก events
-            if last_id:
-                current_after_id = last_id
-            else:
-                max_id = max(e.get('id', 0) for e in events_batch)
-                if max_id <= current_after_id:
-                    break
-                current_after_id = max_id
+            next_after_id = last_id or max(e.get('id', 0) for e in events_batch)
+            self.pages += 1
+            done = next_after_id <= self.after_id
+            self.after_id = max(self.after_id, next_after_id)
             
-        except Exception as e:
-            print(f"⚠️  Error fetching {endpoint} page {page+1}: {e}")
+            yield events_batch
+            
+            if done:
+                return
+        
+        self.truncated = True
+        print(f"⚠️  {self.endpoint}: reached max_pages={self.max_pages}, "
+              f"resume from after_event_id {self.after_id}")
+
+def iter_event_pages(endpoint, after_id, max_pages=None, search=None):
+    """
+    Generator ดึง events ทีละหน้าแบบ lazy (ดึงหน้าถัดไปเมื่อผู้เรียกต้องการเท่านั้น)
+    max_pages=None คือดึงจนหมด (ใช้ PageCrawl โดยตรงถ้าต้องการรู้ว่าดึงครบหรือไม่)
+    """
+    yield from PageCrawl(endpoint, after_id, max_pages, search)
+
+def _insertion_time(event):
+    """เวลาที่ server บันทึก event (เพิ่มขึ้นตาม event ID) เป็น datetime UTC"""
+    timestamp = event.get('insertion_timestamp') or event.get('timestamp')
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+def _page_past(page, day_end):
+    """ทั้งหน้าถูกบันทึกหลังเวลา day_end แล้วหรือไม่"""
+    times = [_insertion_time(e) for e in page]
+    return all(t and t >= day_end for t in times)
+
+_START_ID_CACHE_LOCK = threading.Lock()
+
+def locate_start_id(endpoint, target_date, margin=timedelta(hours=1)):
+    """
+    หา after_event_id ที่ทำให้หน้าแรกเริ่มที่ events ของวันที่กำหนด (Bangkok)
+    
+    ค้นแบบ exponential แล้ว binary search บน after_event_id โดยดูเวลาของ events ที่ได้กลับมา
+    (event ID เพิ่มตามเวลา insertion) ใช้ประมาณ O(log N) requests
+    margin: เผื่อเวลาก่อนเริ่มวัน สำหรับ events ที่เวลาเครื่องคลาดจากเวลา server
+    ผลลัพธ์ของวันที่ผ่านมาแล้วเก็บ cache ไว้ใน STATE_DIR/start_id_cache.json
+    """
+    if isinstance(target_date, str):
+        target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
+    date_key = target_date.isoformat()
+    cache_path = os.path.join(get_state_dir(), 'start_id_cache.json')
+    cache = load_json(cache_path, default={}) or {}
+    stream_cache = cache.setdefault(endpoint, {})
+    if date_key in stream_cache:
+        return stream_cache[date_key]
+    
+    day_start = bangkok_day_bounds(target_date)[0] - margin
+    
+    # เริ่มจาก ID ของวันก่อนหน้าที่ใกล้ที่สุดใน cache (ถ้ามี)
+    earlier = [stream_cache[k] for k in stream_cache if k < date_key]
+    lo = max(earlier) if earlier else 0
+    hi = None
+    step = 64
+    probes = 0
+    
+    def probe(after_id):
+        """คืนค่า ID ที่ได้คำตอบทันที หรือปรับช่วง lo/hi"""
+        nonlocal lo, hi, probes
+        probes += 1
+        events_batch, _ = fetch_event_page(endpoint, after_id)
+        events_batch = [e for e in events_batch if _insertion_time(e)]
+        if not events_batch:
+            hi = after_id
+            return None
+        events_batch.sort(key=lambda e: e.get('id', 0))
+        before = [e for e in events_batch if _insertion_time(e) < day_start]
+        if not before:
+            # ทั้งหน้าอยู่ในวันนั้นแล้ว -> คำตอบไม่เกิน after_id
+            hi = after_id
+            return None
+        if len(before) < len(events_batch):
+            # หน้านี้คร่อมจุดเริ่มวัน -> ได้คำตอบทันที
+            return before[-1]['id']
+        # ทั้งหน้าอยู่ก่อนวันนั้น -> คำตอบอย่างน้อยเป็น ID สุดท้ายของหน้า
+        lo = max(lo, events_batch[-1]['id'])
+        return None
+    
+    found = probe(lo)
+    # exponential search หาขอบบน
+    while found is None and hi is None:
+        found = probe(lo + step)
+        step *= 2
+    # binary search ระหว่าง lo และ hi
+    while found is None and lo < hi:
+        found = probe((lo + hi) // 2)
+    start_id = found if found is not None else lo
+    print(f"   🔎 Located start ID {start_id} for {endpoint} on {date_key} ({probes} probe requests)")
+    
+    # cache เฉพาะวันที่เริ่มไปแล้ว (ID เริ่มต้นของวันนั้นจะไม่เปลี่ยนอีก)
+    # (อ่านไฟล์ใหม่ภายใต้ lock เพราะ stream อื่นอาจบันทึกพร้อมกันจากอีก thread)
+    if bangkok_day_bounds(target_date)[0] <= datetime.now(timezone.utc):
+        with _START_ID_CACHE_LOCK:
+            cache = load_json(cache_path, default={}) or {}
+            cache.setdefault(endpoint, {})[date_key] = start_id
+            try:
+                atomic_write_json(cache_path, cache)
+            except OSError as e:
+                print(f"⚠️  Cannot save start ID cache: {e}")
+    return start_id
+
+def fill_store_gap(store, endpoint, report_date, first_id, margin=timedelta(hours=1)):
+    """
+    เติม events ช่วงต้นวันที่รายงานที่ store ยังไม่มี
+    (เช่น monitor เริ่มเขียน store กลางวัน หรือรายงานย้อนหลังก่อนข้อมูลแรกใน store)
+
+    ดึงจาก ID แรกของวันนั้นจนถึง first_id (ID ต่ำสุดใน store) และบันทึกลง store เมื่อดึงครบเท่านั้น
+    ถ้าบันทึกบางส่วน ID ต่ำสุดใน store จะเลื่อนลงและช่องว่างที่เหลือจะไม่ถูกตรวจพบอีก
+    คืนค่า (จำนวน events ที่เติม, เติมครบหรือไม่)
+    """
+    try:
+        start_id = locate_start_id(endpoint, report_date, margin)
+    except Exception as e:
+        print(f"⚠️  Cannot locate start ID for {endpoint}: {e}")
+        return 0, False
+    if start_id >= first_id - 1:
+        return 0, True
+
+    print(f"   🧩 Filling {endpoint} store gap: after ID {start_id} up to ID {first_id}")
+    pages = []
+    crawl = PageCrawl(endpoint, start_id)
+    for page in crawl:
+        pages.append([e for e in page if e.get('id', 0) < first_id])
+        if crawl.after_id >= first_id - 1:
             break
+    if crawl.truncated:
+        print(f"   ⚠️  {endpoint} store gap not filled, report will be incomplete")
+        return 0, False
+    return sum(store.add_events(endpoint, page) for page in pages), True
+
+def sync_event_store(store, endpoint, report_date, margin=timedelta(hours=1)):
+    """
+    ดึงเฉพาะ events ที่ใหม่กว่าที่มีอยู่ใน store แล้วบันทึกลง store
+    (ถ้า store ยังว่าง เริ่มจาก ID แรกของวันที่รายงาน)
+    ID ล่าสุดใน store เป็น checkpoint ในตัว: ถ้าหยุดกลางทาง รอบถัดไปจะดึงต่อจากเดิม
+    ถ้า event แรกใน store ถูกบันทึกหลังเริ่มวันที่รายงาน จะเติมช่วงที่ขาดด้วย fill_store_gap ก่อน
+    คืนค่า (จำนวน events ใหม่ที่บันทึก, ดึงครบหรือไม่)
+    """
+    after_id = store.last_id(endpoint)
+    if not after_id:
+        try:
+            after_id = locate_start_id(endpoint, report_date, margin)
+        except Exception as e:
+            print(f"⚠️  Cannot locate start ID for {endpoint}: {e}")
+            return 0, False
+
+    total = 0
+    complete = True
+    first = store.first_event(endpoint)
+    if first is not None:
+        first_time = _insertion_time(first)
+        day_start = bangkok_day_bounds(report_date)[0] - margin
+        if first_time is None or first_time > day_start:
+            total, complete = fill_store_gap(store, endpoint, report_date, first['id'], margin)
+
+    crawl = PageCrawl(endpoint, after_id)
+    for page in crawl:
+        total += store.add_events(endpoint, page)
+    return total, complete and not crawl.truncated
+
+def _checkpoint_path(endpoint, report_date, mode):
+    """path ของไฟล์ checkpoint สำหรับการดึง events ของวันที่รายงาน"""
+    directory = os.path.join(get_state_dir(), 'checkpoints')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{endpoint}_{mode}_{report_date.isoformat()}.jsonl")
+
+def _read_checkpoint(path):
+    """
+    อ่าน checkpoint (JSON Lines: 1 บรรทัดต่อ 1 หน้า {"after_id": ..., "events": [...]})
+    บรรทัดสุดท้ายที่เขียนไม่ครบ (process ถูก kill ระหว่างเขียน) จะถูกข้าม
+    คืนค่า (after_id ล่าสุด, events ทั้งหมด) หรือ (None, []) ถ้าไม่มี checkpoint
+    """
+    after_id = None
+    events = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                after_id = entry['after_id']
+                events.extend(entry['events'])
+    except FileNotFoundError:
+        pass
+    return after_id, events
+
+def crawl_report_day(endpoint, report_date, search=None):
+    """
+    ไล่ดึง events ของวันที่รายงานแบบ resumable
+    
+    บันทึก checkpoint หลังแต่ละหน้า ถ้าหยุดกลางทาง (error หรือ process ถูก kill)
+    การรันครั้งถัดไปจะดึงต่อจาก after_event_id ล่าสุดที่สำเร็จ และลบ checkpoint เมื่อดึงครบ
+    คืนค่า (events ของวันนั้น, ดึงครบหรือไม่)
+    """
+    mode = 'search' if search else 'scan'
+    path = _checkpoint_path(endpoint, report_date, mode)
+    after_id, events = _read_checkpoint(path)
+    if after_id is not None:
+        print(f"   ♻️  Resuming {endpoint} from checkpoint (after ID {after_id}, {len(events)} events)")
+    elif search:
+        after_id = 0
+    else:
+        try:
+            after_id = locate_start_id(endpoint, report_date)
+        except Exception as e:
+            print(f"⚠️  Cannot locate start ID for {endpoint}: {e}")
+            return [], False
+    
+    day_end = bangkok_day_bounds(report_date)[1] + timedelta(hours=1)
+    crawl = PageCrawl(endpoint, after_id, search=search)
+    with open(path, 'a', encoding='utf-8') as checkpoint:
+        for page in crawl:
+            matched = filter_by_date(page, report_date)
+            events.extend(matched)
+            checkpoint.write(json.dumps({'after_id': crawl.after_id, 'events': matched},
+                                        ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            if not search and _page_past(page, day_end):
+                break
     
-    return all_events
+    if crawl.truncated:
+        print(f"   ⚠️  {endpoint} incomplete, checkpoint kept: {path}")
+    else:
+        os.remove(path)
+    return filter_by_date(events, report_date), not crawl.truncated
+
+def load_report_events(endpoint, report_date, store=None):
+    """
+    ดึง events ของวันที่รายงาน ตาม REPORT_SOURCE:
+    store = local event store, search = /search แบบช่วงวันที่, api = ไล่ดึงจาก ID แรกของวันนั้น
+    คืนค่า (events, ดึงครบหรือไม่)
+    """
+    if store is not None:
+        first = store.first_event(endpoint)
+        first_time = _insertion_time(first) if first else None
+        if first_time and first_time >= bangkok_day_bounds(report_date)[1] + timedelta(hours=1):
+            # ทั้งวันอยู่ก่อนข้อมูลแรกใน store (รายงานย้อนหลัง): ดึงเฉพาะวันนั้นจาก API แทนการเติม store
+            print(f"   ⏪ Local store starts after {report_date}, crawling {endpoint} from API")
+            return crawl_report_day(endpoint, report_date)
+        new_count, complete = sync_event_store(store, endpoint, report_date)
+        print(f"   📦 Synced {new_count} new event(s) into local store")
+        return filter_by_date(store.events_for_date(endpoint, report_date), report_date), complete
+    if REPORT_SOURCE == 'search':
+        return crawl_report_day(endpoint, report_date, search=build_date_search(report_date))
+    return crawl_report_day(endpoint, report_date)
 
 def get_severity_icon(severity):
     """ดึง icon สำหรับ severity level"""
@@ -210,207 +462,105 @@ def get_severity_icon(severity):
     }
     return severity_map.get(severity, '❓')
 
-def build_event_details_html(malicious_events, suspicious_events, output_file):
-    """สร้างไฟล์ HTML รายละเอียด Events (จับคู่ Snip IT แสดงผู้รับผิดชอบเครื่อง)"""
+def _snipit_display(snipit_lookup, hostname):
+    """คืนค่า (ผู้รับผิดชอบ, แผนก, กอง) ของเครื่องจาก Snip IT สำหรับแสดงผล"""
+    if hostname and str(hostname) != 'N/A':
+        info = snipit_lookup.match(hostname)
+        if isinstance(info, dict):
+            responsible = info.get("responsible", "N/A")
+            snipit_dept = info.get("แผนก", "N/A")
+            snipit_division = info.get("กอง", "N/A")
+        else:
+            responsible = info if info else "N/A"
+            snipit_dept = snipit_division = "N/A"
+    else:
+        responsible = snipit_dept = snipit_division = 'N/A'
+    # แสดงข้อความเมื่อไม่พบข้อมูลใน Snip IT (แทน N/A)
+    _na_msg = "ไม่พบข้อมูลใน Snip IT"
+    return tuple(
+        _na_msg if (not value or str(value).strip() in ("", "N/A", "-")) else value
+        for value in (responsible, snipit_dept, snipit_division)
+    )
+
+def event_record(event, event_type, snipit_lookup):
+    """
+    แปลง event เป็น record สำหรับแสดงผลในรายงาน (ค่าที่ใช้แสดงใน card)
+    event_type: 'malicious' หรือ 'suspicious'
+    """
+    dt = bangkok_time(event)
+    
+    # Device & User Details
+    recorded_info = event.get('recorded_device_info') or {}
+    hostname = recorded_info.get('hostname', 'N/A')
+    responsible, snipit_dept, snipit_division = _snipit_display(snipit_lookup, hostname)
+    
+    return {
+        'event_type': event_type,
+        'event_id': event.get('id', 'N/A'),
+        'time_str': dt.strftime('%d/%m/%Y %H:%M:%S') if dt else 'N/A',
+        'action': event.get('action', 'N/A'),
+        'severity': event.get('threat_severity', 'N/A'),
+        'threat_type': event.get('threat_type', 'N/A'),
+        'description': event.get('description', 'N/A'),
+        'hostname': hostname,
+        'ip_address': recorded_info.get('ip_address', 'N/A'),
+        'msp_name': event.get('msp_name', 'N/A'),
+        'tenant_name': event.get('tenant_name', 'N/A'),
+        'responsible_display': responsible,
+        'snipit_dept_display': snipit_dept,
+        'snipit_division_display': snipit_division,
+        # Event Indicators
+        'filename': event.get('path', 'N/A'),
+        'file_hash': event.get('file_hash', event.get('container_hash', 'N/A')),
+    }
+
+def build_event_details_html(malicious_events, suspicious_events, output_file, snipit_lookup=None,
+                             layout=None):
+    """
+    สร้างไฟล์ HTML รายละเอียด Events (จับคู่ Snip IT แสดงผู้รับผิดชอบเครื่อง)
+    snipit_lookup: inventory ที่โหลดไว้แล้ว (ถ้าไม่ระบุจะดึงจาก Snip IT ตอนนี้)
+    layout: 'paged' (HTML + JSON shards) หรือ 'single' (default: REPORT_LAYOUT)
+    """
     
     now_bangkok = datetime.now(TZ_BANGKOK)
     date_str = now_bangkok.strftime('%d/%m/%Y %H:%M:%S')
     
-    all_events = malicious_events + suspicious_events
+    # ติดประเภทให้ event ตอนรวม list (ไม่ต้องค้นใน list ทีละ event)
+    tagged_events = [(e, "malicious") for e in malicious_events] + \
+                    [(e, "suspicious") for e in suspicious_events]
     # รวบรวม hostname ทั้งหมดจาก events เพื่อใช้ Search API สำหรับเครื่องที่ list ไม่มี (เช่น custom field Device Name)
     unique_hostnames = []
     seen_hn = set()
-    for event in all_events:
+    for event, _ in tagged_events:
         recorded_info = event.get("recorded_device_info") or {}
         hn = recorded_info.get("hostname")
         if hn and str(hn).strip() and str(hn).strip().lower() not in seen_hn:
             seen_hn.add(str(hn).strip().lower())
             unique_hostnames.append(hn)
     # ดึง mapping ชื่อเครื่อง -> ผู้รับผิดชอบ จาก Snip IT (list + search สำหรับ hostname ที่มีในรายงาน)
-    snipit_lookup = get_snipit_responsible_lookup(extra_search_hostnames=unique_hostnames)
+    if snipit_lookup is None:
+        snipit_lookup = get_snipit_responsible_lookup(extra_search_hostnames=unique_hostnames)
+    else:
+        snipit_lookup = resolve_snipit_hostnames(snipit_lookup, unique_hostnames)
     
-    all_events_sorted = sorted(
-        [e for e in all_events if e.get('_bangkok_time')],
-        key=lambda x: x['_bangkok_time'],
+    # เวลา parse ครั้งเดียวต่อ timestamp (cache ใน day_buckets) ไม่เขียนลง event
+    tagged_sorted = sorted(
+        [(e, t) for e, t in tagged_events if bangkok_time(e)],
+        key=lambda item: sort_key(item[0]),
         reverse=True
     )
+    records = (event_record(event, event_type, snipit_lookup) for event, event_type in tagged_sorted)
     
-    html = f"""<!DOCTYPE html>
-<html lang="th">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>รายละเอียด Events - Deep Instinct</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f5f5; padding: 20px; }}
-        .container {{ max-width: 1200px; margin: 0 auto; background: white; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-        .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 10px 10px 0 0; }}
-        .header h1 {{ font-size: 28px; margin-bottom: 10px; }}
-        .header p {{ opacity: 0.9; }}
-        .content {{ padding: 30px; }}
-        .event-card {{ background: #f9f9f9; border-left: 4px solid #667eea; padding: 20px; margin-bottom: 20px; border-radius: 5px; }}
-        .event-card.malicious {{ border-left-color: #e74c3c; }}
-        .event-card.suspicious {{ border-left-color: #f39c12; }}
-        .event-header {{ display: flex; justify-content: space-between; align-items: center; margin-bottom: 15px; padding-bottom: 10px; border-bottom: 2px solid #e0e0e0; }}
-        .event-id {{ font-size: 20px; font-weight: bold; color: #333; }}
-        .event-time {{ color: #666; font-size: 14px; }}
-        .section {{ margin-bottom: 20px; }}
-        .section-title {{ font-size: 16px; font-weight: bold; color: #667eea; margin-bottom: 10px; padding-bottom: 5px; border-bottom: 1px solid #e0e0e0; }}
-        .detail-row {{ display: grid; grid-template-columns: 200px 1fr; gap: 10px; padding: 8px 0; border-bottom: 1px solid #f0f0f0; }}
-        .detail-label {{ font-weight: 600; color: #555; }}
-        .detail-value {{ color: #333; word-break: break-all; }}
-        .badge {{ display: inline-block; padding: 4px 12px; border-radius: 20px; font-size: 12px; font-weight: bold; margin-right: 5px; }}
-        .badge.prevented {{ background: #e74c3c; color: white; }}
-        .badge.detected {{ background: #3498db; color: white; }}
-        .badge.severity-critical {{ background: #c0392b; color: white; }}
-        .badge.severity-very-high {{ background: #e74c3c; color: white; }}
-        .badge.severity-high {{ background: #e67e22; color: white; }}
-        .badge.severity-moderate {{ background: #f39c12; color: white; }}
-        .badge.severity-low {{ background: #27ae60; color: white; }}
-        .badge.severity-very-low {{ background: #95a5a6; color: white; }}
-        .hash {{ font-family: 'Courier New', monospace; font-size: 12px; background: #ecf0f1; padding: 5px; border-radius: 3px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🔒 รายละเอียด Security Events</h1>
-            <p>สร้างเมื่อ: {date_str} (GMT+7)</p>
-            <p>จำนวนทั้งหมด: {len(all_events_sorted)} events</p>
-        </div>
-        <div class="content">
-"""
-    
-    for event in all_events_sorted:
-        event_type = "malicious" if event in malicious_events else "suspicious"
-        event_id = event.get('id', 'N/A')
-        dt = event.get('_bangkok_time')
-        time_str = dt.strftime('%d/%m/%Y %H:%M:%S') if dt else 'N/A'
-        
-        action = event.get('action', 'N/A')
-        severity = event.get('threat_severity', 'N/A')
-        threat_type = event.get('threat_type', 'N/A')
-        description = event.get('description', 'N/A')
-        
-        # Device & User Details
-        recorded_info = event.get('recorded_device_info', {})
-        hostname = recorded_info.get('hostname', 'N/A')
-        ip_address = recorded_info.get('ip_address', 'N/A')
-        msp_name = event.get('msp_name', 'N/A')
-        tenant_name = event.get('tenant_name', 'N/A')
-        # จับคู่กับ Snip IT (ผู้รับผิดชอบ, แผนก, กอง)
-        if hostname and str(hostname) != 'N/A':
-            info = snipit_lookup.get(str(hostname).strip().lower())
-            if isinstance(info, dict):
-                responsible = info.get("responsible", "N/A")
-                snipit_dept = info.get("แผนก", "N/A")
-                snipit_division = info.get("กอง", "N/A")
-            else:
-                responsible = info if info else "N/A"
-                snipit_dept = snipit_division = "N/A"
-        else:
-            responsible = snipit_dept = snipit_division = 'N/A'
-        # แสดงข้อความเมื่อไม่พบข้อมูลใน Snip IT (แทน N/A)
-        _na_msg = "ไม่พบข้อมูลใน Snip IT"
-        responsible_display = _na_msg if (not responsible or str(responsible).strip() in ("", "N/A", "-")) else responsible
-        snipit_dept_display = _na_msg if (not snipit_dept or str(snipit_dept).strip() in ("", "N/A", "-")) else snipit_dept
-        snipit_division_display = _na_msg if (not snipit_division or str(snipit_division).strip() in ("", "N/A", "-")) else snipit_division
-        
-        # Event Indicators
-        filename = event.get('path', 'N/A')
-        file_hash = event.get('file_hash', event.get('container_hash', 'N/A'))
-        
-        # Badges
-        action_badge = f'<span class="badge {action.lower()}">{action}</span>'
-        severity_class = severity.lower().replace('_', '-')
-        severity_badge = f'<span class="badge severity-{severity_class}">{severity}</span>'
-        
-        html += f"""
-            <div class="event-card {event_type}">
-                <div class="event-header">
-                    <div class="event-id">Event ID: {event_id}</div>
-                    <div class="event-time">{time_str}</div>
-                </div>
-                
-                <div style="margin-bottom: 15px;">
-                    {action_badge}
-                    {severity_badge}
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">📋 ข้อมูลทั่วไป</div>
-                    <div class="detail-row">
-                        <div class="detail-label">Threat Type:</div>
-                        <div class="detail-value">{threat_type}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">Details:</div>
-                        <div class="detail-value">{description}</div>
-                    </div>
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">💻 Device & User Details</div>
-                    <div class="detail-row">
-                        <div class="detail-label">Device Name:</div>
-                        <div class="detail-value">{hostname}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">IP Address:</div>
-                        <div class="detail-value">{ip_address}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">MSP:</div>
-                        <div class="detail-value">{msp_name}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">Tenant:</div>
-                        <div class="detail-value">{tenant_name}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">ผู้รับผิดชอบ (Snip IT):</div>
-                        <div class="detail-value">{responsible_display}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">แผนก (Snip IT):</div>
-                        <div class="detail-value">{snipit_dept_display}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">กอง (Snip IT):</div>
-                        <div class="detail-value">{snipit_division_display}</div>
-                    </div>
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">🔍 Event Indicators</div>
-                    <div class="detail-row">
-                        <div class="detail-label">Filename:</div>
-                        <div class="detail-value">{filename}</div>
-                    </div>
-                    <div class="detail-row">
-                        <div class="detail-label">File Hash:</div>
-                        <div class="detail-value"><span class="hash">{file_hash}</span></div>
-                    </div>
-                </div>
-            </div>
-"""
-    
-    html += """
-        </div>
-    </div>
-</body>
-</html>
-"""
-    
-    # บันทึกไฟล์
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html)
-    
-    return output_file
+    if (layout or REPORT_LAYOUT) == 'single':
+        return write_single_report(records, output_file, date_str, len(tagged_sorted))
+    return write_paged_report(records, output_file, date_str)
 
-def build_mattermost_message(malicious_events, suspicious_events, details_url=None, report_date=None):
-    """สร้างข้อความสำหรับ Mattermost พร้อม Threat Severity"""
+def build_mattermost_message(malicious_events, suspicious_events, details_url=None, report_date=None,
+                             incomplete_streams=None):
+    """
+    สร้างข้อความสำหรับ Mattermost พร้อม Threat Severity
+    incomplete_streams: ชื่อ stream ที่ดึงข้อมูลไม่ครบ (จะแสดงคำเตือนในข้อความ)
+    """
     
     now_bangkok = datetime.now(TZ_BANGKOK)
     if report_date:
@@ -479,6 +629,10 @@ def build_mattermost_message(malicious_events, suspicious_events, details_url=No
     
     message += "\n---\n\n"
     
+    # แจ้งเตือนเมื่อดึงข้อมูลไม่ครบ (รันซ้ำเพื่อดึงต่อจาก checkpoint)
+    if incomplete_streams:
+        message += f"⚠️ **ข้อมูลอาจไม่ครบ:** ดึง {', '.join(incomplete_streams)} ไม่สำเร็จทั้งหมด\n\n"
+    
     # เพิ่ม link ไปยังรายละเอียด
     if details_url:
         message += f"📄 [ดูรายละเอียด Events ทั้งหมด]({details_url})\n"
@@ -497,7 +651,7 @@ def send_to_mattermost(message):
     }
     
     try:
-        response = requests.post(WEBHOOK_URL, json=payload, timeout=10)
+        response = http_transport.post(WEBHOOK_URL, json=payload)
         response.raise_for_status()
         return True
     except Exception as e:
@@ -533,26 +687,50 @@ def main():
         print("  🔒 Deep Instinct → Mattermost (Daily Report)")
         print("=" * 70)
     
-    # 1. ดึง Malicious Events
-    print("\n📥 Fetching Malicious Events...")
-    malicious = fetch_events_with_pagination('events', 17400)
-    malicious_filtered = filter_by_date(malicious, target_date or datetime.now(TZ_BANGKOK).date())
-    print(f"   ✅ Found {len(malicious_filtered)} malicious events")
-    
-    # 2. ดึง Suspicious Events
-    print("\n📥 Fetching Suspicious Events...")
-    suspicious = fetch_events_with_pagination('suspicious-events', 14400)
-    suspicious_filtered = filter_by_date(suspicious, target_date or datetime.now(TZ_BANGKOK).date())
-    print(f"   ✅ Found {len(suspicious_filtered)} suspicious events")
+    report_date = target_date or datetime.now(TZ_BANGKOK).date()
+    store = EventStore() if REPORT_SOURCE == 'store' else None
+    if store is not None:
+        print(f"\n📦 Using local event store: {store.path}")
+    
+    # 1-2. ดึง Malicious Events, Suspicious Events และ Snip IT inventory พร้อมกัน
+    # (เป็น I/O ที่ไม่ขึ้นต่อกัน จึงใช้เวลาเท่ากับขั้นตอนที่นานที่สุดแทนผลรวม)
+    print("\n📥 Fetching Malicious Events, Suspicious Events and Snip IT inventory...")
+    incomplete_streams = []
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        malicious_future = executor.submit(load_report_events, STREAM_EVENTS, report_date, store)
+        suspicious_future = executor.submit(load_report_events, STREAM_SUSPICIOUS, report_date, store)
+        snipit_future = executor.submit(load_snipit_inventory)
+        
+        malicious_filtered, complete = malicious_future.result()
+        if not complete:
+            incomplete_streams.append(STREAM_EVENTS)
+        print(f"   ✅ Found {len(malicious_filtered)} malicious events")
+        
+        suspicious_filtered, complete = suspicious_future.result()
+        if not complete:
+            incomplete_streams.append(STREAM_SUSPICIOUS)
+        print(f"   ✅ Found {len(suspicious_filtered)} suspicious events")
+        if store is not None:
+            store.close()
+        if incomplete_streams:
+            print(f"\n⚠️  Incomplete data for: {', '.join(incomplete_streams)} (re-run to resume)")
+        
+        # 3. สร้างไฟล์ HTML รายละเอียด (จับคู่ Snip IT แสดงผู้รับผิดชอบ) เก็บใน event_detail/
+        # รอ Snip IT inventory ตรงนี้ (ตอน render) เท่านั้น
+        snipit_lookup = snipit_future.result()
     
-    # 3. สร้างไฟล์ HTML รายละเอียด (จับคู่ Snip IT แสดงผู้รับผิดชอบ) เก็บใน event_detail/
     print("\n📄 Creating detailed HTML report...")
     os.makedirs(EVENT_DETAIL_DIR, exist_ok=True)
-    date_filename = (target_date or datetime.now(TZ_BANGKOK).date()).strftime('%Y-%m-%d')
+    date_filename = report_date.strftime('%Y-%m-%d')
     html_filename = f"event_details_{date_filename}.html"
     html_path = os.path.join(EVENT_DETAIL_DIR, html_filename)
     
-    build_event_details_html(malicious_filtered, suspicious_filtered, html_path)
+    # marker อยู่ตลอดระหว่างเขียนไฟล์ และคงไว้ถ้าข้อมูลยังไม่ครบ (re-run จะเขียนรายงานวันเดิมทับ)
+    # report server จึงไม่ส่ง Cache-Control immutable ให้รายงานที่ยังจะเปลี่ยนอีก
+    mark_report_incomplete(html_path)
+    build_event_details_html(malicious_filtered, suspicious_filtered, html_path, snipit_lookup)
+    if not incomplete_streams:
+        mark_report_incomplete(html_path, False)
     print(f"   ✅ Created: event_detail/{html_filename}")
     if IT_PARCEL_API_URL and IT_PARCEL_TOKEN:
         print(f"   📌 จับคู่ผู้รับผิดชอบจาก Snip IT (IT Parcel) แล้ว")
@@ -563,8 +741,8 @@ def main():
     
     # 4. สร้างข้อความ Mattermost
     print("\n📝 Building Mattermost message...")
-    report_date = target_date or datetime.now(TZ_BANGKOK).date()
-    message = build_mattermost_message(malicious_filtered, suspicious_filtered, details_url, report_date)
+    message = build_mattermost_message(malicious_filtered, suspicious_filtered, details_url, report_date,
+                                       incomplete_streams)
     
     # 5. แสดงตัวอย่าง
     print("\n" + "=" * 70)
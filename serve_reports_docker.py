@@ -4,26 +4,20 @@ Simple HTTP Server for serving event detail reports (Docker version)
 รัน server เพื่อให้ Mattermost เข้าถึงไฟล์ HTML reports ได้
 """
 
-import http.server
-import socketserver
 import os
 import sys
 
+from report_http import ReportHTTPServer, ReportRequestHandler
+
 # Configuration - use /app for Docker
 PORT = int(os.getenv('REPORT_SERVER_PORT', '8080'))
 DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '')
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+class MyHTTPRequestHandler(ReportRequestHandler):
+    # ส่งไฟล์ .gz/.br ที่สร้างไว้, ETag/304 และ cache รายงานวันที่ผ่านมาแบบ immutable (report_http.py)
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
     
-    def end_headers(self):
-        # เพิ่ม CORS headers
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        super().end_headers()
-    
     def log_message(self, format, *args):
         """Override to add timestamp"""
         sys.stdout.write("%s - [%s] %s\n" %
@@ -48,7 +42,8 @@ def main():
     os.chdir(DIRECTORY)
     
     # Bind to 0.0.0.0 เพื่อให้เข้าถึงได้จากเครื่องอื่น
-    with socketserver.TCPServer(("0.0.0.0", PORT), MyHTTPRequestHandler) as httpd:
+    # 1 thread ต่อ connection (client ที่ช้าไม่บล็อกคนอื่น) จำกัดด้วย REPORT_SERVER_MAX_CONNECTIONS
+    with ReportHTTPServer(("0.0.0.0", PORT), MyHTTPRequestHandler) as httpd:
         local_ip = get_local_ip()
         container_name = os.getenv('HOSTNAME', 'container')
         
@@ -58,6 +53,7 @@ def main():
         print(f"\n  📂 Serving directory: {DIRECTORY}")
         print(f"  🐳 Container: {container_name}")
         print(f"  🔗 Local URL: http://localhost:{PORT}")
+        print(f"  👥 Max connections: {httpd.max_connections}")
         print(f"  🔗 Network URL: http://{local_ip}:{PORT}")
         print(f"  🔗 Docker URL: http://report-server:{PORT}")
         print(f"\n  📄 Access reports at:")
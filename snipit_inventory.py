@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Snip IT (IT Parcel) Inventory - ดึงรายการ Hardware และเก็บ cache ลงดิสก์
+ใช้ร่วมกันระหว่างรายงานรายวัน (จับคู่ผู้รับผิดชอบเครื่อง) และ fetch_snipit_devices.py
+
+- cache มีอายุ (TTL) ถ้ายังไม่หมดอายุใช้จากไฟล์ได้ทันทีโดยไม่เรียก API
+- หมดอายุแล้ว refresh แบบ incremental: ดึงเฉพาะ assets ที่ updated_at ใหม่กว่าใน cache
+  (เรียง updated_at จากใหม่ไปเก่า แล้วหยุดเมื่อเจอ asset ที่เก่ากว่า)
+- ถ้าจำนวน assets (total) ไม่ตรงกับ cache หรือครบรอบ full refresh จะดึงใหม่ทั้งหมด (รองรับ asset ที่ถูกลบ)
+- ถ้า IT Parcel ล่ม ใช้ข้อมูลเก่าใน cache ต่อ
+
+Environment (optional):
+    SNIPIT_CACHE_PATH     path ของไฟล์ cache (default: STATE_DIR/snipit_inventory.json)
+    SNIPIT_CACHE_TTL      อายุ cache เป็นวินาที (default: 3600)
+    SNIPIT_FULL_REFRESH   ดึงใหม่ทั้งหมดทุกกี่วินาที (default: 86400)
+    SNIPIT_CRAWL_WORKERS  จำนวนหน้าที่ดึงพร้อมกันตอนดึงทั้งหมด (default: 8)
+    SNIPIT_SEARCH_WORKERS จำนวน hostname ที่ค้นหาพร้อมกัน (default: 8)
+    SNIPIT_SEARCH_HIT_TTL / SNIPIT_SEARCH_MISS_TTL
+                          อายุ cache ผลค้นหาที่พบ / ไม่พบ เป็นวินาที (default: 604800 / 86400)
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import http_transport
+from state_store import atomic_write_json, get_state_dir, load_json
+
+PAGE_LIMIT = 200
+
+
+def _rows_from_response(data) -> List[Dict]:
+    """ดึง rows จาก response ของ /hardware (รองรับทั้ง rows / data / list)"""
+    if isinstance(data, list):
+        return data
+    return data.get("rows") or data.get("data") or []
+
+
+def updated_at(row: Dict) -> str:
+    """เวลาแก้ไขล่าสุดของ asset (Snip IT ส่งเป็น {"datetime": ..., "formatted": ...})"""
+    value = row.get("updated_at")
+    if isinstance(value, dict):
+        value = value.get("datetime") or value.get("formatted")
+    return str(value) if value else ""
+
+
+def compact_row(row: Dict) -> Dict:
+    """เก็บเฉพาะ field ที่ใช้จับคู่เครื่อง/ผู้รับผิดชอบ เพื่อให้ไฟล์ cache เล็ก"""
+    assigned = row.get("assigned_to")
+    if isinstance(assigned, dict):
+        assigned = {k: assigned.get(k) for k in ("id", "name", "username", "display_name") if assigned.get(k)}
+    custom_fields = {}
+    cf = row.get("custom_fields") or {}
+    if isinstance(cf, dict):
+        for field_name, field_data in cf.items():
+            if isinstance(field_data, dict):
+                if field_data.get("value"):
+                    custom_fields[field_name] = {"value": field_data.get("value")}
+            elif isinstance(field_data, (str, int, float)) and str(field_data).strip():
+                custom_fields[field_name] = field_data
+    compact = {k: row.get(k) for k in ("id", "name", "asset_tag", "hostname", "device_name", "serial")
+               if row.get(k) not in (None, "")}
+    compact["assigned_to"] = assigned
+    compact["custom_fields"] = custom_fields
+    compact["updated_at"] = updated_at(row)
+    return compact
+
+
+class SnipitClient:
+    """Client สำหรับ /hardware ของ Snip IT (IT Parcel)"""
+
+    def __init__(self, base_url: str, token: str):
+        self.url = f"{base_url.rstrip('/')}/hardware"
+        self.headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+
+    def fetch_page(self, offset: int = 0, limit: int = PAGE_LIMIT, **params):
+        """
+        ดึง hardware 1 หน้า
+
+        Returns:
+            Tuple (rows, total) โดย total อาจเป็น None ถ้า API ไม่ส่งมา
+        """
+        query = {"limit": limit, "offset": offset}
+        query.update(params)
+        r = http_transport.get(self.url, headers=self.headers, params=query)
+        r.raise_for_status()
+        data = r.json()
+        total = data.get("total") if isinstance(data, dict) else None
+        return _rows_from_response(data), total
+
+    def iter_pages_parallel(self, workers: Optional[int] = None, limit: int = PAGE_LIMIT):
+        """
+        Generator ดึง hardware ทั้งหมดทีละหน้า (เรียงตาม offset) โดยดึงหลายหน้าพร้อมกัน
+
+        ใช้ total จากหน้าแรกวางแผน offset ของหน้าที่เหลือทั้งหมด แล้วดึงพร้อมกันผ่าน worker pool
+        หน้าแรกได้ทันทีโดยไม่ต้องรอหน้าอื่น ถ้า API ไม่ส่ง total จะดึงทีละหน้าตามเดิม
+        """
+        first, total = self.fetch_page(0, limit)
+        if not first:
+            return
+        yield first
+        if total is None:
+            if len(first) < limit:
+                return
+            offset = len(first)
+            while True:
+                page, _ = self.fetch_page(offset, limit)
+                if page:
+                    yield page
+                if len(page) < limit:
+                    return
+                offset += len(page)
+
+        # server อาจจำกัด limit ต่ำกว่าที่ขอ จึงใช้ขนาดหน้าแรกเป็นระยะของ offset
+        step = len(first)
+        offsets = range(step, total, step)
+        if not offsets:
+            return
+        workers = workers or int(os.getenv('SNIPIT_CRAWL_WORKERS', '8'))
+        with ThreadPoolExecutor(max_workers=min(workers, len(offsets))) as executor:
+            for page, _ in executor.map(lambda offset: self.fetch_page(offset, step), offsets):
+                yield page
+
+    def fetch_all(self, workers: Optional[int] = None) -> List[Dict]:
+        """ดึง hardware ทั้งหมด (ดึงหลายหน้าพร้อมกัน ลำดับ rows เรียงตาม offset)"""
+        rows = []
+        for page in self.iter_pages_parallel(workers):
+            rows.extend(page)
+        return rows
+
+    def search(self, keyword: str, limit: int = 5) -> List[Dict]:
+        """ค้นหา hardware ด้วย Search API (รองรับ custom field เช่น Device Name)"""
+        r = http_transport.get(self.url, headers=self.headers,
+                               params={"search": keyword, "limit": limit})
+        r.raise_for_status()
+        return _rows_from_response(r.json())
+
+
+class InventoryCache:
+    """Cache รายการ Hardware ของ Snip IT บนดิสก์ พร้อม TTL และ incremental refresh"""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 full_refresh: Optional[float] = None):
+        self.path = path or os.getenv('SNIPIT_CACHE_PATH') or os.path.join(get_state_dir(), 'snipit_inventory.json')
+        self.ttl = float(os.getenv('SNIPIT_CACHE_TTL', '3600')) if ttl is None else ttl
+        self.full_refresh = (float(os.getenv('SNIPIT_FULL_REFRESH', '86400'))
+                             if full_refresh is None else full_refresh)
+
+    def _load(self) -> Dict:
+        data = load_json(self.path, default=None)
+        if not isinstance(data, dict) or not isinstance(data.get("rows"), dict):
+            return {}
+        return data
+
+    def _save(self, rows: Dict[str, Dict], full_at: float) -> Dict:
+        data = {
+            "fetched_at": time.time(),
+            "full_at": full_at,
+            "max_updated_at": max((r.get("updated_at") or "" for r in rows.values()), default=""),
+            "rows": rows,
+        }
+        try:
+            atomic_write_json(self.path, data)
+        except OSError as e:
+            print(f"⚠️  Cannot save Snip IT cache: {e}")
+        return data
+
+    def load_cached(self) -> List[Dict]:
+        """คืนค่า rows ใน cache ตามที่มี (ไม่เรียก API ไม่สนใจ TTL)"""
+        return list(self._load().get("rows", {}).values())
+
+    def _full_crawl(self, client: SnipitClient) -> Dict:
+        rows = {str(row.get("id", i)): compact_row(row) for i, row in enumerate(client.fetch_all())}
+        return self._save(rows, time.time())
+
+    def _incremental(self, client: SnipitClient, cached: Dict) -> Dict:
+        """ดึงเฉพาะ assets ที่แก้ไขหลัง max_updated_at ของ cache"""
+        rows = dict(cached["rows"])
+        since = cached.get("max_updated_at") or ""
+        offset = 0
+        total = None
+        while True:
+            page, page_total = client.fetch_page(offset, PAGE_LIMIT, sort="updated_at", order="desc")
+            if total is None:
+                total = page_total
+            older_seen = False
+            for row in page:
+                if updated_at(row) < since:
+                    older_seen = True
+                    break
+                rows[str(row.get("id"))] = compact_row(row)
+            if older_seen or len(page) < PAGE_LIMIT:
+                break
+            offset += PAGE_LIMIT
+        # จำนวน assets ไม่ตรง = มี asset ถูกลบ/ข้อมูลไม่ครบ -> ดึงใหม่ทั้งหมด
+        if total is not None and total != len(rows):
+            return self._full_crawl(client)
+        return self._save(rows, cached.get("full_at") or 0)
+
+    def load_rows(self, client: Optional[SnipitClient]) -> List[Dict]:
+        """
+        คืนค่า rows ของ hardware ทั้งหมด (จาก cache ถ้ายังไม่หมดอายุ)
+
+        Args:
+            client: SnipitClient (None = ใช้ cache อย่างเดียว)
+
+        Returns:
+            List ของ rows (compact) ว่างถ้าไม่มี cache และดึงไม่สำเร็จ
+        """
+        cached = self._load()
+        now = time.time()
+        if client is None or (cached and now - cached.get("fetched_at", 0) < self.ttl):
+            return list(cached.get("rows", {}).values())
+        try:
+            if cached and now - (cached.get("full_at") or 0) < self.full_refresh:
+                data = self._incremental(client, cached)
+            else:
+                data = self._full_crawl(client)
+        except Exception as e:
+            if cached:
+                age_min = (now - cached.get("fetched_at", 0)) / 60
+                print(f"⚠️  Snip IT unavailable ({e}), using cached inventory ({age_min:.0f} min old)")
+                return list(cached["rows"].values())
+            print(f"⚠️  Snip IT unavailable: {e}")
+            return []
+        return list(data["rows"].values())
+
+
+class HostSearchCache:
+    """
+    Cache ผลการค้นหา hostname ด้วย Search API (ทั้งที่พบและไม่พบ)
+    แยก TTL ของ hit และ miss เพื่อไม่ต้องค้นเครื่องที่ไม่มีใน Snip IT ซ้ำทุกวัน
+    """
+
+    def __init__(self, path: Optional[str] = None, hit_ttl: Optional[float] = None,
+                 miss_ttl: Optional[float] = None):
+        self.path = path or os.getenv('SNIPIT_SEARCH_CACHE_PATH') or os.path.join(
+            get_state_dir(), 'snipit_search_cache.json')
+        self.hit_ttl = float(os.getenv('SNIPIT_SEARCH_HIT_TTL', '604800')) if hit_ttl is None else hit_ttl
+        self.miss_ttl = float(os.getenv('SNIPIT_SEARCH_MISS_TTL', '86400')) if miss_ttl is None else miss_ttl
+        self._entries = load_json(self.path, default={}) or {}
+
+    def get(self, key: str):
+        """
+        คืนค่า (found_in_cache, row) โดย row เป็น None ถ้าเคยค้นแล้วไม่พบ
+        """
+        entry = self._entries.get(key)
+        if not entry:
+            return False, None
+        ttl = self.hit_ttl if entry.get("row") else self.miss_ttl
+        if time.time() - entry.get("at", 0) >= ttl:
+            return False, None
+        return True, entry.get("row")
+
+    def put(self, key: str, row: Optional[Dict]):
+        self._entries[key] = {"row": row, "at": time.time()}
+
+    def save(self):
+        """บันทึก cache (ตัด entry ที่หมดอายุทิ้ง)"""
+        now = time.time()
+        self._entries = {
+            k: v for k, v in self._entries.items()
+            if now - v.get("at", 0) < (self.hit_ttl if v.get("row") else self.miss_ttl)
+        }
+        try:
+            atomic_write_json(self.path, self._entries)
+        except OSError as e:
+            print(f"⚠️  Cannot save Snip IT search cache: {e}")
+
+
+def search_hostnames(client: SnipitClient, hostnames, cache: Optional[HostSearchCache] = None,
+                     workers: Optional[int] = None) -> Dict[str, Optional[Dict]]:
+    """
+    ค้นหาหลาย hostname พร้อมกันผ่าน worker pool (ใช้ cache ทั้ง hit และ miss)
+
+    Args:
+        client: SnipitClient
+        hostnames: hostname ที่ต้องการค้นหา
+        cache: HostSearchCache (None = ไม่ใช้ cache)
+        workers: จำนวน request พร้อมกัน (default: SNIPIT_SEARCH_WORKERS หรือ 8)
+
+    Returns:
+        Dictionary hostname (ตัวพิมพ์เล็ก) -> row ที่พบ (compact) หรือ None ถ้าไม่พบ/ไม่ชัดเจน
+        hostname ที่ค้นไม่สำเร็จ (API error) จะไม่อยู่ในผลลัพธ์และไม่ถูก cache
+    """
+    results = {}
+    pending = set()
+    for hostname in hostnames:
+        key = str(hostname).strip().lower()
+        if not key or key in results or key in pending:
+            continue
+        if cache is not None:
+            cached, row = cache.get(key)
+            if cached:
+                results[key] = row
+                continue
+        pending.add(key)
+
+    def _search(key):
+        rows = client.search(key)
+        # พบเพียง 1 รายการเท่านั้นจึงถือว่าจับคู่ได้
+        return compact_row(rows[0]) if len(rows) == 1 else None
+
+    if pending:
+        workers = workers or int(os.getenv('SNIPIT_SEARCH_WORKERS', '8'))
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {key: executor.submit(_search, key) for key in pending}
+            for key, future in futures.items():
+                try:
+                    row = future.result()
+                except Exception:
+                    continue
+                results[key] = row
+                if cache is not None:
+                    cache.put(key, row)
+        if cache is not None:
+            cache.save()
+    return results
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+State Store - เก็บสถานะของระบบ (cursor / checkpoint) ลงไฟล์แบบ crash-safe
+เขียนไฟล์ JSON แบบ atomic (เขียนไฟล์ชั่วคราว -> fsync -> os.replace)
+เพื่อไม่ให้ไฟล์เสียหายถ้า container ถูก kill ระหว่างเขียน
+"""
+
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+# โฟลเดอร์เก็บ state (Docker ตั้ง STATE_DIR=/app/state และ mount เป็น volume)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_state_dir() -> str:
+    """คืนค่าโฟลเดอร์เก็บ state (สร้างให้ถ้ายังไม่มี)"""
+    state_dir = os.getenv('STATE_DIR') or SCRIPT_DIR
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def load_json(path: str, default=None):
+    """
+    อ่านไฟล์ JSON
+
+    Args:
+        path: path ของไฟล์
+        default: ค่าที่คืนถ้าไม่มีไฟล์หรืออ่านไม่ได้
+
+    Returns:
+        ข้อมูลจากไฟล์ หรือ default
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Cannot read state file {path}: {e}")
+        return default
+
+
+def atomic_write_json(path: str, data) -> None:
+    """
+    เขียนไฟล์ JSON แบบ atomic
+
+    เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกัน, fsync แล้วค่อย os.replace ทับไฟล์เดิม
+    ผู้อ่านจะเห็นไฟล์เก่าหรือไฟล์ใหม่ครบทั้งไฟล์เท่านั้น ไม่มีไฟล์ที่เขียนค้างครึ่งทาง
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class CursorStore:
+    """
+    เก็บ cursor ของแต่ละ stream (เช่น last_event_id, last_suspicious_event_id)
+    ลงไฟล์ JSON รูปแบบเดียวกับ .last_event_id เดิม
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cursors: Optional[Dict[str, int]] = None
+
+    def load(self) -> Dict[str, int]:
+        """
+        อ่าน cursor ทั้งหมดจากไฟล์ (อ่านครั้งเดียวตอน startup แล้ว cache ไว้)
+
+        Returns:
+            Dictionary ชื่อ cursor -> event id (ว่างถ้ายังไม่เคยบันทึก)
+        """
+        with self._lock:
+            if self._cursors is None:
+                data = load_json(self.path, default={}) or {}
+                self._cursors = {
+                    key: int(value)
+                    for key, value in data.items()
+                    if key != 'updated_at' and isinstance(value, int)
+                }
+            return dict(self._cursors)
+
+    def get(self, name: str, default: int = 0) -> int:
+        """ดึงค่า cursor ตามชื่อ"""
+        return self.load().get(name, default)
+
+    def commit(self, **cursors: int) -> None:
+        """
+        บันทึก cursor ลงไฟล์ (เรียกหลังส่ง events สำเร็จแล้วเท่านั้น)
+
+        Args:
+            **cursors: ชื่อ cursor=event id เช่น commit(last_event_id=17729)
+        """
+        self.load()
+        with self._lock:
+            changed = {k: int(v) for k, v in cursors.items() if self._cursors.get(k) != v}
+            if not changed:
+                return
+            self._cursors.update(changed)
+            data = dict(self._cursors)
+            data['updated_at'] = datetime.now().isoformat()
+            atomic_write_json(self.path, data)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Tenant Monitor - โหมด monitor ที่แบ่ง tenants ให้หลาย worker processes (MONITOR_MODE=tenants)
+
+- แต่ละ tenant ดึง events ผ่าน /events/search และ /suspicious-events/search กรองด้วย tenant_id
+  และมี cursor ของตัวเอง (STATE_DIR/tenants/tenant-<id>.json)
+- tenants ถูกแบ่งให้ worker processes แบบ round-robin (การดึงข้อมูลขยายตามจำนวน CPU)
+- ในแต่ละรอบ worker ดึง tenant ละ 1 หน้าต่อ stream แล้ววนไป tenant ถัดไป
+  tenant ที่มี events มากจึงไม่แย่งเวลาของ tenant อื่น (ส่วนที่เหลือดึงต่อในรอบถัดไป)
+- หน้าของทุก tenant ในรอบถูกดึงพร้อมกันบน event loop เดียว (deepinstinct_async, DI_ASYNC)
+  แล้วจึงประมวลผล/ส่งทีละ tenant ตามลำดับ (ดึงไม่สำเร็จ = ดึงแบบ sync ตอนประมวลผล tenant นั้น)
+- worker บันทึก alerts ลง outbox ร่วมกัน และ process หลักเป็นผู้ส่งไปยัง Mattermost
+- worker ไม่เขียน local event store (events ถูกกรองตาม tenant) รายงานรายวัน sync store จาก stream รวมเอง
+  (จำกัดอัตราการส่งรวมที่ webhook เดียว)
+- process หลักคอยเริ่ม worker ใหม่เมื่อ worker หยุดทำงาน และแบ่ง tenants ใหม่เมื่อรายชื่อเปลี่ยน
+
+Environment (optional):
+    MONITOR_MODE      global (default, stream รวมของทุก tenant) / tenants
+    TENANT_WORKERS    จำนวน worker processes (default: จำนวน CPU)
+    TENANT_IDS        tenant IDs คั่นด้วย comma (default: ทุก tenant จาก /multitenancy/tenant/)
+    TENANT_REFRESH    วินาทีระหว่างการอ่านรายชื่อ tenants ใหม่ (default: 3600)
+"""
+
+import os
+import glob
+import time
+import multiprocessing
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from deepinstinct_to_mattermost import DeepInstinctClient, DeepInstinctMonitor, MattermostNotifier
+from event_aggregator import EventAggregator, merge_state_files
+from mattermost_delivery import DeliveryQueue, Outbox
+from poll_scheduler import PollScheduler
+from state_store import CursorStore, get_state_dir
+
+
+def _enabled(name: str) -> bool:
+    return os.getenv(name, 'on').lower() not in ('off', '0', 'false', 'no')
+
+
+class TenantClient:
+    """DeepInstinctClient ที่เห็นเฉพาะ events ของ tenant เดียว (ใช้ /search กรองด้วย tenant_id)"""
+
+    def __init__(self, client: DeepInstinctClient, tenant_id: int):
+        self.client = client
+        self.tenant_id = tenant_id
+        # หน้าที่ดึงไว้ล่วงหน้า: endpoint -> (after_event_id, events)
+        self._primed: Dict[str, Tuple[int, List[Dict]]] = {}
+
+    def prime(self, endpoint: str, after_event_id: int, events: List[Dict]):
+        """เก็บหน้าที่ดึงไว้ล่วงหน้า (ใช้เมื่อ monitor ขอหน้าต่อจาก after_event_id เดียวกัน)"""
+        self._primed[endpoint] = (after_event_id, events)
+
+    def _page(self, endpoint: str, after_event_id: int) -> List[Dict]:
+        primed = self._primed.pop(endpoint, None)
+        if primed is not None and primed[0] == after_event_id:
+            return primed[1]
+        return self.client.search_stream(endpoint, {'tenant_id': self.tenant_id}, after_event_id)
+
+    def get_events(self, after_event_id: int = 0, limit: int = 50) -> List[Dict]:
+        """ดึง Events ของ tenant ต่อจาก after_event_id"""
+        return self._page('/events', after_event_id)
+
+    def get_suspicious_events(self, after_event_id: int = 0) -> List[Dict]:
+        """ดึง Suspicious Events ของ tenant ต่อจาก after_event_id"""
+        return self._page('/suspicious-events', after_event_id)
+
+    def get_file_details(self, file_hash: str) -> Optional[Dict]:
+        """ข้อมูลไฟล์ตาม hash (cache ร่วมกับ client หลักของ worker)"""
+        return self.client.get_file_details(file_hash)
+
+    def prefetch_file_details(self, file_hashes) -> int:
+        """ดึงข้อมูลไฟล์ของหลาย hash พร้อมกันลง cache (ดู DeepInstinctClient.prefetch_file_details)"""
+        return self.client.prefetch_file_details(file_hashes)
+
+
+def prefetch_tenant_pages(di_client: DeepInstinctClient, monitors: Sequence[Tuple[int, DeepInstinctMonitor]]) -> int:
+    """
+    ดึงหน้าถัดไปของทุก tenant / stream ในรอบพร้อมกัน (async fan-out) แล้วเก็บไว้ใน TenantClient
+
+    Returns:
+        จำนวนหน้าที่ดึงสำเร็จ (0 ถ้าไม่มี fan-out: แต่ละ tenant ดึงแบบ sync ตามเดิม)
+    """
+    targets = []
+    for tenant_id, monitor in monitors:
+        targets.append((monitor.di_client, '/events', monitor.last_event_id))
+        targets.append((monitor.di_client, '/suspicious-events', monitor.last_suspicious_event_id))
+    results = di_client.search_streams([(endpoint, {'tenant_id': client.tenant_id}, after_id)
+                                        for client, endpoint, after_id in targets])
+    primed = 0
+    for (client, endpoint, after_id), events in zip(targets, results):
+        if events is not None:
+            client.prime(endpoint, after_id, events)
+            primed += 1
+    return primed
+
+
+def tenant_cursor_store(tenant_id: int, seed: Optional[Dict[str, int]] = None) -> CursorStore:
+    """
+    Cursor store ของ tenant (STATE_DIR/tenants/tenant-<id>.json)
+
+    Args:
+        tenant_id: Tenant ID
+        seed: cursor เริ่มต้นเมื่อ tenant ยังไม่มีไฟล์ (เช่น cursor ของโหมด global
+              เพื่อไม่ให้ส่ง history ทั้งหมดซ้ำเมื่อเปลี่ยนโหมด)
+    """
+    path = os.path.join(get_state_dir(), 'tenants', f'tenant-{tenant_id}.json')
+    store = CursorStore(path)
+    if seed and not os.path.exists(path):
+        store.commit(**seed)
+    return store
+
+
+def rollup_state_path(shard: int) -> str:
+    """ไฟล์ state ของกลุ่ม events ที่รอแจ้งของ shard (STATE_DIR/tenants/rollups-shard-<n>.json)"""
+    return os.path.join(get_state_dir(), 'tenants', f'rollups-shard-{shard}.json')
+
+
+def adopt_orphan_rollups(shards: int):
+    """ย้ายกลุ่มที่รอแจ้งของ shard ที่ไม่มีแล้ว (จำนวน worker ลดลง) ไปให้ shard 0"""
+    orphans = []
+    for path in glob.glob(os.path.join(get_state_dir(), 'tenants', 'rollups-shard-*.json')):
+        try:
+            shard = int(os.path.basename(path)[len('rollups-shard-'):-len('.json')])
+        except ValueError:
+            continue
+        if shard >= shards:
+            orphans.append(path)
+    merge_state_files(sorted(orphans), rollup_state_path(0))
+
+
+def tenant_ids_from_env() -> Optional[List[int]]:
+    """อ่าน TENANT_IDS (None ถ้าไม่ได้กำหนด)"""
+    value = os.getenv('TENANT_IDS')
+    if not value:
+        return None
+    return sorted({int(v) for v in value.split(',') if v.strip()})
+
+
+def list_tenant_ids(di_client: DeepInstinctClient) -> Optional[List[int]]:
+    """
+    รายชื่อ tenant IDs ที่ต้อง monitor (TENANT_IDS หรือจาก /multitenancy/tenant/)
+
+    Returns:
+        List ของ tenant IDs เรียงจากน้อยไปมาก หรือ None ถ้าอ่านรายชื่อไม่สำเร็จ
+    """
+    configured = tenant_ids_from_env()
+    if configured is not None:
+        return configured
+    tenants = di_client.get_tenants()
+    if tenants is None:
+        return None
+    return sorted({t['id'] for t in tenants if isinstance(t, dict) and t.get('id') is not None})
+
+
+def partition_tenants(tenant_ids: Sequence[int], shards: int) -> List[List[int]]:
+    """
+    แบ่ง tenants เป็น shards แบบ round-robin (ไม่มี shard ว่าง)
+
+    Returns:
+        List ของ tenant IDs ของแต่ละ shard
+    """
+    tenant_ids = sorted(tenant_ids)
+    shards = max(1, min(shards, len(tenant_ids)))
+    return [tenant_ids[i::shards] for i in range(shards)]
+
+
+def run_shard(shard: int, tenant_ids: List[int], di_url: str, di_token: str, mm_webhook: str,
+              seed_cursors: Optional[Dict[str, int]] = None, interval: Optional[float] = None):
+    """
+    Worker process: poll tenants ของ shard นี้วนไปเรื่อยๆ
+
+    Args:
+        shard: ลำดับของ shard (ใช้แสดงผล)
+        tenant_ids: tenants ของ shard นี้
+        di_url, di_token: Deep Instinct API
+        mm_webhook: Mattermost webhook (ใช้ส่งตรงเมื่อปิด outbox)
+        seed_cursors: cursor เริ่มต้นของ tenant ที่ยังไม่มีไฟล์ cursor
+        interval: คาบ polling (default: POLLING_INTERVAL)
+    """
+    di_client = DeepInstinctClient(di_url, di_token)
+    mm_notifier = MattermostNotifier(mm_webhook)
+    # ไม่เขียน local event store: หน้าของ worker ถูกกรองด้วย tenant_id ถ้าเขียนลง stream รวม
+    # last_id ของ store จะข้าม events ของ tenant อื่นที่ ID ต่ำกว่า และรายงานจะขาด events เหล่านั้น
+    # (รายงานรายวัน sync store จาก stream รวมเอง)
+    # บันทึกลง outbox ร่วมกันเท่านั้น process หลักเป็นผู้ส่ง (จึงไม่ start queue ใน worker)
+    delivery_queue = DeliveryQueue(Outbox(), mm_notifier.send_message) if _enabled('MM_OUTBOX') else None
+    aggregator = EventAggregator(state_path=rollup_state_path(shard))
+    monitors = [
+        (tenant_id, DeepInstinctMonitor(TenantClient(di_client, tenant_id), mm_notifier,
+                                        tenant_cursor_store(tenant_id, seed_cursors), None,
+                                        delivery_queue=delivery_queue, aggregator=aggregator))
+        for tenant_id in tenant_ids
+    ]
+    scheduler = PollScheduler.from_env(interval)
+    print(f"🧵 Shard {shard} (pid {os.getpid()}): tenants {', '.join(map(str, tenant_ids))}")
+
+    try:
+        while True:
+            scheduler.wait()
+            scheduler.start_cycle()
+            found = 0
+            try:
+                prefetch_tenant_pages(di_client, monitors)
+            except Exception as e:
+                print(f"⚠️  Shard {shard}: concurrent fetch failed, fetching tenants one by one: {e}")
+            # tenant ละ 1 หน้าต่อ stream ต่อรอบ: tenant ที่มี events มากไม่แย่งรอบของ tenant อื่น
+            for tenant_id, monitor in monitors:
+                print(f"\n🏢 Shard {shard} / Tenant {tenant_id}")
+                try:
+                    found += sum(monitor.check_new_events())
+                except Exception as e:
+                    print(f"❌ Tenant {tenant_id}: unexpected error: {e}")
+            delay = scheduler.end_cycle(found)
+            print(f"\n💤 Shard {shard}: sleeping for {delay:.0f} seconds "
+                  f"(cycle took {scheduler.last_cost:.1f}s, period {scheduler.period:g}s)...")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        di_client.close()
+
+
+class TenantSupervisor:
+    """process หลักของโหมด tenants: เริ่ม/เฝ้า/เริ่มใหม่ worker processes ของแต่ละ shard"""
+
+    def __init__(self, di_client: DeepInstinctClient, di_url: str, di_token: str, mm_webhook: str,
+                 seed_cursors: Optional[Dict[str, int]] = None, interval: Optional[float] = None,
+                 workers: Optional[int] = None):
+        self.di_client = di_client
+        self.worker_args = (di_url, di_token, mm_webhook, seed_cursors or {}, interval)
+        self.workers = workers or int(os.getenv('TENANT_WORKERS') or os.cpu_count() or 1)
+        self.refresh = float(os.getenv('TENANT_REFRESH', '3600'))
+        # spawn: worker เริ่มจาก interpreter ใหม่ ไม่รับ threads / connections ของ process หลัก
+        self._context = multiprocessing.get_context('spawn')
+        self.tenant_ids: List[int] = []
+        self.shards: List[List[int]] = []
+        self.processes: List[multiprocessing.Process] = []
+
+    def _spawn(self, shard: int) -> multiprocessing.Process:
+        process = self._context.Process(target=run_shard, args=(shard, self.shards[shard]) + self.worker_args,
+                                        name=f'tenant-shard-{shard}', daemon=True)
+        process.start()
+        return process
+
+    def start(self, tenant_ids: List[int]):
+        """แบ่ง tenants และเริ่ม worker ของทุก shard"""
+        self.tenant_ids = list(tenant_ids)
+        self.shards = partition_tenants(self.tenant_ids, self.workers)
+        # worker เดิมหยุดแล้ว: ย้าย state ของ shard ที่ถูกยุบก่อนเริ่ม worker ชุดใหม่
+        adopt_orphan_rollups(len(self.shards))
+        print(f"🏢 Monitoring {len(self.tenant_ids)} tenant(s) with {len(self.shards)} worker process(es)")
+        self.processes = [self._spawn(i) for i in range(len(self.shards))]
+
+    def stop(self, timeout: float = 10):
+        """หยุด worker ทั้งหมด"""
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout)
+        self.processes = []
+
+    def check(self):
+        """เริ่ม worker ใหม่แทน worker ที่หยุดทำงาน"""
+        for shard, process in enumerate(self.processes):
+            if not process.is_alive():
+                print(f"⚠️  Shard {shard} worker exited (code {process.exitcode}), restarting...")
+                self.processes[shard] = self._spawn(shard)
+
+    def run(self):
+        """รันจนกว่าจะถูกหยุด (Ctrl+C)"""
+        try:
+            while True:
+                tenant_ids = list_tenant_ids(self.di_client)
+                if not tenant_ids and not self.tenant_ids:
+                    print("⚠️  No tenants found (check TENANT_IDS or API permissions), retrying in 60 seconds...")
+                    time.sleep(60)
+                    continue
+                # อ่านรายชื่อไม่สำเร็จ: ใช้รายชื่อเดิมต่อ
+                if tenant_ids and tenant_ids != self.tenant_ids:
+                    if self.processes:
+                        print("🔄 Tenant list changed, re-partitioning workers...")
+                        self.stop()
+                    self.start(tenant_ids)
+
+                deadline = time.monotonic() + self.refresh
+                while time.monotonic() < deadline:
+                    time.sleep(min(5.0, max(deadline - time.monotonic(), 0)))
+                    self.check()
+        except KeyboardInterrupt:
+            print("\n\n👋 Stopping tenant workers... Goodbye!")
+        finally:
+            self.stop()